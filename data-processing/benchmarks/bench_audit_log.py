@@ -0,0 +1,152 @@
+"""
+Compares the dictionary-coded audit log with the original row-of-strings log.
+
+Runs the extractors over synthetic users twice. The first run keeps the audit
+the original way: a full string row per entry, duplicate subscriptions found
+by filtering the table once per duplicated user, and summary stats computed
+by filtering the finished frame. The second uses `AuditLog`, a single
+counting pass for duplicates, the running counters, and the chunked CSV
+writer. For each it reports the Python memory the audit rows hold after
+extraction (tracemalloc, with the output tables dropped), the time of the
+duplicate check, and the time to compute the summary and write the CSV. It
+also checks that both produce the same CSV. `--sample N` also reports the
+size of the file with one in N users' `Processed` rows written.
+
+Usage (from data-processing/):
+    python benchmarks/bench_audit_log.py --users 20000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+import pandas as pd  # noqa: E402
+
+from synthetic import format_auth_row, generate_users  # noqa: E402
+from audit_log import AUDIT_COLUMNS, AuditLog  # noqa: E402
+from extractors import SubscriptionsExtractor, UserProfilesExtractor, MyGymExtractor, dispatch_user  # noqa: E402
+from table_builder import TableBuilder  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+
+class PlainAuditLog(TableBuilder):
+    """The original layout: one row of strings per audit entry."""
+
+    def __init__(self):
+        super().__init__(AUDIT_COLUMNS)
+
+    def log(self, user_id, section, action, reason, details):
+        self.append([user_id, section, action, reason, details])
+
+
+def plain_finish(self):
+    """The original duplicate check, which filters the table once per duplicated user."""
+    subscriptions = self.table.to_frame()
+    dup_subs = subscriptions[subscriptions.duplicated('user_id', keep=False)]
+    if not dup_subs.empty:
+        for user_id in dup_subs['user_id'].unique():
+            self.log(user_id, 'Flagged', 'Duplicate user ID', f"Found {len(dup_subs[dup_subs['user_id'] == user_id])} entries")
+
+
+def extract(users, user_store, compact):
+    extractors = [SubscriptionsExtractor(), UserProfilesExtractor(), MyGymExtractor(user_store)]
+    if not compact:
+        for extractor in extractors:
+            extractor.audit = PlainAuditLog()
+        extractors[0].finish = types.MethodType(plain_finish, extractors[0])
+    for user_id, record, _ in users:
+        dispatch_user(user_id, record, extractors)
+    return extractors
+
+
+def summary_rows(removed_users, flagged_issues):
+    return [['SUMMARY', 'Summary', 'Summary Stat', 'Total Users Removed', str(removed_users)],
+            ['SUMMARY', 'Summary', 'Summary Stat', 'Total Flagged Issues', str(flagged_issues)]]
+
+
+def write_plain(extractors, path):
+    audit_log = TableBuilder(AUDIT_COLUMNS)
+    for extractor in extractors:
+        audit_log.merge(extractor.audit)
+    audit_frame = audit_log.to_frame()
+    removed_users = audit_frame[audit_frame['action'] == 'Skipped']['user_id'].nunique()
+    flagged_issues = audit_frame[audit_frame['action'] == 'Flagged'].shape[0]
+    audit_log.extend(summary_rows(removed_users, flagged_issues))
+    audit_log.to_frame().to_csv(path, index=False)
+
+
+def write_compact(extractors, path, sample=1):
+    audit_log = AuditLog(path, sample=sample)
+    for extractor in extractors:
+        audit_log.merge(extractor.audit)
+    audit_log.extend(summary_rows(len(audit_log.skipped_users), audit_log.action_count('Flagged')))
+    audit_log.close()
+    return audit_log
+
+
+def measure(users, num_users, seed, user_store, compact, path):
+    # Held memory, measured while streaming so raw values count only if the audit keeps them alive
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    extractors = extract(generate_users(num_users, seed), user_store, compact)
+    for extractor in extractors:
+        extractor.table = TableBuilder(extractor.columns)  # Same in both layouts; only the audit is compared
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    extractors = extract(users, user_store, compact)
+    start = time.perf_counter()
+    for extractor in extractors:
+        extractor.finish()
+    finish_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    (write_compact if compact else write_plain)(extractors, path)
+    write_seconds = time.perf_counter() - start
+    return {'held': held, 'finish': finish_seconds, 'write': write_seconds, 'bytes': os.path.getsize(path)}, extractors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample', type=int, default=10, help="Also write the log keeping one in N users' Processed rows")
+    args = parser.parse_args()
+
+    users = list(generate_users(args.users, args.seed))
+    auth_rows = [format_auth_row(auth_row) for _, _, auth_row in users]
+    auth_data = pd.DataFrame([row for row in auth_rows if row is not None],
+                             columns=['user_id', 'email', 'creation_date', 'last_sign_in'])
+    user_store = UserStore(auth_data)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path, compact_path, sampled_path = (os.path.join(tmp, name) for name in ('plain.csv', 'compact.csv', 'sampled.csv'))
+        plain, _ = measure(users, args.users, args.seed, user_store, False, plain_path)
+        compact, extractors = measure(users, args.users, args.seed, user_store, True, compact_path)
+        with open(plain_path) as plain_file, open(compact_path) as compact_file:
+            identical = plain_file.read() == compact_file.read()
+        sampled_log = write_compact(extractors, sampled_path, args.sample)
+        sampled_bytes = os.path.getsize(sampled_path)
+
+    print(f"\n{args.users:,} users, {sampled_log.logged:,} audit rows")
+    print(f"{'layout':>8} {'held B/row':>11} {'dup check s':>12} {'summary+write s':>16}")
+    for name, result in [('plain', plain), ('compact', compact)]:
+        print(f"{name:>8} {result['held'] / sampled_log.logged:>11.0f} {result['finish']:>12.2f} {result['write']:>16.2f}")
+    print(f"Held memory: {plain['held'] / compact['held']:.1f}x less; "
+          f"duplicate check: {plain['finish'] / compact['finish']:.0f}x faster")
+    print(f"Sampled 1 in {args.sample}: {sampled_log.written:,} rows, {sampled_bytes / 1e6:.1f} MB "
+          f"vs {compact['bytes'] / 1e6:.1f} MB")
+    print(f"Identical CSVs: {identical}")
+
+
+if __name__ == '__main__':
+    main()
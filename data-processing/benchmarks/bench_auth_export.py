@@ -0,0 +1,92 @@
+"""
+Benchmarks the streaming Auth export against the original whole-frame export.
+
+The original built the DataFrame with `df.loc[len(df)] = [...]` for every
+user, filtered fake emails and converted timestamps over the whole frame, and
+wrote the CSV once at the end. Both versions run against `FakeAuth` with no
+latency, so only the local work is timed, and the two CSVs are compared
+byte-for-byte.
+
+Usage (from data-processing/):
+    python benchmarks/bench_auth_export.py --users 100000
+"""
+
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+import pandas as pd  # noqa: E402
+
+from fake_firebase import FakeAuth, Latency  # noqa: E402
+from synthetic import generate_users  # noqa: E402
+from fetch_auth_data import fetch_auth_data  # noqa: E402
+
+
+def legacy_fetch_auth_data(auth, file_path, batch_size=1000):
+    """The export as it was before streaming, kept here as the reference."""
+    page = auth.list_users(max_results=batch_size)
+    df = pd.DataFrame(columns=['user_id', 'email', 'creation_date', 'last_sign_in'])
+    while page:
+        for user in page.users:
+            df.loc[len(df)] = [
+                user.uid,
+                user.email,
+                user.user_metadata.creation_timestamp,
+                user.user_metadata.last_sign_in_timestamp
+            ]
+        page = page.get_next_page()
+    fake_emails = ['uatbuild.com', 'uat.com']
+    df['email'] = df['email'].astype(str)
+    for e in fake_emails:
+        mask = ~df['email'].str.endswith(e)
+        df = df[mask]
+    df.creation_date = pd.to_datetime(df.creation_date, unit='ms', origin='unix')
+    df.last_sign_in = pd.to_datetime(df.last_sign_in, unit='ms', origin='unix')
+    df.to_csv(file_path, index=False)
+
+
+def measure(export, auth, file_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        export(auth, file_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help="Only time the streaming export (the legacy one is quadratic)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    auth = FakeAuth([auth_row for _, _, auth_row in generate_users(args.users, args.seed)], Latency(0, 0))
+    print(f"{args.users:,} users")
+    print(f"{'export':<10} {'seconds':>9} {'peak MB (tracemalloc)':>22}")
+    with tempfile.TemporaryDirectory() as tmp:
+        streaming_path = os.path.join(tmp, 'streaming.csv')
+        elapsed, peak = measure(fetch_auth_data, auth, streaming_path)
+        print(f"{'streaming':<10} {elapsed:>9.2f} {peak:>22.1f}")
+        if not args.skip_legacy:
+            legacy_path = os.path.join(tmp, 'legacy.csv')
+            elapsed, peak = measure(legacy_fetch_auth_data, auth, legacy_path)
+            print(f"{'legacy':<10} {elapsed:>9.2f} {peak:>22.1f}")
+            print(f"Outputs identical: {filecmp.cmp(streaming_path, legacy_path, shallow=False)}")
+
+
+if __name__ == '__main__':
+    main()
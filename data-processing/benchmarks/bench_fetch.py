@@ -0,0 +1,81 @@
+"""
+Compares the fetch stage run one job after the other, the old way, with the
+concurrent version: both fetches at once, Auth pages prefetched and `/users`
+pulled in parallel key ranges.
+
+Runs against the latency-injecting fakes in `fake_firebase.py`, checks that
+both modes write the same files, and reports the wall-clock savings.
+
+Usage (from data-processing/):
+    python benchmarks/bench_fetch.py --users 20000 --round-trip 0.2 --per-user 0.00005
+"""
+
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+from fake_firebase import FakeAuth, FakeDb, Latency  # noqa: E402
+from synthetic import generate_users  # noqa: E402
+from fetch_auth_data import fetch_auth_data  # noqa: E402
+from fetch_firebase_data import DEFAULT_SHARDS, fetch_firebase_data  # noqa: E402
+
+
+def run_sequential(auth, db, out_dir):
+    start = time.perf_counter()
+    fetch_firebase_data(db, os.path.join(out_dir, 'users.json'), shards=1)
+    fetch_auth_data(auth, os.path.join(out_dir, 'auth.csv'), prefetch=False)
+    return time.perf_counter() - start
+
+
+def run_concurrent(auth, db, out_dir, shards):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        jobs = [
+            executor.submit(fetch_firebase_data, db, os.path.join(out_dir, 'users.json'), shards),
+            executor.submit(fetch_auth_data, auth, os.path.join(out_dir, 'auth.csv')),
+        ]
+        for job in jobs:
+            job.result()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    parser.add_argument('--round-trip', type=float, default=0.2, help="Seconds per request")
+    parser.add_argument('--per-user', type=float, default=0.00005, help="Transfer seconds per user record")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    users, auth_rows = {}, []
+    for user_id, record, auth_row in generate_users(args.users, args.seed):
+        users[user_id] = record
+        auth_rows.append(auth_row)
+    latency = Latency(args.round_trip, args.per_user)
+    auth, db = FakeAuth(auth_rows, latency), FakeDb(users, latency)
+
+    with tempfile.TemporaryDirectory() as sequential_dir, tempfile.TemporaryDirectory() as concurrent_dir:
+        sequential = run_sequential(auth, db, sequential_dir)
+        concurrent = run_concurrent(auth, db, concurrent_dir, args.shards)
+        identical = all(
+            filecmp.cmp(os.path.join(sequential_dir, name), os.path.join(concurrent_dir, name), shallow=False)
+            for name in ['users.json', 'auth.csv']
+        )
+
+    print(f"\n{args.users:,} users, {args.round_trip}s round trip, {args.per_user * 1000:.3f} ms/user, {args.shards} shards")
+    print(f"Sequential: {sequential:.2f}s")
+    print(f"Concurrent: {concurrent:.2f}s")
+    print(f"Saved:      {sequential - concurrent:.2f}s ({1 - concurrent / sequential:.0%}), outputs identical: {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Times `process_raw_to_csv.py --incremental` against a plain run.
+
+Writes a synthetic snapshot into a `SnapshotStore` and processes it with
+`--full` to build the incremental state. A second day is then stored with
+`--churn` of the users changed, as `fetch_firebase_data.py` would store it,
+and processed four ways: a plain run, `--full`, and `--incremental` against
+the first day's state (only the changed users are extracted). The last is
+`--incremental` run again on the same day, where nothing changed. Each run
+starts a fresh interpreter, as the pipeline is run from the command line.
+Whole runs and their `extract` span are reported, and the CSVs of every
+variant are compared byte for byte with the plain run's.
+
+Usage (from data-processing/):
+    python benchmarks/bench_incremental.py --users 50000 --churn 0.01
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(BENCH_DIR, '..', 'scripts', 'process_raw_to_csv.py')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+from synthetic import write_snapshot  # noqa: E402
+from snapshot_store import SnapshotStore  # noqa: E402
+
+STATE_FILE = 'data/processed/.incremental_state.pkl'
+
+
+def timed(root, *argv):
+    """Run one processing pass; returns its wall time and its `extract` span."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, SCRIPT, '--log-level', 'ERROR', *argv], cwd=root, check=True,
+                   stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    with open(os.path.join(root, 'data', 'processed', 'metrics.json')) as f:
+        return seconds, json.load(f)['spans']['extract']['seconds']
+
+
+def next_day(store, snapshot_date, churn, seed):
+    """Store `snapshot_date` with `churn` of the latest snapshot's users changed."""
+    users = dict(store.iter_users())
+    for user_id in random.Random(seed).sample(sorted(users), int(len(users) * churn)):
+        record = users[user_id]
+        if isinstance(record.get('userInfo'), dict):
+            record['userInfo']['lastOpened'] = snapshot_date
+        else:
+            record['lastOpened'] = snapshot_date
+    return store.write(snapshot_date, users.items())
+
+
+def csvs(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.csv'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--churn', type=float, default=0.01, help="Share of users changed on the second day")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per variant; the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        json_path, auth_path = write_snapshot(root, args.users, seed=args.seed)
+        store = SnapshotStore(os.path.join(root, 'data', 'raw', 'store'))
+        with open(json_path) as f:
+            store.write('2024-01-01', json.load(f).items())
+        os.remove(json_path)
+        shutil.copy(auth_path, os.path.join(os.path.dirname(auth_path), '2024-01-02.csv'))
+        stats = next_day(store, '2024-01-02', args.churn, args.seed)
+        processed = os.path.join(root, 'data', 'processed')
+        os.makedirs(processed)
+        state_path = os.path.join(root, STATE_FILE)
+
+        timed(root, '--full', '--snapshot', '2024-01-01')
+        shutil.copy(state_path, os.path.join(root, 'day1_state.pkl'))
+        variants = {
+            'plain': ['--snapshot', '2024-01-02'],
+            '--full': ['--full', '--snapshot', '2024-01-02'],
+            '--incremental': ['--incremental', '--snapshot', '2024-01-02'],
+            '--incremental, no change': ['--incremental', '--snapshot', '2024-01-02'],
+        }
+        results = {}
+        identical = True
+        for name, argv in variants.items():
+            best = None
+            for _ in range(args.repeat):
+                if name == '--incremental':
+                    shutil.copy(os.path.join(root, 'day1_state.pkl'), state_path)
+                elif name == '--incremental, no change':
+                    shutil.copy(os.path.join(root, 'day2_state.pkl'), state_path)
+                result = timed(root, *argv)
+                best = result if best is None or result < best else best
+            if name == 'plain':
+                shutil.copytree(processed, os.path.join(root, 'plain'))
+            else:
+                _, mismatch, errors = filecmp.cmpfiles(os.path.join(root, 'plain'), processed, csvs(processed),
+                                                       shallow=False)
+                identical = identical and not mismatch and not errors
+            if name == '--incremental':
+                shutil.copy(state_path, os.path.join(root, 'day2_state.pkl'))
+            results[name] = best
+        state_mb = os.path.getsize(state_path) / 1e6
+
+    print(f"{args.users:,} users, {args.churn:.1%} changed: {stats['new_shards']} of {stats['shards']} shards new")
+    print(f"{'':>24} {'run s':>8} {'extract s':>10}")
+    for name, (seconds, extract_seconds) in results.items():
+        print(f"{name:>24} {seconds:>8.2f} {extract_seconds:>10.2f}")
+    print(f"State file: {state_mb:.1f} MB")
+    print(f"Identical CSVs: {identical}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures how sharded extraction scales with the number of worker processes.
+
+Generates a synthetic snapshot, runs the fused extraction serially and then
+with each worker count, checks that every run produces the same tables as the
+serial one, and reports wall-clock time and speedup.
+
+Usage (from data-processing/):
+    python benchmarks/bench_parallel_scaling.py --users 200000 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+import pandas as pd  # noqa: E402
+
+from synthetic import write_snapshot  # noqa: E402
+from user_store import UserStore  # noqa: E402
+from extractors import SubscriptionsExtractor, UserProfilesExtractor, MyGymExtractor, run_extractors  # noqa: E402
+from parallel import DEFAULT_SHARD_SIZE, run_parallel  # noqa: E402
+
+
+def extract(data, user_store, workers, shard_size):
+    extractors = [SubscriptionsExtractor(), UserProfilesExtractor(), MyGymExtractor(user_store)]
+    start = time.perf_counter()
+    if workers == 1:
+        run_extractors(data.items(), extractors)
+    else:
+        run_parallel(data.items(), extractors, workers, shard_size)
+    elapsed = time.perf_counter() - start
+    # Compare on the CSV text, which is what the pipeline writes
+    outputs = [extractor.to_frame().to_csv(index=False) + extractor.audit.to_frame().to_csv(index=False)
+               for extractor in extractors]
+    return elapsed, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path, auth_path = write_snapshot(tmp, args.users, seed=args.seed)
+        with open(json_path) as f:
+            data = json.load(f)
+        auth_data = pd.read_csv(auth_path)
+
+    user_store = UserStore(auth_data)
+    results = []
+    serial_time, serial_outputs = extract(data, user_store, 1, args.shard_size)
+    for workers in args.workers:
+        if workers == 1:
+            elapsed, outputs = serial_time, serial_outputs
+        else:
+            elapsed, outputs = extract(data, user_store, workers, args.shard_size)
+        results.append((workers, elapsed, outputs == serial_outputs))
+
+    # Printed at the end so the extractors' debug output doesn't interleave with the table
+    print(f"\n{args.users:,} users, {os.cpu_count()} CPUs, shard size {args.shard_size}")
+    print(f"{'workers':>7} {'seconds':>9} {'speedup':>8} {'identical':>10}")
+    for workers, elapsed, identical in results:
+        print(f"{workers:>7} {elapsed:>9.2f} {serial_time / elapsed:>7.2f}x {str(identical):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares the typed Parquet outputs with the CSVs: file size, and the time to
+read each table into typed pandas columns.
+
+A CSV read includes the conversions consumers do today (epoch-ms receipts to
+datetimes, auth dates parsed). The Parquet read gets those types from the file.
+
+Usage (from data-processing/):
+    python benchmarks/bench_parquet.py --users 200000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCH_DIR, '..', 'scripts')
+sys.path.insert(0, BENCH_DIR)
+
+import pandas as pd  # noqa: E402
+
+from synthetic import write_snapshot  # noqa: E402
+
+MS_COLUMNS = {'subscriptions': ['purchase_date', 'expiration_date', 'original_purchase_date']}
+DATE_COLUMNS = {'auth_data': ['creation_date', 'last_sign_in'], 'my_gym': ['creation_date']}
+TABLES = ['auth_data', 'subscriptions', 'user_profiles', 'my_gym', 'data_cleaning_audit']
+
+
+def read_csv_typed(path, table):
+    df = pd.read_csv(path)
+    for col in MS_COLUMNS.get(table, []):
+        df[col] = pd.to_datetime(pd.to_numeric(df[col], errors='coerce'), unit='ms')
+    for col in DATE_COLUMNS.get(table, []):
+        df[col] = pd.to_datetime(df[col], errors='coerce', format='ISO8601')
+    return df
+
+
+def timed(read, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_snapshot(tmp, args.users, seed=args.seed)
+        subprocess.run(
+            [sys.executable, os.path.join(SCRIPTS_DIR, 'process_raw_to_csv.py'), '--parquet'],
+            cwd=tmp, check=True, stdout=subprocess.DEVNULL
+        )
+        processed = os.path.join(tmp, 'data', 'processed')
+        print(f"{args.users:,} users")
+        print(f"{'table':<20} {'CSV MB':>8} {'Parquet MB':>11} {'CSV read s':>11} {'Parquet read s':>15}")
+        for table in TABLES:
+            csv_path = os.path.join(processed, f"{table}.csv")
+            parquet_path = os.path.join(processed, 'parquet', f"{table}.parquet")
+            csv_time = timed(lambda: read_csv_typed(csv_path, table))
+            parquet_time = timed(lambda: pd.read_parquet(parquet_path))
+            print(f"{table:<20} {os.path.getsize(csv_path) / 1e6:>8.2f} {os.path.getsize(parquet_path) / 1e6:>11.2f} "
+                  f"{csv_time:>11.3f} {parquet_time:>15.3f}")
+
+
+if __name__ == '__main__':
+    main()
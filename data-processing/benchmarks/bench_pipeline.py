@@ -0,0 +1,83 @@
+"""
+Times the old subprocess chain against the in-process orchestrator.
+
+On a synthetic data directory, runs the process, load and cohort steps the
+way `run_pipeline.py` used to (one `python` interpreter per script, one after
+the other) and then `run_pipeline.py` itself: once cold, with an empty stage
+cache, and once more as a no-op rerun. Each run starts a fresh interpreter,
+as the pipeline is run from the command line. The fetch stages are left out
+with `--skip` since they need Firebase; `bench_fetch.py` covers them against
+local fakes. The CSVs from both pipelines are compared byte for byte.
+
+Usage (from data-processing/):
+    python benchmarks/bench_pipeline.py --users 20000
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.join(BENCH_DIR, '..')
+SCRIPTS_DIR = os.path.join(PIPELINE_DIR, 'scripts')
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import write_snapshot  # noqa: E402
+
+OLD_CHAIN = ['process_raw_to_csv.py', 'load_to_db.py', 'cohorts.py']
+SKIP_FETCH = ['--skip', 'fetch_rtdb', 'fetch_auth']
+
+
+def timed(commands, root):
+    start = time.perf_counter()
+    for command in commands:
+        subprocess.run([sys.executable, *command], cwd=root, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def reset(root):
+    shutil.rmtree(os.path.join(root, 'data', 'processed'), ignore_errors=True)
+    os.makedirs(os.path.join(root, 'data', 'processed'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per variant; the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        write_snapshot(root, args.users, seed=args.seed)
+        old = [[os.path.join(SCRIPTS_DIR, script)] for script in OLD_CHAIN]
+        new = [[os.path.join(PIPELINE_DIR, 'run_pipeline.py'), *SKIP_FETCH]]
+
+        old_seconds, cold_seconds, noop_seconds = [], [], []
+        for _ in range(args.repeat):
+            reset(root)
+            old_seconds.append(timed(old, root))
+        old_csvs = os.path.join(root, 'old')
+        shutil.copytree(os.path.join(root, 'data', 'processed'), old_csvs)
+        for _ in range(args.repeat):
+            reset(root)
+            cold_seconds.append(timed(new, root))
+            noop_seconds.append(timed(new, root))
+
+        names = sorted(name for name in os.listdir(old_csvs) if name.endswith('.csv'))
+        _, mismatch, errors = filecmp.cmpfiles(old_csvs, os.path.join(root, 'data', 'processed'), names, shallow=False)
+
+    print(f"\n{args.users:,} users, process + load + cohorts")
+    print(f"{'subprocess chain':>22} {min(old_seconds):>8.2f} s")
+    print(f"{'orchestrator, cold':>22} {min(cold_seconds):>8.2f} s  ({min(old_seconds) / min(cold_seconds):.2f}x)")
+    print(f"{'orchestrator, no-op':>22} {min(noop_seconds):>8.2f} s  ({min(old_seconds) / min(noop_seconds):.0f}x)")
+    print(f"Identical CSVs: {not mismatch and not errors} ({len(names)} files)")
+
+
+if __name__ == '__main__':
+    main()
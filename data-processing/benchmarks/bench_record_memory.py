@@ -0,0 +1,101 @@
+"""
+Measures the memory per user of the extracted tables, plain vs. typed columns.
+
+Streams synthetic users through the extractors twice: once with every column
+kept as a list of raw values (the original layout) and once with the
+extractors' int64 and dictionary-encoded columns. For each it reports the
+Python memory the tables still hold after extraction (column buffers plus the
+raw values they keep alive, via tracemalloc; audit rows are left out), the
+size of the finished DataFrames and the extraction time, and checks that both
+produce the same CSV text.
+
+The whole-table checks in `finish` are left out; they don't depend on the
+layout.
+
+Usage (from data-processing/):
+    python benchmarks/bench_record_memory.py --users 200000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+import pandas as pd  # noqa: E402
+
+from synthetic import format_auth_row, generate_users  # noqa: E402
+from extractors import SubscriptionsExtractor, UserProfilesExtractor, MyGymExtractor, dispatch_user  # noqa: E402
+from table_builder import TableBuilder  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+
+def build_extractors(user_store, typed):
+    extractors = [SubscriptionsExtractor(), UserProfilesExtractor(), MyGymExtractor(user_store)]
+    if not typed:
+        for extractor in extractors:
+            extractor.kinds = {}
+            extractor.table = TableBuilder(extractor.columns)
+    return extractors
+
+
+def extract(users, user_store, typed):
+    extractors = build_extractors(user_store, typed)
+    start = time.perf_counter()
+    for user_id, record, _ in users:
+        dispatch_user(user_id, record, extractors)
+    return extractors, time.perf_counter() - start
+
+
+def measure(users, num_users, seed, user_store, typed, repeat):
+    # Timed over pre-generated users, without tracemalloc, which slows every allocation down
+    seconds = min(extract(users, user_store, typed)[1] for _ in range(repeat))
+    gc.collect()
+    # Measured while streaming, so raw values count only if the tables keep them alive
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    extractors, _ = extract(generate_users(num_users, seed), user_store, typed)
+    for extractor in extractors:
+        extractor.audit = None  # Same in both layouts; only the tables are compared
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    frames = [extractor.to_frame() for extractor in extractors]
+    frame_bytes = sum(int(frame.memory_usage(deep=True).sum()) for frame in frames)
+    csv_text = [frame.to_csv(index=False) for frame in frames]
+    return {'seconds': seconds, 'held': held, 'frame_bytes': frame_bytes}, csv_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per layout; the fastest is reported")
+    args = parser.parse_args()
+
+    users = list(generate_users(args.users, args.seed))
+    auth_rows = [format_auth_row(auth_row) for _, _, auth_row in users]
+    auth_data = pd.DataFrame([row for row in auth_rows if row is not None],
+                             columns=['user_id', 'email', 'creation_date', 'last_sign_in'])
+    user_store = UserStore(auth_data)
+
+    plain, plain_csv = measure(users, args.users, args.seed, user_store, False, args.repeat)
+    typed, typed_csv = measure(users, args.users, args.seed, user_store, True, args.repeat)
+
+    print(f"\n{args.users:,} users")
+    print(f"{'layout':>7} {'extract s':>10} {'held B/user':>12} {'frames B/user':>14}")
+    for name, result in [('plain', plain), ('typed', typed)]:
+        print(f"{name:>7} {result['seconds']:>10.2f} {result['held'] / args.users:>12.0f} "
+              f"{result['frame_bytes'] / args.users:>14.0f}")
+    print(f"Held memory: {plain['held'] / typed['held']:.2f}x less; "
+          f"frames: {plain['frame_bytes'] / typed['frame_bytes']:.2f}x less")
+    print(f"Identical CSVs: {plain_csv == typed_csv}")
+
+
+if __name__ == '__main__':
+    main()
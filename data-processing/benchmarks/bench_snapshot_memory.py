@@ -0,0 +1,82 @@
+"""
+Compares peak RSS of loading a raw RTDB snapshot with `json.load` against
+streaming it with `snapshot_reader.iter_users`.
+
+Each mode runs in its own interpreter so the numbers don't bleed into each
+other. Both modes touch every user record (the fused extraction loop is the
+consumer in the real pipeline), so the difference is down to ingestion alone.
+
+Usage (from data-processing/):
+    python benchmarks/bench_snapshot_memory.py --users 2000000
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCH_DIR, '..', 'scripts')
+
+sys.path.insert(0, BENCH_DIR)
+from synthetic import write_snapshot  # noqa: E402
+
+CHILD = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[3])
+from metrics import peak_rss_mb
+from snapshot_reader import iter_users
+mode, path = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+if mode == 'json.load':
+    with open(path) as f:
+        data = json.load(f)
+    users = sum(1 for _ in data.items())
+else:
+    users = sum(1 for _ in iter_users(path, use_ijson=(mode == 'ijson')))
+elapsed = time.perf_counter() - start
+print(json.dumps({'mode': mode, 'users': users, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+
+def run_mode(mode, path):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, mode, path, SCRIPTS_DIR],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=2_000_000,
+                        help="Synthetic users to generate (about 1 KB each; the default gives a ~2 GB snapshot)")
+    parser.add_argument('--snapshot', help="Benchmark an existing snapshot instead of generating one")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.snapshot
+        if path is None:
+            print(f"Generating {args.users:,} users...")
+            start = time.perf_counter()
+            path, _ = write_snapshot(tmp, args.users, seed=args.seed)
+            print(f"Generated in {time.perf_counter() - start:.1f}s")
+        print(f"Snapshot: {path} ({os.path.getsize(path) / 1e9:.2f} GB)")
+
+        modes = ['json.load', 'stream']
+        if importlib.util.find_spec('ijson') is not None:
+            modes.append('ijson')
+
+        print(f"{'mode':<10} {'users':>10} {'seconds':>9} {'peak RSS (MB)':>14}")
+        for mode in modes:
+            r = run_mode(mode, path)
+            print(f"{r['mode']:<10} {r['users']:>10,} {r['seconds']:>9.1f} {r['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
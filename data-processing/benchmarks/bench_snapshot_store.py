@@ -0,0 +1,118 @@
+"""
+Compares daily `indent=4` JSON snapshots with the sharded snapshot store.
+
+Simulates several days of a synthetic `/users` tree: each day a share of the
+users change and some new ones sign up. Every day is written both as the JSON
+file `fetch_firebase_data.py` used to write and into a `SnapshotStore`. The
+benchmark reports the bytes on disk and the write time for each, the time to
+read the latest snapshot back (`json.load`, the streaming reader and the
+store), and the time to look up single users. It also checks that the store
+returns the same records as the JSON.
+
+Usage (from data-processing/):
+    python benchmarks/bench_snapshot_store.py --users 100000 --days 7 --churn 0.01
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'scripts'))
+
+from synthetic import generate_users  # noqa: E402
+from snapshot_reader import iter_users  # noqa: E402
+from snapshot_store import DEFAULT_SHARD_USERS, SnapshotStore  # noqa: E402
+
+
+def disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
+
+
+def daily_snapshots(num_users, days, churn, signups, seed):
+    """Yield `(date, users)` for each day, with `churn` of the users changed and `signups` new ones per day."""
+    rng = random.Random(seed)
+    total = num_users + signups * (days - 1)
+    all_users = [(user_id, record) for user_id, record, _ in generate_users(total, seed)]
+    users = dict(all_users[:num_users])
+    for day in range(days):
+        if day:
+            users.update(all_users[num_users + signups * (day - 1):num_users + signups * day])
+            for user_id in rng.sample(sorted(users), int(len(users) * churn)):
+                record = users[user_id]
+                if isinstance(record.get('userInfo'), dict):
+                    record['userInfo']['lastOpened'] = f"day {day}"
+                else:
+                    record['lastOpened'] = f"day {day}"
+        # Firebase returns /users in key order
+        yield f"2024-01-{day + 1:02d}", dict(sorted(users.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--churn', type=float, default=0.01, help="Share of users changed per day")
+    parser.add_argument('--signups', type=int, default=200, help="New users per day")
+    parser.add_argument('--shard-users', type=int, default=DEFAULT_SHARD_USERS)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir = os.path.join(tmp, 'json')
+        os.makedirs(json_dir)
+        store = SnapshotStore(os.path.join(tmp, 'store'), args.shard_users)
+        json_seconds = store_seconds = 0.0
+        print(f"{'date':>10} {'users':>8} {'shards':>7} {'new':>6}")
+        for snapshot_date, users in daily_snapshots(args.users, args.days, args.churn, args.signups, args.seed):
+            json_path = os.path.join(json_dir, f"{snapshot_date}.json")
+            start = time.perf_counter()
+            with open(json_path, 'w') as f:
+                json.dump(users, f, indent=4)
+            json_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            stats = store.write(snapshot_date, users.items())
+            store_seconds += time.perf_counter() - start
+            print(f"{snapshot_date:>10} {stats['users']:>8} {stats['shards']:>7} {stats['new_shards']:>6}")
+
+        start = time.perf_counter()
+        with open(json_path) as f:
+            latest = json.load(f)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in iter_users(json_path):
+            pass
+        stream_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        stored = dict(store.iter_users())
+        store_read_seconds = time.perf_counter() - start
+        identical = stored == latest and list(stored) == list(latest)
+
+        sample = random.Random(args.seed).sample(sorted(latest), min(args.lookups, len(latest)))
+        start = time.perf_counter()
+        identical = identical and all(store.get(user_id) == latest[user_id] for user_id in sample)
+        lookup_ms = (time.perf_counter() - start) / len(sample) * 1000
+
+        json_bytes = disk_usage(json_dir)
+        store_bytes = disk_usage(store.root)
+
+    print(f"\n{args.users:,} users, {args.days} days, {args.churn:.1%} changed and {args.signups} new per day")
+    print(f"{'':>22} {'JSON':>10} {'store':>10}")
+    print(f"{'MB on disk':>22} {json_bytes / 1e6:>10.1f} {store_bytes / 1e6:>10.1f}")
+    print(f"{'write s (all days)':>22} {json_seconds:>10.2f} {store_seconds:>10.2f}")
+    print(f"{'read latest s':>22} {load_seconds:>10.2f} {store_read_seconds:>10.2f}  (streamed JSON: {stream_seconds:.2f})")
+    print(f"Single-user lookup: {lookup_ms:.2f} ms; {json_bytes / store_bytes:.0f}x less disk")
+    print(f"Identical records: {identical}")
+
+
+if __name__ == '__main__':
+    main()
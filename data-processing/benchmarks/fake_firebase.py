@@ -0,0 +1,115 @@
+"""
+Local stand-ins for the parts of `firebase_admin.auth` and `firebase_admin.db`
+the fetch scripts use, with injected network latency.
+
+Each call sleeps for a fixed round-trip time plus a per-user transfer time, so
+the effect of prefetching, sharding and running fetches concurrently can be
+measured without a Firebase project.
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from fetch_firebase_data import key_order
+
+
+class Latency:
+    """Round-trip plus per-user transfer delay, in seconds."""
+
+    def __init__(self, round_trip=0.05, per_user=0.0001):
+        self.round_trip = round_trip
+        self.per_user = per_user
+
+    def wait(self, num_users):
+        time.sleep(self.round_trip + self.per_user * num_users)
+
+
+class FakePage:
+    def __init__(self, auth, users, next_token):
+        self._auth = auth
+        self.users = users
+        self.next_page_token = next_token
+
+    def get_next_page(self):
+        if self.next_page_token is None:
+            return None
+        return self._auth.list_users(max_results=len(self.users), page_token=self.next_page_token)
+
+
+class FakeAuth:
+    """Mimics `firebase_admin.auth.list_users` paging."""
+
+    def __init__(self, auth_rows, latency=None):
+        self.latency = latency or Latency()
+        self.users = [
+            SimpleNamespace(
+                uid=user_id, email=email or None,
+                user_metadata=SimpleNamespace(creation_timestamp=created, last_sign_in_timestamp=last_sign_in)
+            )
+            for user_id, email, created, last_sign_in in auth_rows
+        ]
+
+    def list_users(self, page_token=None, max_results=1000):
+        start = int(page_token or 0)
+        users = self.users[start:start + max_results]
+        self.latency.wait(len(users))
+        end = start + len(users)
+        return FakePage(self, users, str(end) if end < len(self.users) else None)
+
+
+class FakeQuery:
+    def __init__(self, ref):
+        self._ref = ref
+        self._start = None
+        self._end = None
+
+    def start_at(self, key):
+        self._start = key
+        return self
+
+    def end_at(self, key):
+        self._end = key
+        return self
+
+    def get(self):
+        order = self._ref.order
+        first = 0 if self._start is None else bisect_left(order, key_order(self._start))
+        last = len(order) if self._end is None else bisect_right(order, key_order(self._end))
+        result = OrderedDict(self._ref.items[first:last])
+        self._ref.latency.wait(len(result))
+        return result
+
+
+class FakeReference:
+    def __init__(self, data, latency):
+        self.data = data
+        self.latency = latency
+        # Children in `order_by_key` order, as the server keeps them
+        self.items = sorted(data.items(), key=lambda item: key_order(item[0]))
+        self.order = [key_order(key) for key, _ in self.items]
+
+    def get(self, etag=False, shallow=False):
+        if shallow:
+            # A shallow read transfers keys only, which is far cheaper than full records
+            self.latency.wait(len(self.data) // 50)
+            return {k: True for k in self.data}
+        self.latency.wait(len(self.data))
+        return dict(self.items)
+
+    def order_by_key(self):
+        return FakeQuery(self)
+
+
+class FakeDb:
+    """Mimics `firebase_admin.db.reference('/users/')`."""
+
+    def __init__(self, users, latency=None):
+        self.users = users
+        self.latency = latency or Latency()
+
+    def reference(self, path):
+        if path.strip('/') != 'users':
+            raise ValueError(f"FakeDb only serves /users, not {path}")
+        return FakeReference(self.users, self.latency)
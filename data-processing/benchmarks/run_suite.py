@@ -0,0 +1,142 @@
+"""
+End-to-end pipeline benchmark over synthetic snapshots at several scales.
+
+For each scale a deterministic snapshot is generated (`synthetic.py`), then
+every stage runs in its own interpreter (`stages.py`):
+    fetch    both fetch scripts against zero-latency Firebase fakes
+    process  process_raw_to_csv.py on the snapshot
+    load     load_to_db.py into a scratch SQLite file
+
+Wall-clock time, peak RSS and rows/s per stage are printed and appended to a
+JSON-lines history together with the git revision, and each result is compared
+with the latest earlier one from the same machine for the same stage, scale and
+options so slowdowns show up between versions.
+
+Usage (from data-processing/):
+    python benchmarks/run_suite.py --scales 1k 10k 100k
+    python benchmarks/run_suite.py --scales 1M --stages process --process-args=--stream
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import parse_scale, write_snapshot  # noqa: E402
+
+DEFAULT_HISTORY = os.path.join(BENCH_DIR, 'results', 'history.jsonl')
+STAGE_ORDER = ['fetch', 'process', 'load']
+REGRESSION_THRESHOLD = 0.2  # Slower by more than this fraction of the previous run
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCH_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{rev}-dirty" if dirty else rev
+
+
+def run_stage(stage, root, kwargs):
+    """Run one stage in a fresh interpreter and return its measurements."""
+    result_path = os.path.join(root, f"{stage}.result.json")
+    subprocess.run([sys.executable, os.path.join(BENCH_DIR, 'stages.py'), stage, root, result_path,
+                    json.dumps(kwargs)], check=True)
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, record):
+    """Latest earlier result on the same machine with the same stage, scale and options."""
+    for old in reversed(history):
+        if all(old.get(key) == record[key] for key in ('machine', 'stage', 'users', 'process_args', 'seed')):
+            return old
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', nargs='+', default=['1k', '10k', '100k'],
+                        help="Users per run: 1k, 10k, 100k, 1M or a number")
+    parser.add_argument('--stages', nargs='+', choices=STAGE_ORDER, default=STAGE_ORDER)
+    parser.add_argument('--process-args', default='', help="Extra flags for process_raw_to_csv.py, e.g. '--stream'")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="JSON-lines file results are appended to")
+    parser.add_argument('--no-history', action='store_true', help="Don't append this run to the history")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help=f"Exit non-zero if a stage is more than {REGRESSION_THRESHOLD:.0%} slower than before")
+    args = parser.parse_args()
+
+    history = read_history(args.history)
+    revision = git_revision()
+    run_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    records = []
+    regressions = []
+
+    print(f"{'users':>9} {'stage':<8} {'seconds':>9} {'rows':>10} {'rows/s':>11} {'peak MB':>9}  vs. previous")
+    for scale in args.scales:
+        users = parse_scale(scale)
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            write_snapshot(tmp, users, seed=args.seed)
+            print(f"{users:>9,} {'generate':<8} {time.perf_counter() - start:>9.2f}")
+            # Each stage reads what the one before it wrote, so they run in pipeline order
+            for stage in [s for s in STAGE_ORDER if s in args.stages]:
+                kwargs = {'users': users}
+                if stage == 'fetch':
+                    kwargs['seed'] = args.seed
+                if stage == 'process':
+                    kwargs['args'] = args.process_args.split()
+                result = run_stage(stage, tmp, kwargs)
+                record = {
+                    'run_at': run_at,
+                    'revision': revision,
+                    'python': platform.python_version(),
+                    'machine': platform.node(),
+                    'users': users,
+                    'seed': args.seed,
+                    'process_args': args.process_args,
+                    **result,
+                }
+                previous = previous_result(history, record)
+                comparison = ''
+                if previous:
+                    change = record['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0
+                    comparison = f"{change:+.0%} ({previous.get('revision')})"
+                    if change > REGRESSION_THRESHOLD:
+                        comparison += '  REGRESSION'
+                        regressions.append(record)
+                print(f"{users:>9,} {stage:<8} {record['seconds']:>9.2f} {record['rows']:>10,} "
+                      f"{record['rows_per_sec'] or 0:>11,.0f} {record['peak_rss_mb']:>9.0f}  {comparison}")
+                records.append(record)
+
+    if not args.no_history:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        print(f"Appended {len(records)} results to {args.history}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Runs one pipeline stage against a synthetic data directory and records its
+wall-clock time, peak RSS and row count. The process stage also records the
+spans from the metrics report `process_raw_to_csv.py` writes.
+
+`run_suite.py` starts each stage in its own interpreter through this module,
+so peak memory is per stage and imports are paid the way a real run pays them.
+
+Usage:
+    python benchmarks/stages.py <stage> <data root> <result.json> [<json kwargs>]
+"""
+
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(BENCH_DIR, '..', 'scripts')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SCRIPTS_DIR)
+
+from metrics import peak_rss_mb  # noqa: E402
+
+
+def _count_csv_rows(path):
+    with open(path, newline='') as f:
+        return sum(1 for _ in csv.reader(f)) - 1
+
+
+def fetch(root, users, seed=0):
+    """Both fetch scripts against zero-latency fakes, so only local work is timed."""
+    from fake_firebase import FakeAuth, FakeDb, Latency
+    from synthetic import generate_users
+    from fetch_auth_data import fetch_auth_data
+    from fetch_firebase_data import fetch_firebase_data
+
+    user_dict, auth_rows = {}, []
+    for user_id, record, auth_row in generate_users(users, seed):
+        user_dict[user_id] = record
+        auth_rows.append(auth_row)
+    out_dir = os.path.join(root, 'fetch')
+    os.makedirs(out_dir, exist_ok=True)
+    latency = Latency(0, 0)
+
+    start = time.perf_counter()
+    fetch_firebase_data(FakeDb(user_dict, latency), os.path.join(out_dir, 'users.json'))
+    fetch_auth_data(FakeAuth(auth_rows, latency), os.path.join(out_dir, 'auth.csv'))
+    return time.perf_counter() - start, users, None
+
+
+def process(root, users, args=()):
+    import process_raw_to_csv
+
+    start = time.perf_counter()
+    process_raw_to_csv.main(list(args))
+    elapsed = time.perf_counter() - start
+    # Break the stage down with the spans from the script's own metrics report
+    with open(os.path.join(root, 'data', 'processed', 'metrics.json')) as f:
+        spans = {name: span['seconds'] for name, span in json.load(f)['spans'].items()}
+    return elapsed, users, spans
+
+
+def load(root, users):
+    import load_to_db
+
+    db_path = os.path.join(root, 'data', 'processed', 'bench.sqlite')
+    start = time.perf_counter()
+    load_to_db.main(['--db', f"sqlite:///{db_path}"])
+    elapsed = time.perf_counter() - start
+    rows = sum(_count_csv_rows(os.path.join(root, spec['csv'])) for spec in load_to_db.TABLES.values())
+    return elapsed, rows, None
+
+
+STAGES = {'fetch': fetch, 'process': process, 'load': load}
+
+
+def main():
+    stage, root, result_path = sys.argv[1:4]
+    kwargs = json.loads(sys.argv[4]) if len(sys.argv) > 4 else {}
+    os.chdir(root)
+    # Stage output is noise here; only the measurements matter
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds, rows, spans = STAGES[stage](root, **kwargs)
+    with open(result_path, 'w') as f:
+        json.dump({
+            'stage': stage,
+            'seconds': seconds,
+            'rows': rows,
+            'rows_per_sec': rows / seconds if seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'spans': spans,
+        }, f)
+
+
+if __name__ == '__main__':
+    main()
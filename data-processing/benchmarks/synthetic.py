@@ -0,0 +1,183 @@
+"""
+Deterministic synthetic Firebase data for benchmarking the pipeline.
+
+Generates RTDB `/users` records and matching Firebase Auth users in the same
+shapes the real data has, and writes them the way the fetch scripts do:
+`indent=4` JSON, and an auth CSV without fake emails and with formatted dates.
+Everything is streamed, so multi-GB snapshots can be written without holding
+them in memory.
+"""
+
+import csv
+import json
+import os
+import random
+from datetime import datetime, timezone
+
+PREFERENCE_CODES = ['A', 'N', 'DA', 'KA', 'K', 'B', 'C', 'J', 'M', 'S', 'R', 'HB', 'H', 'X', 'Y', 'P', 'D', 'd', ' b ', 'Z', '']
+PREFERENCE_FIELDS = ['myGym', 'myGymPreferences', 'gymPreferences', 'my_gym_preferences']
+PRODUCT_IDS = ['klein_monthly', 'klein_yearly', 'klein_monthly_trial']
+COUNTRIES = ['US', 'CA', 'GB', 'AU', 'DE', '']
+CITIES = ['Omaha', 'Phoenix', 'Denver', 'Toronto', 'London', '']
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+BASE_MS = 1_690_000_000_000  # 2023-07-22
+DAY_MS = 86_400_000
+FAKE_EMAILS = ('uatbuild.com', 'uat.com')  # Dropped by fetch_auth_data.py
+
+
+def user_id_for(n):
+    """Firebase-style 28 character user ID for the n-th synthetic user."""
+    return f"{n:012d}".rjust(28, 'u')
+
+
+def _receipts(rng, created_ms):
+    receipts = []
+    purchase_ms = created_ms + rng.randint(0, 14) * DAY_MS
+    for _ in range(rng.choice([1, 1, 1, 2, 3, 6, 12])):
+        if rng.random() < 0.03:
+            receipts.append(rng.choice(['invalid', None, 0]))
+            continue
+        days = rng.choice([3, 30, 30, 365])
+        receipt = {
+            'product_id': rng.choice(PRODUCT_IDS),
+            'purchase_date_ms': str(purchase_ms),
+            'expires_date_ms': str(purchase_ms + days * DAY_MS if rng.random() > 0.01 else purchase_ms - DAY_MS),
+            'original_purchase_date_ms': str(created_ms),
+            'transaction_id': str(rng.getrandbits(48)),
+            'is_trial_period': 'true' if days == 3 else 'false',
+        }
+        if rng.random() < 0.02:
+            del receipt['expires_date_ms']
+        receipts.append(receipt)
+        purchase_ms += days * DAY_MS
+    return receipts
+
+
+def _common_preferences(count=200, seed=1):
+    rng = random.Random(seed)
+    return [[rng.choice(PREFERENCE_CODES) for _ in range(rng.randint(1, 4))] for _ in range(count)]
+
+
+# Most users pick one of a few common equipment combinations, most popular first
+COMMON_PREFERENCES = _common_preferences()
+
+
+def _preferences(rng):
+    if rng.random() < 0.8:
+        codes = list(COMMON_PREFERENCES[min(int(rng.paretovariate(1.2)) - 1, len(COMMON_PREFERENCES) - 1)])
+    else:
+        codes = [rng.choice(PREFERENCE_CODES) for _ in range(rng.randint(0, 6))]
+    roll = rng.random()
+    if roll < 0.6:
+        return ', '.join(codes)
+    if roll < 0.95:
+        return codes
+    return rng.choice([42, {'A': True}, True])
+
+
+def generate_user(rng, n):
+    """Return `(user_id, record, auth_row)` for the n-th synthetic user."""
+    user_id = user_id_for(n)
+    created_ms = BASE_MS + n * 60_000 + rng.randint(0, 59_999)  # One sign-up a minute
+    roll = rng.random()
+    if roll < 0.03:
+        email = f"tester{n}@{rng.choice(['uat.com', 'uatbuild.com', 'builduat.io'])}"
+    elif roll < 0.05:
+        email = ''
+    else:
+        email = f"user{n}@example.com"
+    last_sign_in_ms = created_ms + rng.randint(0, 400) * DAY_MS if rng.random() < 0.97 else None
+    auth_row = [user_id, email, created_ms, last_sign_in_ms]
+
+    if rng.random() < 0.08:
+        return user_id, {'workouts': {'w1': {'completed': True}}}, auth_row
+
+    info = {'email': email}
+    if rng.random() < 0.85:
+        info.update({
+            'country': rng.choice(COUNTRIES),
+            'city': rng.choice(CITIES),
+            'gender': rng.choice(['male', 'female', '']),
+            'level': rng.choice(LEVELS),
+        })
+    if rng.random() < 0.7:
+        info.update({
+            'height': rng.choice([rng.randint(150, 200), round(rng.uniform(150, 200), 1), "5'11"]),
+            'weight': rng.randint(50, 120),
+            'age': rng.randint(16, 70),
+            'active': rng.choice([True, False]),
+        })
+    if rng.random() < 0.45:
+        info['latestReceiptInfo'] = _receipts(rng, created_ms)
+    if rng.random() < 0.7:
+        info[rng.choice(PREFERENCE_FIELDS)] = _preferences(rng)
+    return user_id, {'userInfo': info}, auth_row
+
+
+def _format_ms(ms):
+    if ms is None:
+        return ''
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def format_auth_row(auth_row):
+    """Auth row as `fetch_auth_data.py` writes it, or None if it would be filtered out.
+
+    `auth_row` holds what Firebase Auth returns (epoch-ms timestamps).
+    """
+    user_id, email, created_ms, last_sign_in_ms = auth_row
+    if str(email).endswith(FAKE_EMAILS):
+        return None
+    return [user_id, email or '', _format_ms(created_ms), _format_ms(last_sign_in_ms)]
+
+
+def generate_users(num_users, seed=0):
+    """Yield `(user_id, record, auth_row)` for `num_users` users.
+
+    `auth_row` is the raw Firebase Auth view, `[uid, email, creation_ms,
+    last_sign_in_ms]`; use `format_auth_row` for the CSV form.
+    """
+    rng = random.Random(seed)
+    for n in range(num_users):
+        yield generate_user(rng, n)
+
+
+def write_snapshot(root, num_users, seed=0, snapshot_date='2024-01-01'):
+    """Write a raw JSON snapshot and auth CSV under `root/data/raw/`.
+
+    Returns the paths of the JSON and CSV files.
+    """
+    json_dir = os.path.join(root, 'data', 'raw', 'json')
+    auth_dir = os.path.join(root, 'data', 'raw', 'auth')
+    os.makedirs(json_dir, exist_ok=True)
+    os.makedirs(auth_dir, exist_ok=True)
+    json_path = os.path.join(json_dir, f"{snapshot_date}.json")
+    auth_path = os.path.join(auth_dir, f"{snapshot_date}.csv")
+
+    with open(json_path, 'w') as json_file, open(auth_path, 'w', newline='') as auth_file:
+        writer = csv.writer(auth_file, lineterminator='\n')
+        writer.writerow(['user_id', 'email', 'creation_date', 'last_sign_in'])
+        json_file.write('{')
+        for n, (user_id, record, auth_row) in enumerate(generate_users(num_users, seed)):
+            # Same layout as json.dump(userDict, f, indent=4)
+            body = json.dumps(record, indent=4).replace('\n', '\n    ')
+            json_file.write(f'{"," if n else ""}\n    {json.dumps(user_id)}: {body}')
+            csv_row = format_auth_row(auth_row)
+            if csv_row is not None:
+                writer.writerow(csv_row)
+        json_file.write('\n}' if num_users else '}')
+    return json_path, auth_path
+
+
+# Named scales for the benchmark suite
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+
+
+def parse_scale(value):
+    """Number of users for a scale name (`10k`, `1M`) or a plain integer."""
+    if value in SCALES:
+        return SCALES[value]
+    suffixes = {'k': 1_000, 'm': 1_000_000}
+    if value[-1:].lower() in suffixes:
+        return int(float(value[:-1]) * suffixes[value[-1].lower()])
+    return int(value)
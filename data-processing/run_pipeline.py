@@ -2,20 +2,89 @@
 Automates the Klein Data Pipeline for data fetching and processing.
 
 This script runs the pipeline to fetch data from Firebase and process it into CSVs. It demonstrates automation, data pipeline design, and data processing skills.
+
+The stages run in this one interpreter as a dependency graph (see
+scripts/orchestrator.py): the Realtime Database and Auth fetches run at the
+same time, processing starts once both have finished, and the database load
+and the cohort tables are then built side by side. A stage whose code, inputs
+and settings haven't changed since its last run is skipped, so rerunning the
+pipeline on the same day only redoes what changed. Use `--force` to rerun
+stages anyway, e.g. `--force fetch_rtdb fetch_auth` to fetch again today, and
+`--skip fetch_rtdb fetch_auth` to process the raw data already on disk.
 """
 
-import subprocess
+import argparse
+import glob
+import os
+import sys
+from datetime import date
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(PIPELINE_DIR, 'scripts'))
+
+from orchestrator import DEFAULT_CACHE_PATH, Pipeline, Stage  # noqa: E402
+from snapshot_store import DEFAULT_STORE_DIR  # noqa: E402
+from load_to_db import DEFAULT_DB_URL, TABLES  # noqa: E402
+
+PROCESSED_CSVS = [spec['csv'] for spec in TABLES.values()] + [
+    'data/processed/equipment_counts.csv', 'data/processed/equipment_cooccurrence.csv']
+
+
+def latest_raw_inputs():
+    """The newest stored snapshot, JSON snapshot and auth export, which process_raw_to_csv.py picks from."""
+    patterns = [f"{DEFAULT_STORE_DIR}/snapshots/*.json", 'data/raw/json/*.json', 'data/raw/auth/*.csv']
+    newest = [max(glob.glob(pattern), default=None) for pattern in patterns]
+    rules = os.environ.get('KLEIN_CLEANING_RULES') or os.path.join(PIPELINE_DIR, 'config', 'cleaning_rules.json')
+    return [path for path in newest if path] + [rules]
+
+
+def sqlite_path(db_url):
+    return [db_url[len('sqlite:///'):]] if db_url.startswith('sqlite:///') else []
+
+
+def build_stages():
+    today = str(date.today())
+    return [
+        # Step 1: Fetch Firebase Realtime Database JSON and Firebase Auth data concurrently
+        Stage('fetch_rtdb', 'fetch_firebase_data', argv=[],
+              outputs=[f"{DEFAULT_STORE_DIR}/snapshots/{today}.json"], params={'date': today}),
+        Stage('fetch_auth', 'fetch_auth_data',
+              outputs=[f"data/raw/auth/{today}.csv"], params={'date': today}),
+        # Step 2: Process raw data into CSVs
+        Stage('transform', 'process_raw_to_csv', argv=[], deps=['fetch_rtdb', 'fetch_auth'],
+              inputs=latest_raw_inputs, outputs=PROCESSED_CSVS),
+        # Step 3: Load the CSVs into the relational store ($KLEIN_DB_URL, or a local SQLite file)
+        Stage('load', 'load_to_db', argv=[], deps=['transform'],
+              inputs=[spec['csv'] for spec in TABLES.values()], outputs=sqlite_path(DEFAULT_DB_URL),
+              params={'db': DEFAULT_DB_URL}),
+        # Step 4: Build the cohort retention and LTV tables
+        Stage('cohorts', 'cohorts', argv=[], deps=['transform'],
+              inputs=[TABLES['subscriptions']['csv']],
+              outputs=['data/processed/cohort_retention.csv', 'data/processed/cohort_ltv.csv']),
+    ]
+
 
-# Step 1: Fetch Firebase Realtime Database JSON
-print("Step 1: Fetching Firebase Realtime Database data...")
-subprocess.run(['python', 'scripts/fetch_firebase_data.py'])
+def main(argv=None):
+    stages = build_stages()
+    parser = argparse.ArgumentParser(description="Run the fetch, process, load and cohort stages.")
+    parser.add_argument('--force', nargs='*', choices=[stage.name for stage in stages],
+                        help="Rerun these stages even if they are up to date (all stages if none are named)")
+    parser.add_argument('--skip', nargs='+', default=[], choices=[stage.name for stage in stages],
+                        help="Leave these stages out and use what they last produced, e.g. the fetches when offline")
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_PATH,
+                        help="Where stage fingerprints are kept")
+    parser.add_argument('--report', default='data/processed/pipeline_metrics.json',
+                        help="Where the per-stage timings are written")
+    args = parser.parse_args(argv)
+    force = [stage.name for stage in stages] if args.force == [] else (args.force or [])
 
-# Step 2: Fetch Firebase Auth data
-print("Step 2: Fetching Firebase Auth data...")
-subprocess.run(['python', 'scripts/fetch_auth_data.py'])
+    os.makedirs('data/processed', exist_ok=True)
+    status = Pipeline(stages, args.cache_file).run(force, args.skip, args.report)
+    if 'failed' in status.values():
+        print("ERROR: Pipeline stopped; see the failed stage above.")
+        sys.exit(1)
+    print("Pipeline complete! CSVs are in data/processed/ and loaded into the database.")
 
-# Step 3: Process raw data into CSVs
-print("Step 3: Processing raw data into CSVs...")
-subprocess.run(['python', 'scripts/process_raw_to_csv.py'])
 
-print("Pipeline complete! CSVs are in data/processed/. Next step: Manually upload to MySQL.")
+if __name__ == '__main__':
+    main()
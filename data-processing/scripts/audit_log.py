@@ -0,0 +1,251 @@
+"""
+Compact, append-only store for the data cleaning audit log.
+
+Nearly every user gets several audit rows, and most of their text repeats:
+the section, action and reason come from a handful of combinations, and
+details such as `Tried fields: [...]` or `Profile data extracted` are the
+same for thousands of users. `AuditLog` keeps one small integer per row for
+the (section, action, reason) combination and one for the details string,
+each looked up in a table of the distinct values, plus a reference to the
+user ID. Rows are only turned back into text when they are written.
+
+The summary counters (rows per combination, users skipped) are updated as
+rows are added, so the summary stats don't need another pass over the log.
+
+Given a `path`, the log writes itself to that CSV in chunks of `chunk_rows`
+rows as they come in and is moved into place by `close()`. Between chunks it
+keeps only the counters and the (section, action, reason) table, so its memory
+doesn't grow with the log.
+
+The extractors' logs have no path. Their rows stay in memory until extraction
+is done and `process_raw_to_csv.py` merges them into the file-backed log,
+dropping each one once it is written. Until then they cost a few bytes per row
+plus each distinct details string, rather than the rows' text.
+
+With `sample` > 1 only one in `sample` users' high-volume `Processed` /
+`Valid data` rows are written, picked by a hash of the user ID, so the same
+users are kept in every section and on every run. They are still counted.
+"""
+
+import csv
+import math
+import os
+import zlib
+from array import array
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+AUDIT_COLUMNS = ['user_id', 'section', 'action', 'reason', 'details']
+CHUNK_ROWS = 50_000  # Rows buffered before a file-backed log writes them out
+SAMPLED_KIND = ('Processed', 'Valid data')  # (action, reason) of the rows `sample` thins out
+
+
+def sampled(user_id, sample):
+    """Whether `user_id`'s sampled rows are written when keeping one user in `sample`."""
+    return sample <= 1 or zlib.crc32(str(user_id).encode()) % sample == 0
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class AuditLog:
+    """Audit rows as dictionary codes, with counters kept up to date."""
+
+    def __init__(self, path=None, sample=1, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.sample = sample
+        self.chunk_rows = chunk_rows
+        self._kind_codes = {}  # (section, action, reason) -> code
+        self._kinds = []
+        self._detail_codes = {}  # details -> code
+        self._details = []
+        self._row_users = []
+        self._row_kinds = array('H')
+        self._row_details = array('I')
+        self.kind_counts = []  # Rows per kind code, including rows already written
+        self.skipped_users = set()
+        self.logged = 0  # Rows added
+        self.written = 0  # Rows written to `path`
+        self.omitted = 0  # Rows left out by sampling
+        self._file = self._writer = None
+        if path:
+            self._file = open(f"{path}.tmp", 'w', newline='')
+            self._writer = csv.writer(self._file, lineterminator='\n')
+            self._writer.writerow(AUDIT_COLUMNS)
+
+    def __len__(self):
+        return self.logged
+
+    def __getstate__(self):
+        # Worker processes get empty copies; an open file can't be pickled
+        if self._file is not None:
+            raise TypeError("A file-backed AuditLog can't be pickled")
+        return self.__dict__
+
+    def _kind_code(self, section, action, reason):
+        key = (section, action, reason)
+        code = len(self._kinds)
+        self._kind_codes[key] = code
+        self._kinds.append(key)
+        self.kind_counts.append(0)
+        return code
+
+    def _detail_code(self, details):
+        code = len(self._details)
+        self._detail_codes[details] = code
+        self._details.append(details)
+        return code
+
+    def log(self, user_id, section, action, reason, details):
+        """Add one row."""
+        kind = self._kind_codes.get((section, action, reason))
+        if kind is None:
+            kind = self._kind_code(section, action, reason)
+        detail = self._detail_codes.get(details)
+        if detail is None:
+            detail = self._detail_code(details)
+        self._row_users.append(user_id)
+        self._row_kinds.append(kind)
+        self._row_details.append(detail)
+        self.kind_counts[kind] += 1
+        self.logged += 1
+        if action == 'Skipped' and not _is_missing(user_id):
+            self.skipped_users.add(user_id)
+        if self._file is not None and len(self._row_kinds) >= self.chunk_rows:
+            self.flush()
+
+    def append(self, row):
+        """Add one row given as `[user_id, section, action, reason, details]`."""
+        self.log(*row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.log(*row)
+
+    def merge(self, other):
+        """Append every row buffered in another log, with its counters.
+
+        A file-backed log takes the rows a chunk at a time, writing each
+        chunk out before the next is copied.
+        """
+        kind_map = [self._kind_codes.get(key) for key in other._kinds]
+        for code, key in enumerate(other._kinds):
+            if kind_map[code] is None:
+                kind_map[code] = self._kind_code(*key)
+            self.kind_counts[kind_map[code]] += other.kind_counts[code]
+        self.skipped_users.update(other.skipped_users)
+        self.logged += other.logged
+        rows = len(other._row_kinds)
+        step = self.chunk_rows if self._file is not None else max(rows, 1)
+        for start in range(0, rows, step):
+            details = other._row_details[start:start + step]
+            # Looked up per chunk, since flushing resets this log's details table
+            detail_map = {}
+            for code in set(details):
+                value = other._details[code]
+                detail_map[code] = self._detail_codes.get(value)
+                if detail_map[code] is None:
+                    detail_map[code] = self._detail_code(value)
+            self._row_users.extend(other._row_users[start:start + step])
+            self._row_kinds.extend(kind_map[code] for code in other._row_kinds[start:start + step])
+            self._row_details.extend(detail_map[code] for code in details)
+            if self._file is not None and len(self._row_kinds) >= self.chunk_rows:
+                self.flush()
+
+    def take(self, sources, rows):
+        """Append rows of `sources`, logs read as one, in the order of `rows` (an integer numpy array).
+
+        Codes are gathered with numpy and each distinct (section, action,
+        reason) and details string is looked up once, so no row is turned
+        back into text.
+        """
+        users = list(chain.from_iterable(source._row_users for source in sources))
+        kinds, kind_keys, details, detail_values = [], [], [], []
+        for source in sources:
+            kinds.append(np.frombuffer(source._row_kinds, dtype=np.uint16).astype(np.int64) + len(kind_keys))
+            kind_keys.extend(source._kinds)
+            details.append(np.frombuffer(source._row_details, dtype=np.uint32).astype(np.int64) + len(detail_values))
+            detail_values.extend(source._details)
+        distinct, first, kind_positions = np.unique(np.concatenate(kinds)[rows], return_index=True,
+                                                    return_inverse=True)
+        kind_map = np.empty(len(distinct), dtype=np.uint16)
+        for i in np.argsort(first).tolist():
+            key = kind_keys[distinct[i]]
+            code = self._kind_codes.get(key)
+            kind_map[i] = self._kind_code(*key) if code is None else code
+        for code, count in zip(kind_map.tolist(), np.bincount(kind_positions, minlength=len(distinct)).tolist()):
+            self.kind_counts[code] += count
+        distinct_details, detail_positions = np.unique(np.concatenate(details)[rows], return_inverse=True)
+        detail_map = np.empty(len(distinct_details), dtype=np.uint32)
+        for i, code in enumerate(distinct_details.tolist()):
+            value = detail_values[code]
+            mapped = self._detail_codes.get(value)
+            detail_map[i] = self._detail_code(value) if mapped is None else mapped
+
+        row_users = [users[i] for i in rows.tolist()]
+        skipped = [i for i, code in enumerate(distinct.tolist()) if kind_keys[code][1] == 'Skipped']
+        if skipped:
+            self.skipped_users.update(row_users[i] for i in np.flatnonzero(np.isin(kind_positions, skipped)).tolist()
+                                      if not _is_missing(row_users[i]))
+        self._row_users.extend(row_users)
+        self._row_kinds.frombytes(kind_map[kind_positions].tobytes())
+        self._row_details.frombytes(detail_map[detail_positions].tobytes())
+        self.logged += len(row_users)
+        if self._file is not None and len(self._row_kinds) >= self.chunk_rows:
+            self.flush()
+
+    def rows(self, start=0):
+        """Buffered rows from `start` on, as `(user_id, section, action, reason, details)` tuples."""
+        kinds, details = self._kinds, self._details
+        return [(user_id, *kinds[kind], details[detail]) for user_id, kind, detail
+                in zip(self._row_users[start:], self._row_kinds[start:], self._row_details[start:])]
+
+    def counts(self):
+        """Rows logged per `(section, action, reason)`."""
+        return {key: count for key, count in zip(self._kinds, self.kind_counts)}
+
+    def action_count(self, action):
+        return sum(count for (_, row_action, _), count in zip(self._kinds, self.kind_counts) if row_action == action)
+
+    def flush(self):
+        """Write the buffered rows to the file and drop them, and their details strings, from memory."""
+        if self._file is None:
+            return
+        kinds, details, sample = self._kinds, self._details, self.sample
+        thinned = {code for code, (_, action, reason) in enumerate(kinds) if (action, reason) == SAMPLED_KIND}
+        rows = []
+        for user_id, kind, detail in zip(self._row_users, self._row_kinds, self._row_details):
+            if sample > 1 and kind in thinned and not sampled(user_id, sample):
+                self.omitted += 1
+                continue
+            # Missing IDs are written as empty fields, as pandas writes NaN
+            rows.append(('' if _is_missing(user_id) else user_id, *kinds[kind], details[detail]))
+        self._writer.writerows(rows)
+        self.written += len(rows)
+        self._row_users = []
+        self._row_kinds = array('H')
+        self._row_details = array('I')
+        # No buffered row refers to a details string any more
+        self._detail_codes = {}
+        self._details = []
+
+    def close(self):
+        """Write what is left and move the file into place."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = self._writer = None
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def nbytes(self):
+        """Approximate size of the row buffers, not counting the distinct values."""
+        return (self._row_kinds.itemsize * len(self._row_kinds) + self._row_details.itemsize * len(self._row_details)
+                + 8 * len(self._row_users))
+
+    def to_frame(self):
+        """The buffered rows as a DataFrame of text columns."""
+        return pd.DataFrame(self.rows(), columns=AUDIT_COLUMNS, dtype=object)
@@ -0,0 +1,162 @@
+"""
+Cleaning rules loaded from `config/cleaning_rules.json`.
+
+The config lists the test accounts, the email substrings that mark a user as
+flagged, and the auth checks with the audit row each one writes. Adding a
+test account or flag string is a config edit. The rules are compiled once:
+test accounts into a set, flag strings into one regular expression, and auth
+checks into whole-column operations whose audit rows are emitted in bulk.
+
+Set `$KLEIN_CLEANING_RULES` (or `--rules`) to use another rules file.
+"""
+
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'cleaning_rules.json')
+RULES_ENV = 'KLEIN_CLEANING_RULES'
+AUTH_SECTION = 'Auth Data'
+
+
+def _missing(values, rules, now):
+    blank = (values.astype(str).str.strip() == '').to_numpy(dtype=bool)
+    return values.isna().to_numpy() | blank
+
+
+def _test_account(values, rules, now):
+    return values.isin(rules.test_accounts).to_numpy()
+
+
+def _timestamp_checks(values, now):
+    """`(future, invalid)` masks, matching `pd.to_datetime` on each value alone.
+
+    The column is parsed in one call; only values that call can't handle
+    (unparseable, out of range, timezone-aware) are retried one at a time.
+    """
+    future = np.zeros(len(values), dtype=bool)
+    invalid = np.zeros(len(values), dtype=bool)
+    retry = values.notna().to_numpy()
+    try:
+        parsed = pd.to_datetime(values.astype(object).where(values.notna(), None), errors='coerce', format='ISO8601')
+        if parsed.dt.tz is None:
+            ok = parsed.notna().to_numpy()
+            future[ok] = (parsed[ok] > now).to_numpy()
+            retry = retry & ~ok
+    except (ValueError, TypeError, OverflowError):
+        pass
+    for i in np.flatnonzero(retry):
+        try:
+            future[i] = pd.to_datetime(values.iat[i]) > now
+        except (ValueError, TypeError):
+            invalid[i] = True
+    return future, invalid
+
+
+def _future_timestamp(values, rules, now):
+    return _timestamp_checks(values, now)[0]
+
+
+def _invalid_timestamp(values, rules, now):
+    return _timestamp_checks(values, now)[1]
+
+
+# Check name in the config -> function(column values, rule set, now) returning a boolean mask
+CHECKS = {
+    'missing': _missing,
+    'test_account': _test_account,
+    'future_timestamp': _future_timestamp,
+    'invalid_timestamp': _invalid_timestamp,
+}
+
+
+class RuleSet:
+    """Compiled cleaning rules."""
+
+    def __init__(self, test_accounts, flagged_email_substrings, auth_rules):
+        self.test_accounts = frozenset(test_accounts)
+        self.flagged_email_substrings = list(flagged_email_substrings)
+        self.flagged_pattern = re.compile('|'.join(re.escape(s.lower()) for s in self.flagged_email_substrings)
+                                          or r'(?!)')
+        for rule in auth_rules:
+            if rule['check'] not in CHECKS:
+                raise ValueError(f"Unknown check '{rule['check']}' in rule {rule.get('name')}")
+        self.auth_rules = auth_rules
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config['test_accounts'], config['flagged_email_substrings'], config['auth_rules'])
+
+    def is_flagged(self, user_id, user_info):
+        """Check if a user should be filtered out based on their email or user ID."""
+        if self.flagged_pattern.search(str(user_info.get('email', '')).lower()):
+            return True
+        return user_id in self.test_accounts
+
+    def check_auth(self, auth_data, now=None):
+        """Run every auth rule over `auth_data` as column operations.
+
+        Returns the audit rows, ordered by auth row and then by rule as a
+        row-by-row pass would write them, and a Counter of hits per rule.
+        """
+        now = now or datetime.now()
+        # Timestamp rules on the same column share one parse
+        masks = {}
+        positions, orders, details = [], [], []
+        counts = Counter()
+        for order, rule in enumerate(self.auth_rules):
+            values = auth_data[rule['column']]
+            key = (rule['check'], rule['column'])
+            if key not in masks:
+                if rule['check'] in ('future_timestamp', 'invalid_timestamp'):
+                    future, invalid = _timestamp_checks(values, now)
+                    masks[('future_timestamp', rule['column'])] = future
+                    masks[('invalid_timestamp', rule['column'])] = invalid
+                else:
+                    masks[key] = CHECKS[rule['check']](values, self, now)
+            hits = np.flatnonzero(masks[key])
+            counts[rule['name']] += len(hits)
+            positions.append(hits)
+            orders.append(np.full(len(hits), order))
+            if '{value}' in rule['details']:
+                details.extend(rule['details'].format(value=value) for value in values.iloc[hits])
+            else:
+                details.extend([rule['details']] * len(hits))
+
+        positions = np.concatenate(positions) if positions else np.array([], dtype=int)
+        orders = np.concatenate(orders) if orders else np.array([], dtype=int)
+        user_ids = auth_data['user_id'].to_numpy(dtype=object)
+        rows = []
+        for i in np.lexsort((orders, positions)):
+            rule = self.auth_rules[orders[i]]
+            rows.append([user_ids[positions[i]], AUTH_SECTION, rule['action'], rule['reason'], details[i]])
+        return rows, counts
+
+
+_active = None
+
+
+def rules_path():
+    return os.environ.get(RULES_ENV) or DEFAULT_RULES_PATH
+
+
+def set_rules_path(path):
+    """Use the rules in `path` in this process and any worker processes it starts."""
+    global _active
+    os.environ[RULES_ENV] = os.path.abspath(path)
+    _active = None
+
+
+def active_rules():
+    """The rule set in use, loaded on first call."""
+    global _active
+    if _active is None:
+        _active = RuleSet.load(rules_path())
+    return _active
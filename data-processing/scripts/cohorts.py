@@ -0,0 +1,264 @@
+"""
+Builds cohort retention and LTV tables from the extracted subscription receipts.
+
+Users are grouped by the month of their first (original) purchase. Each
+receipt covers the months from its purchase month to its expiration month.
+Receipts are sorted by user and purchase date. Each receipt only counts the
+months past the end of the user's earlier coverage. What remains goes into
+per-cohort difference arrays: +1 at the first newly covered month since
+joining, -1 after the last. A cumulative sum over those arrays gives the
+active users per cohort and month. No user x month grid is built, and
+overlapping renewals are counted once.
+
+The difference arrays, each user's cohort and last covered month, and the
+latest purchase date seen are kept in a state file. With `--incremental`
+only receipts purchased after that date are folded in, so a new month of
+receipts costs only its own rows. This assumes receipts are only ever added;
+a user's cohort is fixed by the receipts seen when they first appear.
+Run without it to rebuild from scratch.
+
+Outputs, small enough for R or Tableau to read as they are:
+    data/processed/cohort_retention.csv   cohort, months_since_join, cohort_users, active_users, retention_rate
+    data/processed/cohort_ltv.csv         cohort, months_since_join, cohort_users, receipts, revenue and
+                                          cumulative receipts and revenue per cohort user
+
+Revenue needs product prices (`--prices prices.json`, mapping product_id to
+price); without them the revenue columns are empty.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from metrics import log
+
+SUBSCRIPTIONS_CSV = 'data/processed/subscriptions.csv'
+RETENTION_CSV = 'data/processed/cohort_retention.csv'
+LTV_CSV = 'data/processed/cohort_ltv.csv'
+DEFAULT_STATE_PATH = 'data/processed/.cohort_state.pkl'
+STATE_VERSION = 1
+DEFAULT_HORIZON = 12
+
+
+def month_index(ms):
+    """Months since 1970-01 for epoch-millisecond timestamps."""
+    return np.asarray(ms, dtype='int64').astype('datetime64[ms]').astype('datetime64[M]').astype('int64')
+
+
+def month_label(index):
+    return str(np.datetime64(int(index), 'M'))
+
+
+def parse_month(text):
+    """`YYYY-MM` to a month index."""
+    return int(np.datetime64(text, 'M').astype('int64'))
+
+
+def read_receipts(path=SUBSCRIPTIONS_CSV):
+    """Receipts with valid purchase and expiration dates, as month indexes."""
+    subscriptions = pd.read_csv(path, dtype=str, keep_default_na=False)
+    purchase = pd.to_numeric(subscriptions['purchase_date'], errors='coerce')
+    expiration = pd.to_numeric(subscriptions['expiration_date'], errors='coerce')
+    original = pd.to_numeric(subscriptions['original_purchase_date'], errors='coerce').fillna(purchase)
+    # Invalid receipts are already flagged in the audit log; they can't place a user in time
+    valid = purchase.notna() & expiration.notna() & (expiration >= purchase)
+    purchase_ms = purchase[valid].astype('int64').to_numpy()
+    return pd.DataFrame({
+        'user_id': subscriptions['user_id'][valid].to_numpy(),
+        'purchase_ms': purchase_ms,
+        'start': month_index(purchase_ms),
+        'end': month_index(expiration[valid].astype('int64').to_numpy()),
+        'joined': month_index(original[valid].astype('int64').to_numpy()),
+        'product_id': subscriptions['product_id'][valid].to_numpy(),
+    })
+
+
+def _add(counter, cohorts, offsets, values=None):
+    frame = pd.DataFrame({'cohort': cohorts, 'offset': offsets, 'value': 1 if values is None else values})
+    for key, value in frame.groupby(['cohort', 'offset'])['value'].sum().items():
+        counter[key] += value
+
+
+class CohortState:
+    """Per-cohort difference arrays and per-user coverage, kept between runs."""
+
+    def __init__(self, prices=None):
+        self.prices = prices or {}
+        self.users = pd.DataFrame({'cohort': pd.Series(dtype='int64'), 'last_end': pd.Series(dtype='int64')},
+                                  index=pd.Index([], name='user_id', dtype=object))
+        self.cohort_users = Counter()  # cohort -> users
+        self.coverage = Counter()  # (cohort, months since join) -> change in active users
+        self.receipts = Counter()  # (cohort, months since join) -> receipts purchased
+        self.revenue = Counter()  # (cohort, months since join) -> revenue of those receipts
+        self.unpriced = 0
+        self.watermark_ms = None
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATE_PATH, prices=None):
+        """Load the saved state, or return an empty one if it is missing or was built with other prices."""
+        if not os.path.exists(path):
+            log('DEBUG', f"No cohort state at {path}; building from every receipt")
+            return cls(prices)
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.get('version') != STATE_VERSION or saved['state'].prices != (prices or {}):
+            log('DEBUG', "Cohort state is from another version or price list; building from every receipt")
+            return cls(prices)
+        return saved['state']
+
+    def save(self, path=DEFAULT_STATE_PATH):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': STATE_VERSION, 'state': self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def update(self, receipts):
+        """Fold in the receipts purchased after the watermark. Returns how many were new."""
+        if self.watermark_ms is not None:
+            receipts = receipts[receipts['purchase_ms'] > self.watermark_ms]
+        if receipts.empty:
+            return 0
+        receipts = receipts.sort_values(['user_id', 'purchase_ms', 'end'], kind='stable').reset_index(drop=True)
+        receipts = receipts.join(self.users, on='user_id')
+
+        # Users seen for the first time join in the month of their earliest original purchase
+        new_users = receipts['cohort'].isna()
+        joined = receipts[new_users].groupby('user_id')['joined'].min()
+        receipts.loc[new_users, 'cohort'] = receipts.loc[new_users, 'user_id'].map(joined)
+        cohort = receipts['cohort'].astype('int64').to_numpy()
+        self.cohort_users.update(joined.value_counts().to_dict())
+
+        # Months already covered: by the user's earlier runs, then by their earlier receipts in this one
+        covered = receipts.groupby('user_id', sort=False)['end'].cummax().groupby(receipts['user_id']).shift(1)
+        covered = np.fmax(covered.to_numpy(dtype='float64'), receipts['last_end'].to_numpy(dtype='float64'))
+        start = receipts['start'].to_numpy()
+        end = receipts['end'].to_numpy()
+        first_new = np.where(np.isnan(covered), start, np.maximum(start, covered + 1)).astype('int64')
+        adds = (first_new <= end) & (end >= cohort)
+        first_offset = np.maximum(first_new - cohort, 0)
+        _add(self.coverage, cohort[adds], first_offset[adds])
+        _add(self.coverage, cohort[adds], (end - cohort + 1)[adds], -1)
+
+        purchase_offset = np.maximum(start - cohort, 0)
+        _add(self.receipts, cohort, purchase_offset)
+        price = receipts['product_id'].map(self.prices)
+        self.unpriced += int(price.isna().sum())
+        _add(self.revenue, cohort, purchase_offset, price.fillna(0).to_numpy())
+
+        last_end = pd.DataFrame({'cohort': cohort, 'last_end': end}, index=receipts['user_id']).groupby(level=0).agg(
+            {'cohort': 'first', 'last_end': 'max'})
+        merged = last_end.join(self.users['last_end'].rename('previous'), how='left')
+        last_end['last_end'] = np.fmax(merged['last_end'], merged['previous']).astype('int64')
+        self.users = pd.concat([self.users.drop(last_end.index, errors='ignore'), last_end])
+        self.watermark_ms = int(receipts['purchase_ms'].max())
+        return len(receipts)
+
+    def _grid(self, counter, cohorts, horizon):
+        grid = np.zeros((len(cohorts), horizon + 2))
+        position = {c: i for i, c in enumerate(cohorts)}
+        for (cohort, offset), value in counter.items():
+            if cohort in position and offset <= horizon + 1:
+                grid[position[cohort], offset] += value
+        return grid
+
+    def tables(self, cohort_start=None, cohort_end=None, cohort_months=1, horizon=DEFAULT_HORIZON, as_of=None):
+        """Retention and LTV tables for cohorts of `cohort_months` months, up to `horizon` months after joining.
+
+        Cells past `as_of` (default: the month of the latest purchase) for
+        any month of the cohort are left out rather than reported as churn.
+        """
+        if not self.cohort_users:
+            return pd.DataFrame(), pd.DataFrame()
+        first = cohort_start if cohort_start is not None else min(self.cohort_users)
+        last = cohort_end if cohort_end is not None else max(self.cohort_users)
+        as_of = as_of if as_of is not None else int(month_index([self.watermark_ms])[0])
+        cohorts = list(range(first, last + 1))
+        active = np.cumsum(self._grid(self.coverage, cohorts, horizon), axis=1)[:, :horizon + 1]
+        receipts = self._grid(self.receipts, cohorts, horizon)[:, :horizon + 1]
+        revenue = self._grid(self.revenue, cohorts, horizon)[:, :horizon + 1]
+        users = np.array([self.cohort_users.get(c, 0) for c in cohorts], dtype='int64')
+
+        # Sum each window of `cohort_months` consecutive cohort months
+        windows = (np.arange(len(cohorts)) // cohort_months)
+        window_starts = [cohorts[i] for i in range(0, len(cohorts), cohort_months)]
+        window_ends = [cohorts[min(i + cohort_months, len(cohorts)) - 1] for i in range(0, len(cohorts), cohort_months)]
+        sums = [np.add.reduceat(a, np.arange(0, len(cohorts), cohort_months), axis=0) for a in (active, receipts, revenue)]
+        window_users = np.bincount(windows, weights=users).astype('int64')
+
+        retention_rows, ltv_rows = [], []
+        priced = bool(self.prices)
+        for w, (window_start, window_end) in enumerate(zip(window_starts, window_ends)):
+            if not window_users[w]:
+                continue
+            label = month_label(window_start)
+            cumulative_receipts = np.cumsum(sums[1][w])
+            cumulative_revenue = np.cumsum(sums[2][w])
+            for k in range(horizon + 1):
+                if window_end + k > as_of:
+                    break
+                n = int(window_users[w])
+                retention_rows.append([label, k, n, int(sums[0][w][k]), round(sums[0][w][k] / n, 4)])
+                ltv_rows.append([
+                    label, k, n, int(sums[1][w][k]), round(cumulative_receipts[k] / n, 4),
+                    round(sums[2][w][k], 2) if priced else None,
+                    round(cumulative_revenue[k] / n, 2) if priced else None,
+                ])
+        retention = pd.DataFrame(retention_rows, columns=[
+            'cohort', 'months_since_join', 'cohort_users', 'active_users', 'retention_rate'])
+        ltv = pd.DataFrame(ltv_rows, columns=[
+            'cohort', 'months_since_join', 'cohort_users', 'receipts', 'cumulative_receipts_per_user',
+            'revenue', 'cumulative_revenue_per_user'])
+        return retention, ltv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build cohort retention and LTV tables from subscriptions.csv.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fold in receipts purchased since the last run, using the saved cohort state")
+    parser.add_argument('--state-file', default=DEFAULT_STATE_PATH)
+    parser.add_argument('--prices', help="JSON file mapping product_id to price, for the revenue columns")
+    parser.add_argument('--cohort-start', type=parse_month, help="First cohort month, YYYY-MM")
+    parser.add_argument('--cohort-end', type=parse_month, help="Last cohort month, YYYY-MM")
+    parser.add_argument('--cohort-months', type=int, default=1,
+                        help="Months per cohort, e.g. 3 for quarterly cohorts")
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help="Months after joining to report")
+    parser.add_argument('--as-of', type=parse_month, help="Last observed month, YYYY-MM (default: latest purchase)")
+    args = parser.parse_args(argv)
+    if args.cohort_months < 1 or args.horizon < 0:
+        parser.error("--cohort-months must be at least 1 and --horizon at least 0")
+
+    if not os.path.exists(SUBSCRIPTIONS_CSV):
+        print(f"ERROR: {SUBSCRIPTIONS_CSV} not found. Run process_raw_to_csv.py first.")
+        sys.exit(1)
+    prices = None
+    if args.prices:
+        with open(args.prices) as f:
+            prices = json.load(f)
+
+    state = CohortState.load(args.state_file, prices) if args.incremental else CohortState(prices)
+    receipts = read_receipts()
+    added = state.update(receipts)
+    log('DEBUG', f"Cohorts - {len(receipts)} valid receipts, {added} new, {len(state.users)} users, "
+                 f"{len(state.cohort_users)} cohort months")
+    if prices and state.unpriced:
+        print(f"ERROR: {state.unpriced} receipts have a product_id missing from {args.prices}; counted as 0 revenue")
+
+    retention, ltv = state.tables(args.cohort_start, args.cohort_end, args.cohort_months, args.horizon, args.as_of)
+    for table, path in [(retention, RETENTION_CSV), (ltv, LTV_CSV)]:
+        try:
+            table.to_csv(path, index=False)
+            print(f"Saved: {path}")
+        except PermissionError as e:
+            print(f"ERROR: Permission denied when writing to {path}: {e}")
+            sys.exit(1)
+    state.save(args.state_file)
+
+
+if __name__ == '__main__':
+    main()
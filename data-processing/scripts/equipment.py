@@ -0,0 +1,73 @@
+"""
+Equipment sets as bitmasks over a fixed equipment dictionary.
+
+Each `my_gym` row carries `equipment_mask`, the user's deduplicated equipment
+as one integer with bit `i` set for `EQUIPMENT[i]`. From the masks the
+pipeline writes the tables the product analysis used to build in BigQuery
+with `UNNEST(SPLIT(translated, ','))`:
+    user_equipment.csv           one row per user and equipment type
+    equipment_counts.csv         users per equipment type, overall and among
+                                 users with one to LIMITED_EQUIPMENT types
+    equipment_cooccurrence.csv   users having both equipment types, per pair
+
+Bit positions are stored in the CSVs and the database, so only ever append
+to `EQUIPMENT`.
+"""
+
+import numpy as np
+import pandas as pd
+
+EQUIPMENT = [
+    'Full Gym', 'Bodyweight', 'Dumbbells', 'Kettlebells', 'Barbell & Plates', 'Cable Machines', 'Boxes',
+    'Med Ball', 'Swiss Ball', 'Bands', 'Hexbar', 'Back Extension Machine', 'Assault Bike', 'Weighted Plate',
+]
+BITS = {name: 1 << i for i, name in enumerate(EQUIPMENT)}
+LIMITED_EQUIPMENT = 2  # "Limited equipment" users have at most this many types
+
+
+def decode(mask):
+    """Equipment names in a mask, in dictionary order."""
+    return [name for i, name in enumerate(EQUIPMENT) if mask >> i & 1]
+
+
+def bit_matrix(masks):
+    """Users x equipment 0/1 matrix for an array of masks."""
+    masks = np.asarray(masks, dtype=np.int64)
+    return ((masks[:, None] >> np.arange(len(EQUIPMENT))) & 1).astype(np.int64)
+
+
+def bridge_table(my_gym):
+    """`user_id, equipment` rows for every equipment type each user has."""
+    bits = bit_matrix(pd.to_numeric(my_gym['equipment_mask']).to_numpy())
+    users, columns = np.nonzero(bits)
+    return pd.DataFrame({
+        'user_id': my_gym['user_id'].to_numpy(dtype=object)[users],
+        'equipment': np.array(EQUIPMENT, dtype=object)[columns],
+    })
+
+
+def equipment_counts(my_gym):
+    """Users per equipment type, with shares of all users and of limited-equipment users."""
+    bits = bit_matrix(pd.to_numeric(my_gym['equipment_mask']).to_numpy())
+    total = len(bits)
+    sizes = bits.sum(axis=1)
+    # As in the product analysis, users without any equipment aren't limited-equipment users
+    limited = bits[(sizes >= 1) & (sizes <= LIMITED_EQUIPMENT)]
+    users = bits.sum(axis=0)
+    limited_users = limited.sum(axis=0)
+    return pd.DataFrame({
+        'equipment': EQUIPMENT,
+        'bit': range(len(EQUIPMENT)),
+        'users': users,
+        'percentage_of_total': np.round(users * 100.0 / total, 2) if total else 0.0,
+        'limited_users': limited_users,
+        'percentage_of_limited': np.round(limited_users * 100.0 / len(limited), 2) if len(limited) else 0.0,
+    })
+
+
+def cooccurrence(my_gym):
+    """Equipment x equipment matrix of users having both; the diagonal is users per type."""
+    bits = bit_matrix(pd.to_numeric(my_gym['equipment_mask']).to_numpy())
+    matrix = pd.DataFrame(bits.T @ bits, index=EQUIPMENT, columns=EQUIPMENT)
+    matrix.index.name = 'equipment'
+    return matrix
@@ -0,0 +1,357 @@
+"""
+Per-table extractors for the Firebase `/users` snapshot.
+
+`run_extractors` walks the users once and hands each `userInfo` to every
+extractor, so the missing-userInfo and flagged-email checks run once per user
+instead of once per output table. Each extractor keeps its own table, audit
+rows and skip counters, which keeps the audit log in the same per-section
+order as before. New output tables are added by subclassing `Extractor`.
+"""
+
+import copy
+import time
+import pandas as pd
+from collections import Counter
+from datetime import datetime, timedelta
+
+import equipment
+from audit_log import AuditLog
+from cleaning_rules import active_rules
+from metrics import log, trace
+from table_builder import TableBuilder
+
+EPOCH = datetime(1970, 1, 1)
+# Purchase dates must convert to a `datetime` to be compared with now; both dates must fit in int64
+MIN_MS = (datetime.min - EPOCH) // timedelta(milliseconds=1)
+MAX_MS = (datetime.max - EPOCH) // timedelta(milliseconds=1)
+INT64_MAX = 2 ** 63 - 1
+
+
+def is_flagged(user_id, user_info):
+    """Check if a user should be filtered out based on their email or user ID."""
+    return active_rules().is_flagged(user_id, user_info)
+
+
+class Extractor:
+    """Base class for one output table built from `userInfo` records."""
+
+    section = None  # Section name used in the audit log
+    label = None  # Short name used in debug output
+    columns = []
+    kinds = {}  # Compact column storage, see TableBuilder
+
+    def __init__(self):
+        self.table = TableBuilder(self.columns, self.kinds)
+        self.audit = AuditLog()
+        self.counts = Counter()
+        self.seconds = 0.0  # Time spent extracting, summed over workers
+
+    def log(self, user_id, action, reason, details):
+        self.audit.log(user_id, self.section, action, reason, details)
+
+    def skip_missing_userinfo(self, user_id):
+        self.counts['total_users'] += 1
+        self.counts['skipped_no_userinfo'] += 1
+        self.log(user_id, 'Skipped', 'Missing userInfo', 'No userInfo field in JSON')
+        trace(f"Skipping user {user_id} - no userInfo ({self.label})")
+
+    def skip_flagged(self, user_id, email):
+        self.counts['total_users'] += 1
+        self.counts['skipped_flagged'] += 1
+        self.log(user_id, 'Skipped', 'Flagged email', f"Email: {email}")
+        trace(f"Skipping user {user_id} - flagged (email: {email}) ({self.label})")
+
+    def process(self, user_id, user_info):
+        self.counts['total_users'] += 1
+        self.extract(user_id, user_info)
+
+    def extract(self, user_id, user_info):
+        """Append the table and audit rows for one non-flagged user."""
+        raise NotImplementedError
+
+    def finish(self):
+        """Run whole-table checks after every user has been seen."""
+
+    def finish_timed(self):
+        """`finish`, with its time added to `seconds`."""
+        start = time.perf_counter()
+        self.finish()
+        self.seconds += time.perf_counter() - start
+
+    def empty_copy(self):
+        """Return an extractor with the same configuration but no rows or counts."""
+        clone = copy.copy(self)
+        clone.table = TableBuilder(self.columns, self.kinds)
+        clone.audit = AuditLog()
+        clone.counts = Counter()
+        clone.seconds = 0.0
+        return clone
+
+    def mark(self):
+        """Remember the current position so `emitted_since` can report what a user added."""
+        return len(self.table), len(self.audit), self.counts.copy()
+
+    def emitted_since(self, mark):
+        """Return the table rows, audit rows and counter increments added after `mark`."""
+        table_len, audit_len, counts = mark
+        return self.table.rows(table_len), self.audit.rows(audit_len), dict(self.counts - counts)
+
+    def replay(self, emitted):
+        """Re-add output previously captured with `emitted_since`."""
+        rows, audit_rows, counts = emitted
+        self.table.extend(rows)
+        self.audit.extend(audit_rows)
+        self.counts.update(counts)
+
+    def to_frame(self):
+        return self.table.to_frame()
+
+    def log_summary(self):
+        log('DEBUG', f"{self.section} - Total users: {self.counts['total_users']}")
+        log('DEBUG', f"{self.section} - Skipped (no userInfo): {self.counts['skipped_no_userinfo']}")
+        log('DEBUG', f"{self.section} - Skipped (flagged): {self.counts['skipped_flagged']}")
+
+
+class SubscriptionsExtractor(Extractor):
+    """Transaction history from `latestReceiptInfo`, with timestamp checks."""
+
+    section = 'Subscriptions'
+    label = 'subscriptions'
+    columns = [
+        'user_id', 'purchase_date', 'expiration_date',
+        'original_purchase_date', 'product_id', 'num_transactions'
+    ]
+    kinds = {
+        'purchase_date': 'int', 'expiration_date': 'int', 'original_purchase_date': 'int',
+        'product_id': 'category', 'num_transactions': 'int',
+    }
+
+    def extract(self, user_id, user_info):
+        if 'latestReceiptInfo' not in user_info:
+            return
+        transactions = user_info['latestReceiptInfo']
+        num_transactions = len(transactions)
+        now_us = (datetime.now() - EPOCH) // timedelta(microseconds=1)
+        for y in transactions:
+            if not isinstance(y, dict):
+                trace(f"Skipping invalid transaction for user {user_id}: {y}")
+                self.counts['total_invalid_transactions'] += 1
+                self.log(user_id, 'Skipped', 'Invalid transaction', f"Transaction data: {y}")
+                continue
+            purchase_ms = y.get('purchase_date_ms')
+            expires_ms = y.get('expires_date_ms')
+            if purchase_ms and expires_ms:
+                # Compared as integers; converting each receipt to a Timestamp cost more than the rest of extraction
+                try:
+                    purchase = int(purchase_ms)
+                    expires = int(expires_ms)
+                    invalid = (not (MIN_MS <= purchase <= MAX_MS and -INT64_MAX <= expires <= INT64_MAX)
+                               or purchase * 1000 > now_us or expires < purchase)
+                except (ValueError, TypeError):
+                    invalid = True
+                if invalid:
+                    self.log(user_id, 'Flagged', 'Invalid timestamp', f"Purchase: {purchase_ms}, Expires: {expires_ms}")
+            self.table.append([
+                user_id, purchase_ms, expires_ms, y.get('original_purchase_date_ms'),
+                y.get('product_id'), num_transactions
+            ])
+        self.counts['processed'] += 1
+        self.log(user_id, 'Processed', 'Valid data', f"Transactions: {num_transactions}")
+
+    def finish(self):
+        # Check for duplicate user_ids in subscriptions: one count per user, flagged in order of first appearance
+        entries = Counter(self.table.column('user_id'))
+        for user_id, count in entries.items():
+            if count > 1:
+                self.log(user_id, 'Flagged', 'Duplicate user ID', f"Found {count} entries")
+
+    def log_summary(self):
+        super().log_summary()
+        log('DEBUG', f"Subscriptions - Processed users: {self.counts['processed']}")
+        log('DEBUG', f"Subscriptions - Total invalid transactions skipped: {self.counts['total_invalid_transactions']}")
+
+
+class UserProfilesExtractor(Extractor):
+    """Profile fields from `userInfo`, with completeness checks."""
+
+    section = 'User Profiles'
+    label = 'user_profiles'
+    columns = [
+        'user_id', 'email', 'country', 'city', 'height', 'weight', 'gender', 'age', 'active', 'level'
+    ]
+    kinds = {'country': 'category', 'city': 'category', 'gender': 'category', 'active': 'category', 'level': 'category'}
+
+    def extract(self, user_id, user_info):
+        profile = [user_id] + [user_info.get(col) for col in self.columns[1:]]
+        missing_fields = [col for col, val in zip(self.columns[1:], profile[1:]) if pd.isna(val) or val == '']
+        if len(missing_fields) > 3:  # Arbitrary threshold for "incomplete"
+            self.log(user_id, 'Flagged', 'Incomplete profile', f"Missing: {', '.join(missing_fields)}")
+        height = profile[4]
+        if height and not isinstance(height, (int, float)):
+            self.log(user_id, 'Flagged', 'Data type mismatch', f"Height: {height}")
+        self.table.append(profile)
+        self.counts['processed'] += 1
+        self.log(user_id, 'Processed', 'Valid data', 'Profile data extracted')
+
+    def log_summary(self):
+        super().log_summary()
+        log('DEBUG', f"User Profiles - Processed users: {self.counts['processed']}")
+
+
+preference_mapping = {
+    'A': 'Full Gym', 'N': 'Bodyweight', 'DA': 'Dumbbells', 'KA': 'Kettlebells', 'K': 'Kettlebells',
+    'B': 'Barbell & Plates', 'C': 'Cable Machines', 'J': 'Boxes', 'M': 'Med Ball', 'S': 'Swiss Ball',
+    'R': 'Bands', 'HB': 'Hexbar', 'H': 'Hexbar', 'X': 'Back Extension Machine', 'Y': 'Assault Bike',
+    'P': 'Weighted Plate', 'D': 'Dumbbells'
+}
+
+# Equipment bit for each normalized code (see equipment.py)
+preference_bits = {code: equipment.BITS[name] for code, name in preference_mapping.items()}
+
+possible_preference_fields = ['myGym', 'myGymPreferences', 'gymPreferences', 'my_gym_preferences']
+
+
+class MyGymExtractor(Extractor):
+    """Normalized and translated gym equipment preferences."""
+
+    section = 'My Gym'
+    label = 'my_gym'
+    columns = ['user_id', 'creation_date', 'preferences', 'translated', 'equipment_mask']
+    kinds = {'preferences': 'category', 'translated': 'category', 'equipment_mask': 'int'}
+
+    def __init__(self, user_store, join_creation_dates=True):
+        """Look up `creation_date` in a `UserStore`.
+
+        With `join_creation_dates` the dates are attached to the finished table
+        in one vectorized join; otherwise each user is looked up as it is
+        extracted.
+        """
+        super().__init__()
+        self.user_store = user_store
+        self.join_creation_dates = join_creation_dates
+        self._normalized = {}
+
+    def extract(self, user_id, user_info):
+        preferences = None
+        found_field = None
+        for field in possible_preference_fields:
+            if field in user_info:
+                preferences = user_info[field]
+                found_field = field
+                break
+
+        if preferences is None:
+            self.counts['skipped_no_preferences'] += 1
+            self.log(user_id, 'Skipped', 'No preferences field', f"Tried fields: {possible_preference_fields}")
+            return
+
+        if not isinstance(preferences, (list, str)):
+            self.counts['skipped_invalid_preferences'] += 1
+            self.log(user_id, 'Skipped', 'Invalid preferences type', f"Field {found_field}: {preferences}")
+            trace(f"Skipping user {user_id} - {found_field} is not a list or string: {preferences}")
+            return
+
+        audit_entries, preferences_str, translated_str, equipment_mask = self._normalize(preferences)
+        for action, reason, details in audit_entries:
+            self.log(user_id, action, reason, details)
+
+        if preferences_str is not None:
+            creation_date = None if self.join_creation_dates else self.user_store.creation_date(user_id)
+            self.table.append([user_id, creation_date, preferences_str, translated_str, equipment_mask])
+            self.counts['processed'] += 1
+            self.log(user_id, 'Processed', 'Valid data', f"Preferences: {preferences_str}")
+        else:
+            self.counts['skipped_no_preferences'] += 1
+            self.log(user_id, 'Skipped', 'No valid preferences', 'Empty after normalization')
+
+    def _normalize(self, preferences):
+        """Normalize one raw preference string or list, memoized per distinct value.
+
+        Most users pick from a handful of combinations, so the same raw
+        values recur. Returns `(audit entries, preferences, translated,
+        equipment mask)`, with `preferences` None if nothing valid is left.
+        """
+        # Strings and tuples never compare equal, so one dict serves both shapes
+        key = preferences if isinstance(preferences, str) else tuple(preferences)
+        try:
+            cached = self._normalized.get(key)
+        except TypeError:  # Unhashable list items; normalize without caching
+            key = cached = None
+        if cached is not None:
+            return cached
+
+        if isinstance(preferences, str):
+            pref_list = [pref.strip() for pref in preferences.split(',')]
+        else:
+            pref_list = preferences
+        audit_entries = []
+        normalized_prefs = []
+        for pref in pref_list:
+            if not pref:
+                continue
+            pref = pref.strip().upper()
+            if pref not in preference_mapping and pref not in ['D', 'KA']:
+                audit_entries.append(('Flagged', 'Unmapped preference', f"Preference: {pref}"))
+            if pref == 'D':
+                pref = 'DA'
+                audit_entries.append(('Modified', 'Normalized preference', 'D -> DA'))
+            if pref == 'KA':
+                pref = 'K'
+                audit_entries.append(('Modified', 'Normalized preference', 'KA -> K'))
+            normalized_prefs.append(pref)
+
+        deduped_prefs = list(dict.fromkeys(normalized_prefs))
+        preferences_str = ','.join(deduped_prefs) if deduped_prefs else None
+        translated_str = ','.join(preference_mapping.get(pref, '') for pref in deduped_prefs)
+        equipment_mask = 0
+        for pref in deduped_prefs:
+            equipment_mask |= preference_bits.get(pref, 0)
+        result = (tuple(audit_entries), preferences_str, translated_str, equipment_mask)
+        if key is not None:
+            self._normalized[key] = result
+        return result
+
+    def to_frame(self):
+        my_gym = self.table.to_frame()
+        if self.join_creation_dates:
+            self.user_store.attach(my_gym, 'creation_date')
+        return my_gym
+
+    def log_summary(self):
+        super().log_summary()
+        log('DEBUG', f"My Gym - Skipped (no gym preferences field): {self.counts['skipped_no_preferences']}")
+        log('DEBUG', f"My Gym - Skipped (invalid preferences type): {self.counts['skipped_invalid_preferences']}")
+        log('DEBUG', f"My Gym - Processed users: {self.counts['processed']}")
+
+
+def dispatch_user(user_id, record, extractors):
+    """Send one user's `userInfo` to each extractor, or record why it was skipped."""
+    if 'userInfo' not in record:
+        for extractor in extractors:
+            extractor.skip_missing_userinfo(user_id)
+        return
+    user_info = record['userInfo']
+    if is_flagged(user_id, user_info):
+        email = user_info.get('email', 'N/A')
+        for extractor in extractors:
+            extractor.skip_flagged(user_id, email)
+        return
+    for extractor in extractors:
+        start = time.perf_counter()
+        extractor.process(user_id, user_info)
+        extractor.seconds += time.perf_counter() - start
+
+
+def run_extractors(users, extractors):
+    """Visit every user once, sending its `userInfo` to each extractor.
+
+    `users` is any iterable of `(user_id, record)` pairs, such as
+    `data.items()` or a streamed snapshot. Returns the number of users seen.
+    """
+    total_users = 0
+    for user_id, record in users:
+        total_users += 1
+        dispatch_user(user_id, record, extractors)
+    for extractor in extractors:
+        extractor.finish_timed()
+    return total_users
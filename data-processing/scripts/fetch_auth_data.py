@@ -1,50 +1,155 @@
+"""
+Fetches user authentication data from Firebase Auth and saves it as a CSV.
+
+Users are listed in pages of 1000. The next page is requested in a background
+thread while the current one is converted, and each page is appended to the
+CSV as soon as it is converted, so fetches overlap with the local work and
+memory stays bounded by a page.
+"""
+
 import os
 import pandas as pd
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import auth
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-print("DEBUG: Current working directory:", os.getcwd())
-print("DEBUG: Does 'data/raw/auth' folder exist?", os.path.exists("data/raw/auth"))
-
-cred = credentials.Certificate('config/firebase_admin_key.json')
-firebase_admin.initialize_app(cred)
-
-batch_size = 1000
-page = auth.list_users(max_results=batch_size)
-
-df = pd.DataFrame(columns=['user_id', 'email', 'creation_date', 'last_sign_in'])
-
-# Iterate over all users
-user_count = 0
-while page:
-    for user in page.users:
-        user_count += 1
-        df.loc[len(df)] = [
-            user.uid,
-            user.email,
-            user.user_metadata.creation_timestamp,
-            user.user_metadata.last_sign_in_timestamp
-        ]
-    page = page.get_next_page()
-
-print(f"DEBUG: Total users fetched: {user_count}")
-
-# Remove fake emails
-fake_emails = ['uatbuild.com', 'uat.com']
-df['email'] = df['email'].astype(str)
-for e in fake_emails:
-    mask = ~df['email'].str.endswith(e)
-    df = df[mask]
-
-# Convert timestamps
-df.creation_date = pd.to_datetime(df.creation_date, unit='ms', origin='unix')
-df.last_sign_in = pd.to_datetime(df.last_sign_in, unit='ms', origin='unix')
-
-# Prepare output path
-file_path = f"data/raw/auth/{date.today()}.csv"
-print("DEBUG: Will write auth CSV to:", os.path.abspath(file_path))
-
-df.to_csv(file_path, index=False)
-print("Uploaded auth data to", file_path)
+BATCH_SIZE = 1000
+
+
+def iter_pages(auth, batch_size=BATCH_SIZE, prefetch=True):
+    """Yield every page of `auth.list_users`, prefetching page N+1 while page N is used."""
+    page = auth.list_users(max_results=batch_size)
+    if not prefetch:
+        while page:
+            yield page
+            page = page.get_next_page()
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while page:
+            next_page = executor.submit(page.get_next_page)
+            yield page
+            page = next_page.result()
+
+
+COLUMNS = ['user_id', 'email', 'creation_date', 'last_sign_in']
+TIMESTAMP_COLUMNS = ['creation_date', 'last_sign_in']
+FAKE_EMAILS = ['uatbuild.com', 'uat.com']
+
+# pandas writes a datetime column at the finest resolution found anywhere in it:
+# milliseconds, whole seconds, or dates only when every value is midnight.
+RESOLUTIONS = ['date', 's', 'ms']
+TIMESTAMP_FORMATS = {'date': '%Y-%m-%d', 's': '%Y-%m-%d %H:%M:%S', 'ms': '%Y-%m-%d %H:%M:%S.%f'}
+
+
+def _resolution(timestamps):
+    """Finest resolution pandas would need to write these timestamps."""
+    timestamps = timestamps.dropna()
+    if timestamps.empty:
+        return 'date'
+    if (timestamps.dt.microsecond != 0).any():
+        return 'ms'
+    if ((timestamps.dt.hour != 0) | (timestamps.dt.minute != 0) | (timestamps.dt.second != 0)).any():
+        return 's'
+    return 'date'
+
+
+def _format_timestamps(timestamps, resolution):
+    formatted = timestamps.dt.strftime(TIMESTAMP_FORMATS[resolution])
+    if resolution == 'ms':
+        formatted = formatted.str[:-3]
+    return formatted.astype(object).where(timestamps.notna(), None)
+
+
+def convert_page(users):
+    """Turn one page of `ExportedUserRecord`s into filtered rows with parsed timestamps."""
+    df = pd.DataFrame(
+        [[user.uid, user.email, user.user_metadata.creation_timestamp, user.user_metadata.last_sign_in_timestamp]
+         for user in users],
+        columns=COLUMNS, dtype=object
+    )
+
+    # Remove fake emails
+    df['email'] = df['email'].astype(str)
+    for e in FAKE_EMAILS:
+        mask = ~df['email'].str.endswith(e)
+        df = df[mask]
+
+    # Convert timestamps
+    df.creation_date = pd.to_datetime(df.creation_date, unit='ms', origin='unix')
+    df.last_sign_in = pd.to_datetime(df.last_sign_in, unit='ms', origin='unix')
+    return df
+
+
+def _reformat_file(file_path, resolutions):
+    """Rewrite the timestamp columns of an already written CSV at `resolutions`."""
+    tmp_path = f"{file_path}.tmp"
+    chunks = pd.read_csv(file_path, dtype=str, keep_default_na=False, chunksize=100_000)
+    with open(tmp_path, 'w', newline='') as out:
+        out.write(','.join(COLUMNS) + os.linesep)
+        for chunk in chunks:
+            for col in TIMESTAMP_COLUMNS:
+                chunk[col] = _format_timestamps(pd.to_datetime(chunk[col].replace('', None), format='ISO8601'), resolutions[col])
+            chunk.to_csv(out, header=False, index=False)
+    os.replace(tmp_path, file_path)
+
+
+def fetch_auth_data(auth, file_path, batch_size=BATCH_SIZE, prefetch=True):
+    """List every Firebase Auth user, drop fake emails and write the CSV to `file_path`.
+
+    Each page is filtered, converted and appended to the CSV as soon as it
+    arrives, so memory is bounded by one page. The file only appears at
+    `file_path` once the last page is written; if listing fails part-way
+    nothing is left there. Timestamps are written at the finest resolution
+    seen so far; in the rare case a later page needs a finer one than the
+    pages already written, those rows are reformatted once at the end so the
+    file matches a whole-frame `to_csv`.
+    """
+    print("DEBUG: Will write auth CSV to:", os.path.abspath(file_path))
+    resolutions = {col: 'date' for col in TIMESTAMP_COLUMNS}
+    needs_reformat = False
+    user_count = 0
+    rows_written = 0
+    # A truncated export at the final path would be picked up as the latest one
+    tmp_path = f"{file_path}.tmp"
+    try:
+        with open(tmp_path, 'w', newline='') as f:
+            f.write(','.join(COLUMNS) + os.linesep)
+            for page in iter_pages(auth, batch_size, prefetch):
+                user_count += len(page.users)
+                df = convert_page(page.users)
+                if df.empty:
+                    continue
+                for col in TIMESTAMP_COLUMNS:
+                    page_resolution = _resolution(df[col])
+                    if RESOLUTIONS.index(page_resolution) > RESOLUTIONS.index(resolutions[col]):
+                        needs_reformat = needs_reformat or rows_written > 0
+                        resolutions[col] = page_resolution
+                    df[col] = _format_timestamps(df[col], resolutions[col])
+                df.to_csv(f, header=False, index=False)
+                rows_written += len(df)
+
+        print(f"DEBUG: Total users fetched: {user_count}")
+        if needs_reformat:
+            print("DEBUG: Timestamp resolution changed part-way through; reformatting earlier rows")
+            _reformat_file(tmp_path, resolutions)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, file_path)
+    print("Uploaded auth data to", file_path)
+    return user_count
+
+
+def main():
+    from firebase_admin import auth
+    from fetch_firebase_data import initialize_app
+
+    print("DEBUG: Current working directory:", os.getcwd())
+    print("DEBUG: Does 'data/raw/auth' folder exist?", os.path.exists("data/raw/auth"))
+
+    initialize_app()
+
+    fetch_auth_data(auth, f"data/raw/auth/{date.today()}.csv")
+
+
+if __name__ == '__main__':
+    main()
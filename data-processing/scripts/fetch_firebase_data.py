@@ -1,61 +1,155 @@
-import os
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import db
-import json
-from datetime import date
-
-print("DEBUG: Current working directory:", os.getcwd())
-print("DEBUG: Does 'data/raw/json' folder exist?", os.path.exists("data/raw/json"))
-
 """
 Fetches user data from Firebase Realtime Database and saves it as a JSON file.
 
 This script connects to the Firebase Realtime Database, retrieves user data, and saves it as a JSON file for further processing in the Klein Data Pipeline.
+
+By default the snapshot goes into the sharded, deduplicated store in
+`data/raw/store/` (see snapshot_store.py); `--json` writes the single
+`data/raw/json/YYYY-MM-DD.json` file instead.
+
+With `shards` > 1 the `/users` keys are listed with a shallow read, split
+into contiguous key ranges, and the ranges are fetched in parallel instead of
+as one huge `get()`.
 """
 
+import argparse
 import os
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import db
 import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-# Debug: Check working directory and folder existence
-print("DEBUG: Current working directory:", os.getcwd())
-print("DEBUG: Does 'data/raw/json' folder exist?", os.path.exists("data/raw/json"))
-
-# Initialize Firebase Admin
-cred = credentials.Certificate("config/firebase_admin_key.json")
-# Note: Sensitive Firebase credentials are hidden for security.
-config = {
-    "apiKey": "HIDDEN_FOR_SECURITY",
-    "authDomain": "HIDDEN_FOR_SECURITY",
-    "databaseURL": "HIDDEN_FOR_SECURITY",
-    "projectId": "HIDDEN_FOR_SECURITY",
-    "storageBucket": "HIDDEN_FOR_SECURITY",
-    "databaseAuthVariableOverride": {
-        'uid': 'HIDDEN_FOR_SECURITY'
-    }
-}
-
-app = firebase_admin.initialize_app(cred, config)
-
-# Fetch data from /users endpoint
-userDict = db.reference("/users/").get()
-print("DEBUG: Fetched data type:", type(userDict))
-if userDict:
-    print("DEBUG: Number of keys in userDict:", len(userDict))
-    # Uncomment next line to see all keys (may be large):
-    # print("DEBUG: userDict keys:", list(userDict.keys()))
-else:
-    print("DEBUG: userDict is empty or None")
-
-# Prepare to write JSON
-file_path = f"data/raw/json/{date.today()}.json"
-print("DEBUG: Will write JSON to:", os.path.abspath(file_path))
-
-# Write JSON to file
-with open(file_path, "w") as f:
-    json.dump(userDict, f, indent=4)
-    print("Wrote data to", file_path)
+from snapshot_store import DEFAULT_STORE_DIR, SnapshotStore
+
+DEFAULT_SHARDS = 8
+INT_KEY = re.compile(r'0|-?[1-9][0-9]{0,9}')  # Integers as written canonically: no '07' or '-0'
+
+
+def key_order(key):
+    """Sort key for the RTDB `order_by_key` order.
+
+    Keys that parse as 32-bit integers come first, in numeric order, then
+    every other key in string order.
+    """
+    if INT_KEY.fullmatch(key) and -2 ** 31 <= int(key) < 2 ** 31:
+        return 0, int(key), ''
+    return 1, 0, key
+
+
+def key_ranges(keys, shards):
+    """Split keys into at most `shards` contiguous `(first, last)` ranges in `order_by_key` order."""
+    keys = sorted(keys, key=key_order)
+    size = -(-len(keys) // shards) if keys else 0
+    return [(keys[i], keys[min(i + size, len(keys)) - 1]) for i in range(0, len(keys), size or 1)]
+
+
+def fetch_users(db, shards=DEFAULT_SHARDS):
+    """Return the `/users` tree, fetched in `shards` parallel key-range queries."""
+    ref = db.reference("/users/")
+    if shards <= 1:
+        return ref.get()
+    keys = ref.get(shallow=True)
+    if not keys:
+        return keys
+    ranges = key_ranges(keys, shards)
+    print(f"DEBUG: Fetching {len(keys)} users in {len(ranges)} key ranges")
+
+    def fetch_range(key_range):
+        first, last = key_range
+        return ref.order_by_key().start_at(first).end_at(last).get()
+
+    user_dict = {}
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        # Merged in key order, the same order a single get() returns
+        for chunk in executor.map(fetch_range, ranges):
+            user_dict.update(chunk or {})
+    return user_dict
+
+
+def fetch_firebase_data(db, file_path, shards=DEFAULT_SHARDS):
+    """Fetch `/users` and write it to `file_path`."""
+    userDict = fetch_users(db, shards)
+    print("DEBUG: Fetched data type:", type(userDict))
+    if userDict:
+        print("DEBUG: Number of keys in userDict:", len(userDict))
+        # Uncomment next line to see all keys (may be large):
+        # print("DEBUG: userDict keys:", list(userDict.keys()))
+    else:
+        print("DEBUG: userDict is empty or None")
+
+    # Prepare to write JSON
+    print("DEBUG: Will write JSON to:", os.path.abspath(file_path))
+
+    # Write JSON to file
+    with open(file_path, "w") as f:
+        json.dump(userDict, f, indent=4)
+        print("Wrote data to", file_path)
+    return len(userDict) if userDict else 0
+
+
+def fetch_to_store(db, store, snapshot_date, shards=DEFAULT_SHARDS):
+    """Fetch `/users` and add it to `store` as the snapshot for `snapshot_date`."""
+    userDict = fetch_users(db, shards)
+    print("DEBUG: Number of keys in userDict:", len(userDict) if userDict else 0)
+    stats = store.write(snapshot_date, (userDict or {}).items())
+    print(f"Wrote snapshot {snapshot_date} to {store.root}: {stats['users']} users in {stats['shards']} shards "
+          f"({stats['new_shards']} new, {stats['stored_bytes'] / 1e6:.1f} MB compressed)")
+    return stats['users']
+
+
+_app_lock = threading.Lock()
+
+
+def initialize_app():
+    """Initialize the default Firebase app once per process and return it.
+
+    Both fetches use it, so when the pipeline runs them in one interpreter the
+    credentials are loaded and the app is set up only once.
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _app_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+        cred = credentials.Certificate("config/firebase_admin_key.json")
+        # Note: Sensitive Firebase credentials are hidden for security.
+        config = {
+            "apiKey": "HIDDEN_FOR_SECURITY",
+            "authDomain": "HIDDEN_FOR_SECURITY",
+            "databaseURL": "HIDDEN_FOR_SECURITY",
+            "projectId": "HIDDEN_FOR_SECURITY",
+            "storageBucket": "HIDDEN_FOR_SECURITY",
+            "databaseAuthVariableOverride": {
+                'uid': 'HIDDEN_FOR_SECURITY'
+            }
+        }
+        return firebase_admin.initialize_app(cred, config)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch the RTDB /users tree.")
+    parser.add_argument('--json', action='store_true',
+                        help="Write data/raw/json/YYYY-MM-DD.json instead of adding the snapshot to the store")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    args = parser.parse_args(argv)
+
+    from firebase_admin import db
+
+    # Debug: Check working directory and folder existence
+    print("DEBUG: Current working directory:", os.getcwd())
+    print("DEBUG: Does 'data/raw/json' folder exist?", os.path.exists("data/raw/json"))
+
+    initialize_app()
+
+    if args.json:
+        fetch_firebase_data(db, f"data/raw/json/{date.today()}.json")
+    else:
+        fetch_to_store(db, SnapshotStore(args.store), str(date.today()))
+
+
+if __name__ == '__main__':
+    main()
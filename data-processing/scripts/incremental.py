@@ -0,0 +1,312 @@
+"""
+Incremental extraction keyed on the snapshot store's content-addressed shards.
+
+Only a small share of users change between daily snapshots, and a user who is
+added, changed or removed only changes the shard it falls in (see
+`snapshot_store.py`). The state file keeps the previous run's tables and audit
+logs as they were built, in snapshot order, and for each user a hash of their
+stored line, how many rows they added to each and their counter increments.
+It also maps each shard ID to the users it held.
+
+A shard whose ID was seen last run is neither read nor hashed. In a shard with
+a new ID the lines are hashed, and only the users whose line changed, or who
+are new, are decoded and extracted. Every other user's rows are copied from
+the previous tables a run of consecutive users at a time, a column at a time,
+so a day with few changes copies a few long runs. Rows stay in snapshot order
+and the whole-table checks (`Extractor.finish`) still run over the finished
+tables, so the CSVs are the same as a full run. `my_gym` creation dates are
+joined from the current auth data after extraction, so they are never stale.
+
+Stored snapshots get their shard IDs from the manifest. A JSON snapshot is cut
+at the same user IDs and each shard hashed the way the store would hash it,
+which serializes every user, so it shares the state with the stored copy of
+the same snapshot.
+
+The state is tied to a fingerprint of the extraction code (`extractors.py`,
+`audit_log.py` and `cleaning_rules.py`) and the cleaning rules file; if any of
+them changes the state is discarded and every user is re-extracted. Run with
+`--full` to force that, e.g. after a long gap, since a purchase flagged as "in
+the future" stays flagged until the user changes.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from array import array
+from collections import Counter
+from itertools import accumulate
+
+import numpy as np
+
+import audit_log
+import cleaning_rules
+import extractors as extractors_module
+from extractors import dispatch_user
+from metrics import log
+from snapshot_store import DEFAULT_SHARD_USERS, content_id, encode_user, starts_shard
+
+STATE_VERSION = 2
+DEFAULT_STATE_PATH = 'data/processed/.incremental_state.pkl'
+HASH_SIZE = 8  # Bytes of each user's line hash
+STATE_FIELDS = ['sections', 'shards', 'user_ids', 'hashes', 'outputs', 'table_rows', 'audit_rows', 'user_counts']
+
+
+def line_hash(line):
+    """Hash of one user's NDJSON line."""
+    return hashlib.blake2b(line, digest_size=HASH_SIZE).digest()
+
+
+def code_fingerprint():
+    """Hash of the extraction code and cleaning rules, so rule changes invalidate cached rows."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in (extractors_module.__file__, audit_log.__file__, cleaning_rules.__file__, cleaning_rules.rules_path()):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def store_shards(store, snapshot_date=None):
+    """Yield `(shard_id, users)` for a stored snapshot, where `users` reads the shard once iterated.
+
+    `users` yields `(user_id, line, None)`; records are only decoded for users that changed.
+    """
+    for shard in store.manifest(snapshot_date)['shards']:
+        yield shard['id'], ((user_id, line, None) for user_id, line in store.iter_shard(shard['id']))
+
+
+def snapshot_shards(users, shard_users=DEFAULT_SHARD_USERS):
+    """Cut `(user_id, record)` pairs into the shards `SnapshotStore.write` would store.
+
+    Yields `(shard_id, users)` with `users` a list of `(user_id, line, record)`.
+    """
+    shard = []
+    for user_id, record in users:
+        if shard and starts_shard(user_id, shard_users):
+            yield content_id(b''.join(line for _, line, _ in shard)), shard
+            shard = []
+        shard.append((user_id, encode_user(user_id, record), record))
+    if shard:
+        yield content_id(b''.join(line for _, line, _ in shard)), shard
+
+
+_interned_counts = {}
+
+
+def _interned(counts):
+    """One shared dict per distinct set of counter increments; most users have one of a few."""
+    key = tuple(counts.items())
+    shared = _interned_counts.get(key)
+    if shared is None:
+        shared = _interned_counts[key] = dict(key)
+    return shared
+
+
+def _sum_counts(user_counts):
+    """Add up per-user counter increments, once per distinct (interned) dict."""
+    distinct = {id(counts): counts for counts in user_counts}
+    totals = Counter()
+    for counts_id, users in Counter(map(id, user_counts)).items():
+        for key, count in distinct[counts_id].items():
+            totals[key] += count * users
+    return totals
+
+
+class IncrementalState:
+    """The previous run's tables, with each user's rows, counters and line hash, and each shard's users."""
+
+    def __init__(self, sections=(), shards=None, user_ids=None, hashes=None, outputs=None, table_rows=None,
+                 audit_rows=None, user_counts=None, fingerprint=None):
+        self.sections = list(sections)
+        self.shards = shards if shards is not None else {}  # shard_id -> (first user, users)
+        self.user_ids = user_ids if user_ids is not None else []
+        self.hashes = hashes if hashes is not None else bytearray()  # HASH_SIZE bytes per user
+        # Per extractor: its (table, audit log), the rows each user added to them, and each user's counters
+        self.outputs = outputs if outputs is not None else []
+        self.table_rows = table_rows if table_rows is not None else [array('I') for _ in self.sections]
+        self.audit_rows = audit_rows if audit_rows is not None else [array('I') for _ in self.sections]
+        self.user_counts = user_counts if user_counts is not None else [[] for _ in self.sections]
+        self.fingerprint = fingerprint or code_fingerprint()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def hash(self, i):
+        return bytes(self.hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE])
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATE_PATH):
+        """Load the saved state, or return an empty one if it is missing or stale."""
+        if not os.path.exists(path):
+            log('DEBUG', f"No incremental state at {path}; processing every user")
+            return cls()
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"ERROR: Could not read incremental state {path}: {e}. Processing every user.")
+            return cls()
+        fingerprint = code_fingerprint()
+        if saved.get('version') != STATE_VERSION or saved.get('fingerprint') != fingerprint:
+            log('DEBUG', "Extraction code changed since the last run; processing every user")
+            return cls(fingerprint=fingerprint)
+        return cls(**{field: saved[field] for field in STATE_FIELDS}, fingerprint=fingerprint)
+
+    def save(self, path=DEFAULT_STATE_PATH):
+        """Write the state atomically so an interrupted run can't corrupt it."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'version': STATE_VERSION,
+                'fingerprint': self.fingerprint,
+                **{field: getattr(self, field) for field in STATE_FIELDS},
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def _positions(segments):
+    """Row positions covered by `[start, stop)` segments, in order."""
+    if not segments:
+        return np.array([], dtype=np.intp)
+    return np.concatenate([np.arange(start, stop) for start, stop in segments])
+
+
+class _Builder:
+    """Collects which rows make up each output table, then gathers them in one pass per table.
+
+    Changed and added users are extracted into empty copies of the
+    extractors. Each table is then taken from the previous one and the
+    copy's, read as one: rows of the previous table come first, so the
+    copy's rows are numbered after them. Segments of rows are recorded per
+    run of copied or extracted users, not per user.
+    """
+
+    def __init__(self, extractors, previous):
+        self.extractors = extractors
+        self.previous = previous
+        self.fresh = [extractor.empty_copy() for extractor in extractors]
+        self.state = IncrementalState([extractor.section for extractor in extractors], fingerprint=previous.fingerprint)
+        # Where each previous user's rows start in the previous tables, and where the copies' rows are numbered from
+        self.table_starts = [array('Q', accumulate(rows, initial=0)) for rows in previous.table_rows]
+        self.audit_starts = [array('Q', accumulate(rows, initial=0)) for rows in previous.audit_rows]
+        self.offsets = [(len(table), len(audit)) for table, audit in previous.outputs] or [(0, 0)] * len(extractors)
+        self.table_segments = [[] for _ in extractors]
+        self.audit_segments = [[] for _ in extractors]
+        self.run = None  # [start, stop) of previous users to copy next
+        self.lengths = [(0, 0)] * len(extractors)  # Rows in each copy's table and audit log so far
+        self.fresh_start = None  # `lengths` where the current run of extracted users began
+
+    def reuse(self, start, stop):
+        """Copy previous users `start:stop`, merged with the pending run if they follow it."""
+        self.end_fresh()
+        if self.run is not None and self.run[1] == start:
+            self.run[1] = stop
+            return
+        self.copy_run()
+        self.run = [start, stop]
+
+    def copy_run(self):
+        if self.run is None:
+            return
+        start, stop = self.run
+        self.run = None
+        previous, state = self.previous, self.state
+        state.user_ids.extend(previous.user_ids[start:stop])
+        state.hashes += previous.hashes[start * HASH_SIZE:stop * HASH_SIZE]
+        for k in range(len(self.extractors)):
+            self.table_segments[k].append((self.table_starts[k][start], self.table_starts[k][stop]))
+            self.audit_segments[k].append((self.audit_starts[k][start], self.audit_starts[k][stop]))
+            state.table_rows[k].extend(previous.table_rows[k][start:stop])
+            state.audit_rows[k].extend(previous.audit_rows[k][start:stop])
+            state.user_counts[k].extend(previous.user_counts[k][start:stop])
+
+    def extract(self, user_id, digest, record):
+        """Extract one user with the copies' counters cleared, so their increments can be kept per user."""
+        self.copy_run()
+        if self.fresh_start is None:
+            self.fresh_start = self.lengths
+        state, fresh = self.state, self.fresh
+        state.user_ids.append(user_id)
+        state.hashes += digest
+        for copy in fresh:
+            copy.counts.clear()
+        dispatch_user(user_id, record, fresh)
+        lengths = [(len(copy.table), copy.audit.logged) for copy in fresh]
+        for k, (copy, (table_len, audit_len), (table_before, audit_before)) in enumerate(
+                zip(fresh, lengths, self.lengths)):
+            state.table_rows[k].append(table_len - table_before)
+            state.audit_rows[k].append(audit_len - audit_before)
+            state.user_counts[k].append(_interned(copy.counts))
+        self.lengths = lengths
+
+    def end_fresh(self):
+        if self.fresh_start is None:
+            return
+        for k, ((table_offset, audit_offset), (table_start, audit_start), (table_len, audit_len)) in enumerate(
+                zip(self.offsets, self.fresh_start, self.lengths)):
+            self.table_segments[k].append((table_offset + table_start, table_offset + table_len))
+            self.audit_segments[k].append((audit_offset + audit_start, audit_offset + audit_len))
+        self.fresh_start = None
+
+    def finish(self):
+        """Gather every table and add up the counters; returns the new state."""
+        self.copy_run()
+        self.end_fresh()
+        for k, (extractor, copy) in enumerate(zip(self.extractors, self.fresh)):
+            tables, audits = [copy.table], [copy.audit]
+            if self.previous.outputs:
+                table, audit = self.previous.outputs[k]
+                tables, audits = [table, copy.table], [audit, copy.audit]
+            extractor.table.take(tables, _positions(self.table_segments[k]))
+            extractor.audit.take(audits, _positions(self.audit_segments[k]))
+            extractor.counts.update(_sum_counts(self.state.user_counts[k]))
+            extractor.seconds += copy.seconds
+        self.state.outputs = [(extractor.table, extractor.audit) for extractor in self.extractors]
+        return self.state
+
+
+def run_incremental(shards, extractors, state):
+    """Like `run_extractors`, but copies the rows of users unchanged since the last run.
+
+    `shards` yields `(shard_id, users)` as `store_shards` or `snapshot_shards`
+    do. Returns `(total_users, new_state, stats)` where `stats` counts the
+    users that were unchanged, changed, added and deleted, and the shards
+    reused whole and read.
+    """
+    if state.sections != [extractor.section for extractor in extractors]:
+        state = IncrementalState(fingerprint=state.fingerprint)
+    builder = _Builder(extractors, state)
+    index = None  # user_id -> position in the previous state, built once a shard has changed
+    stats = {'unchanged': 0, 'changed': 0, 'added': 0, 'deleted': 0, 'reused_shards': 0, 'read_shards': 0}
+    total_users = 0
+    for shard_id, users in shards:
+        cached = state.shards.get(shard_id)
+        first = total_users
+        if cached is not None:
+            start, count = cached
+            builder.reuse(start, start + count)
+            total_users += count
+            stats['unchanged'] += count
+            stats['reused_shards'] += 1
+        else:
+            if index is None:
+                index = {user_id: i for i, user_id in enumerate(state.user_ids)}
+            for user_id, line, record in users:
+                digest = line_hash(line)
+                i = index.get(user_id)
+                if i is not None and state.hash(i) == digest:
+                    builder.reuse(i, i + 1)
+                    stats['unchanged'] += 1
+                else:
+                    if record is None:
+                        _, record = json.loads(line)
+                    builder.extract(user_id, digest, record)
+                    stats['changed' if i is not None else 'added'] += 1
+                total_users += 1
+            stats['read_shards'] += 1
+        builder.state.shards[shard_id] = (first, total_users - first)
+    new_state = builder.finish()
+    stats['deleted'] = len(state) - stats['unchanged'] - stats['changed']
+    for extractor in extractors:
+        extractor.finish_timed()
+    return total_users, new_state, stats
@@ -0,0 +1,153 @@
+"""
+Log levels, timing spans, counters and memory sampling for the pipeline.
+
+Messages go through `log`, which prints `LEVEL: message` when the level is
+enabled. Per-user lines use `TRACE`, which is off by default: on a large
+snapshot printing one line per skipped user costs more than skipping them.
+The level comes from `--log-level` or `$KLEIN_LOG_LEVEL`.
+
+`Metrics` collects named spans (wall time and peak RSS while the span was
+open), counter groups and row counts, and writes them as one JSON report.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+LEVELS = {'ERROR': 40, 'INFO': 20, 'DEBUG': 10, 'TRACE': 5}
+DEFAULT_LEVEL = 'DEBUG'
+LEVEL_ENV = 'KLEIN_LOG_LEVEL'
+
+_level = LEVELS.get(os.environ.get(LEVEL_ENV, DEFAULT_LEVEL).upper(), LEVELS[DEFAULT_LEVEL])
+
+
+def set_level(name):
+    """Set the log level for this process and any worker processes it starts."""
+    global _level
+    _level = LEVELS[name.upper()]
+    os.environ[LEVEL_ENV] = name.upper()
+
+
+def enabled(level):
+    return LEVELS[level] >= _level
+
+
+def log(level, message):
+    if LEVELS[level] >= _level:
+        print(f"{level}: {message}")
+
+
+def trace(message):
+    """Per-user detail; only printed at `TRACE`."""
+    if LEVELS['TRACE'] >= _level:
+        print(f"TRACE: {message}")
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory, or 0 where it can't be read."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    """Resident memory right now, or the high-water mark where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+class Metrics:
+    """Timing spans, counters and memory samples for one run.
+
+    A background thread samples resident memory every `sample_interval`
+    seconds, so each span records the peak reached while it was open rather
+    than the process-wide high-water mark.
+    """
+
+    def __init__(self, sample_interval=0.05):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.rows = {}
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, args=(sample_interval,), daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        with self._lock:
+            for span in self._open:
+                span['peak_rss_mb'] = max(span['peak_rss_mb'], rss)
+
+    def _sample_loop(self, interval):
+        while not self._stop.wait(interval):
+            self._sample()
+
+    def _record(self, name, seconds, peak=None):
+        span = self.spans.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_rss_mb': None})
+        span['seconds'] += seconds
+        span['calls'] += 1
+        if peak is not None:
+            span['peak_rss_mb'] = max(span['peak_rss_mb'] or 0.0, peak)
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block as `name`; repeated spans accumulate."""
+        sample = {'peak_rss_mb': current_rss_mb()}
+        with self._lock:
+            self._open.append(sample)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._sample()
+            with self._lock:
+                # By identity: spans open in other threads may hold an equal dict
+                self._open = [other for other in self._open if other is not sample]
+            self._record(name, elapsed, sample['peak_rss_mb'])
+            log('DEBUG', f"{name} took {elapsed:.2f}s")
+
+    def add_span(self, name, seconds):
+        """Record time measured elsewhere, e.g. summed over worker processes."""
+        self._record(name, seconds)
+
+    def count(self, group, counts):
+        """Record a group of counters, such as an extractor's `counts`."""
+        self.counters[group] = {key: counts[key] for key in sorted(counts)}
+
+    def report(self, **extra):
+        self._stop.set()
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_seconds': time.perf_counter() - self._start,
+            'peak_rss_mb': peak_rss_mb(),
+            **extra,
+            'spans': self.spans,
+            'counters': self.counters,
+            'rows': self.rows,
+        }
+
+    def write(self, path, **extra):
+        """Write the JSON report to `path`."""
+        with open(path, 'w') as f:
+            json.dump(self.report(**extra), f, indent=2)
+            f.write('\n')
@@ -0,0 +1,249 @@
+"""
+In-process runner for the pipeline's stages as a dependency graph.
+
+Each `Stage` names the script module whose `main()` it calls and the stages
+it depends on. A stage starts as soon as its dependencies have finished, in a
+thread of the same interpreter. Stages that don't depend on each other run at
+the same time, and pandas and firebase_admin are imported once, by the first
+stage that needs them.
+
+A stage is skipped when its fingerprint is the same as on its last successful
+run and its outputs are still there, unchanged. The fingerprint hashes:
+- the code: the stage's module and every script it imports, followed
+  transitively;
+- the content of its input files, resolved once its dependencies are done;
+- its parameters (arguments, environment, date).
+
+Inputs are hashed by content, so if an upstream stage reruns and writes the
+same files, the stages after it are still skipped. File hashes are memoized
+by size and mtime in the cache file, so checking an unchanged stage costs a
+`stat` per file.
+
+The first stage to fail stops the run. Stages already running are allowed to
+finish and no new ones are started.
+"""
+
+import ast
+import glob
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import Metrics, log
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = 'data/processed/.pipeline_cache.json'
+CACHE_VERSION = 1
+
+
+def local_imports(module):
+    """Paths of `module` and every module in scripts/ it imports, directly or not."""
+    seen, pending = set(), [module]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(SCRIPTS_DIR, f"{name}.py")
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module.split('.')[0])
+    return sorted(os.path.join(SCRIPTS_DIR, f"{name}.py") for name in seen)
+
+
+def _expand(patterns):
+    """Files matching `patterns`, with directories expanded to the files under them."""
+    paths = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.isdir(path):
+                paths.update(os.path.join(directory, name)
+                             for directory, _, names in os.walk(path) for name in names)
+            else:
+                paths.add(path)
+    return sorted(paths)
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Stage:
+    """One pipeline step: `module.main(argv)` plus what its cache key is made of.
+
+    `inputs` are path patterns and `outputs` are paths, or callables
+    returning them, evaluated when the stage is about to run and once it has
+    finished. `params` are any other values the result depends on. A stage
+    with `cache=False` always runs.
+    """
+
+    def __init__(self, name, module, argv=None, deps=(), inputs=(), outputs=(), params=None, cache=True):
+        self.name = name
+        self.module = module
+        self.argv = argv
+        self.deps = list(deps)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.cache = cache
+
+    def input_paths(self):
+        return _expand(self.inputs() if callable(self.inputs) else self.inputs)
+
+    def output_paths(self):
+        return list(self.outputs() if callable(self.outputs) else self.outputs)
+
+    def run(self):
+        main = importlib.import_module(self.module).main
+        try:
+            if self.argv is None:
+                main()
+            else:
+                main(list(self.argv))
+        except SystemExit as e:
+            # The scripts report their own errors and exit(1)
+            if e.code not in (None, 0):
+                raise RuntimeError(f"{self.module}.main exited with status {e.code}") from None
+
+
+class Pipeline:
+    """Runs `stages` in dependency order, skipping those whose fingerprint is cached."""
+
+    def __init__(self, stages, cache_path=DEFAULT_CACHE_PATH):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'version': CACHE_VERSION, 'files': {}, 'stages': {}}
+        if cache.get('version') != CACHE_VERSION:
+            return {'version': CACHE_VERSION, 'files': {}, 'stages': {}}
+        return cache
+
+    def _save_cache(self):
+        self.cache['files'] = {path: known for path, known in self.cache['files'].items() if os.path.exists(path)}
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def file_hash(self, path):
+        """Content hash of `path`, reused while its size and mtime are unchanged."""
+        stat = _stat(path)
+        if stat is None:
+            return None
+        with self._lock:
+            known = self.cache['files'].get(path)
+        if known and known[:2] == stat:
+            return known[2]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+        with self._lock:
+            self.cache['files'][path] = stat + [digest]
+        return digest
+
+    def fingerprint(self, stage):
+        key = {
+            'code': {os.path.relpath(path, SCRIPTS_DIR): self.file_hash(path) for path in local_imports(stage.module)},
+            'inputs': {path: self.file_hash(path) for path in stage.input_paths()},
+            'argv': stage.argv,
+            'params': stage.params,
+        }
+        payload = json.dumps(key, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _is_cached(self, stage, fingerprint):
+        with self._lock:
+            entry = self.cache['stages'].get(stage.name)
+        if not entry or entry['fingerprint'] != fingerprint:
+            return False
+        return all(stat is not None and _stat(path) == stat for path, stat in entry['outputs'].items())
+
+    def _run_stage(self, stage, force, run_metrics):
+        """Run `stage` unless it is cached; returns `'cached'` or `'ran'`. Exceptions propagate."""
+        fingerprint = self.fingerprint(stage) if stage.cache else None
+        if stage.cache and not force and self._is_cached(stage, fingerprint):
+            log('INFO', f"Stage {stage.name}: up to date, skipped")
+            return 'cached'
+        log('INFO', f"Stage {stage.name}: running")
+        with self._lock:
+            self.cache['stages'].pop(stage.name, None)
+        with run_metrics.span(stage.name):
+            stage.run()
+        if stage.cache:
+            outputs = {path: _stat(path) for path in stage.output_paths()}
+            with self._lock:
+                self.cache['stages'][stage.name] = {'fingerprint': fingerprint, 'outputs': outputs}
+                self._save_cache()
+        return 'ran'
+
+    def run(self, force=(), skip=(), report_path=None):
+        """Run every stage; `force` names stages to rerun even if cached.
+
+        Stages in `skip` are not run and count as done for the stages after
+        them. Returns `{stage: status}` with statuses `ran`, `cached`,
+        `skipped`, `failed` or `not run`, and writes the per-stage timings to
+        `report_path`.
+        """
+        run_metrics = Metrics()
+        status = {name: 'skipped' if name in skip else 'not run' for name in self.stages}
+        seconds = {}
+        started, running = set(), {}
+        failed = False
+        with ThreadPoolExecutor(max_workers=len(self.stages) or 1) as pool:
+            while True:
+                if not failed:
+                    for name, stage in self.stages.items():
+                        if name in skip or name in started:
+                            continue
+                        if all(status[dep] in ('ran', 'cached', 'skipped') for dep in stage.deps):
+                            started.add(name)
+                            running[pool.submit(self._run_stage, stage, name in force, run_metrics)] = (name, time.perf_counter())
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start = running.pop(future)
+                    seconds[name] = time.perf_counter() - start
+                    error = future.exception()
+                    if error is None:
+                        status[name] = future.result()
+                    else:
+                        status[name] = 'failed'
+                        failed = True
+                        log('ERROR', f"Stage {name} failed after {seconds[name]:.1f}s: {error}")
+
+        with self._lock:
+            self._save_cache()
+        print(f"{'stage':<14} {'status':<8} {'seconds':>8}")
+        for name in self.stages:
+            elapsed = f"{seconds[name]:.2f}" if name in seconds else '-'
+            print(f"{name:<14} {status[name]:<8} {elapsed:>8}")
+        if report_path:
+            run_metrics.write(report_path, stages=status, stage_seconds=seconds)
+        return status
@@ -0,0 +1,112 @@
+"""
+Writes the processed tables as compressed Parquet with explicit schemas.
+
+The CSVs are untyped, so every consumer re-parses them: BigQuery loads them as
+`string_field_*` columns and the R scripts convert millisecond timestamps on
+every read. The Parquet copies carry the types instead: receipt timestamps as
+int64 epoch milliseconds, auth dates as real timestamps, and low-cardinality
+columns such as `product_id`, `country` and `gender` dictionary-encoded.
+
+Needs `pyarrow`, which is optional; the CSV outputs don't depend on it.
+"""
+
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed for --parquet
+    pa = None
+    pq = None
+
+PARQUET_DIR = 'data/processed/parquet'
+COMPRESSION = 'zstd'
+
+# Column types per table: 'string', 'dictionary', 'epoch_ms', 'int', 'float', 'timestamp'
+SCHEMAS = {
+    'auth_data': {
+        'user_id': 'string', 'email': 'string', 'creation_date': 'timestamp', 'last_sign_in': 'timestamp',
+    },
+    'subscriptions': {
+        'user_id': 'string', 'purchase_date': 'epoch_ms', 'expiration_date': 'epoch_ms',
+        'original_purchase_date': 'epoch_ms', 'product_id': 'dictionary', 'num_transactions': 'int',
+    },
+    'user_profiles': {
+        # Height, weight and age are free-form in Firebase (e.g. 5'11), so they stay strings
+        'user_id': 'string', 'email': 'string', 'country': 'dictionary', 'city': 'string',
+        'height': 'string', 'weight': 'string', 'gender': 'dictionary', 'age': 'string',
+        'active': 'dictionary', 'level': 'dictionary',
+    },
+    'my_gym': {
+        'user_id': 'string', 'creation_date': 'timestamp', 'preferences': 'string', 'translated': 'string',
+        'equipment_mask': 'int',
+    },
+    'user_equipment': {
+        'user_id': 'string', 'equipment': 'dictionary',
+    },
+    'equipment_counts': {
+        'equipment': 'string', 'bit': 'int', 'users': 'int', 'percentage_of_total': 'float',
+        'limited_users': 'int', 'percentage_of_limited': 'float',
+    },
+    'data_cleaning_audit': {
+        'user_id': 'string', 'section': 'dictionary', 'action': 'dictionary', 'reason': 'dictionary',
+        'details': 'string',
+    },
+}
+
+
+def available():
+    return pa is not None
+
+
+def _as_strings(series):
+    # Same text the CSV would hold for each value, with missing values as null
+    return [None if pd.isna(value) else str(value) for value in series.astype(object)]
+
+
+def _column(series, kind):
+    if kind == 'string':
+        return pa.array(_as_strings(series), type=pa.string())
+    if kind == 'dictionary':
+        return pa.array(_as_strings(series), type=pa.string()).dictionary_encode()
+    if kind in ('epoch_ms', 'int'):
+        numbers = pd.to_numeric(series, errors='coerce')
+        return pa.array(numbers.round().astype('Int64'), type=pa.int64())
+    if kind == 'float':
+        return pa.array(pd.to_numeric(series, errors='coerce').astype('float64'), type=pa.float64())
+    if kind == 'timestamp':
+        values = series.astype(object).where(series.notna(), None)
+        try:
+            dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+        except ValueError:  # Naive and timezone-aware values mixed; read them all as UTC
+            dates = pd.to_datetime(values, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+        return pa.array(dates.astype('datetime64[ms]'), type=pa.timestamp('ms'))
+    raise ValueError(f"Unknown column type: {kind}")
+
+
+def to_arrow(name, frame):
+    """Convert one processed table to an Arrow table using its explicit schema."""
+    schema = SCHEMAS[name]
+    arrays = [_column(frame[col], kind) for col, kind in schema.items()]
+    return pa.Table.from_arrays(arrays, names=list(schema))
+
+
+def write_table(name, frame, root=PARQUET_DIR, snapshot_date=None):
+    """Write one table and return its path.
+
+    With `snapshot_date` the file goes in a hive-style partition,
+    `<root>/<table>/snapshot_date=YYYY-MM-DD/part-0.parquet`, which BigQuery,
+    `pyarrow.dataset` and R's `arrow::open_dataset` all read as a column.
+    Otherwise it is written to `<root>/<table>.parquet`.
+    """
+    if snapshot_date:
+        directory = os.path.join(root, name, f"snapshot_date={snapshot_date}")
+        path = os.path.join(directory, 'part-0.parquet')
+    else:
+        directory = root
+        path = os.path.join(root, f"{name}.parquet")
+    os.makedirs(directory, exist_ok=True)
+    pq.write_table(to_arrow(name, frame), path, compression=COMPRESSION)
+    return path
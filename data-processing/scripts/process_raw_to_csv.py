@@ -3,360 +3,331 @@ Processes raw Firebase JSON and auth data into structured CSVs.
 """
 
 import sys
-import subprocess
+import argparse
+import cProfile
 import os
 import json
 import pandas as pd
-from datetime import datetime, date
 
-# Debug: Check the environment
-print("DEBUG: Checking environment...")
-print(f"Current directory: {os.getcwd()}")
+import cleaning_rules
+import equipment
+import metrics
+from audit_log import AuditLog
+from user_store import UserStore
+from snapshot_reader import iter_users
+from snapshot_store import DEFAULT_STORE_DIR, SnapshotStore
+from incremental import DEFAULT_STATE_PATH, IncrementalState, run_incremental, snapshot_shards, store_shards
+import parquet_writer
+from parallel import DEFAULT_SHARD_SIZE, run_parallel
+from extractors import (
+    SubscriptionsExtractor, UserProfilesExtractor, MyGymExtractor,
+    run_extractors
+)
 
-# Ensure required directories exist
-required_dirs = ['data/raw/json', 'data/raw/auth', 'data/processed']
-for dir_path in required_dirs:
-    if not os.path.exists(dir_path):
-        print(f"ERROR: Directory '{dir_path}' does not exist. Creating it...")
-        os.makedirs(dir_path)
-    print(f"'{dir_path}' exists: {os.path.exists(dir_path)}")
+AUDIT_CSV = 'data/processed/data_cleaning_audit.csv'
 
-# Define test accounts and flagged strings for filtering
-test_accounts = [
-    'jR3UB09kczdJQtCGtKHHkHjhVVO2', 
-    'QxjvzDIiQsXdaw75X4Y8SVKEsq52', 
-    '9tOJ5ZlfRoWnbNmiaDporsJv39V2', 
-    'Onr5ALx1EXh9Pl7q0cIiVFHyzhd2', 
-    'dFI1IXGR0pWkEvZMneJTyr05eK52', 
-    'jYLJccV2lVZKMouzjU6u7NXZs3x1'
-]
-flagged_strings = ['uat', 'builduat', 'uatbuild', 'hkleeiin']
+parser = argparse.ArgumentParser(description="Process raw Firebase JSON and auth data into structured CSVs.")
+parser.add_argument('command', nargs='?', choices=['update'], help="Fetch a fresh RTDB snapshot before processing")
+parser.add_argument('--snapshot', metavar='YYYY-MM-DD',
+                    help="Process this snapshot, with the auth export of the same date, instead of the latest")
+parser.add_argument('--store', default=DEFAULT_STORE_DIR,
+                    help="Sharded snapshot store; a snapshot there is used over a JSON file of the same date")
+parser.add_argument('--stream', action='store_true',
+                    help="Parse the JSON snapshot one user at a time instead of loading it whole (bounded memory)")
+parser.add_argument('--incremental', action='store_true',
+                    help="Only re-extract users that changed since the last run, reusing the rest from the state file")
+parser.add_argument('--full', action='store_true',
+                    help="Re-extract every user and rebuild the incremental state file")
+parser.add_argument('--state-file', default=DEFAULT_STATE_PATH,
+                    help="Where the incremental state is kept")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Extract users in this many worker processes (output is identical to a serial run)")
+parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                    help="Users per shard sent to each worker")
+parser.add_argument('--parquet', action='store_true',
+                    help=f"Also write every table as typed, compressed Parquet under {parquet_writer.PARQUET_DIR}/ (needs pyarrow)")
+parser.add_argument('--partition-by-snapshot', action='store_true',
+                    help="With --parquet, write each table into a snapshot_date=YYYY-MM-DD partition")
+parser.add_argument('--audit-sample', type=int, default=1, metavar='N',
+                    help="Write the 'Processed / Valid data' audit rows of only one user in N (picked by user ID); "
+                         "every other audit row is kept")
+parser.add_argument('--rules',
+                    help=f"Cleaning rules file (default: ${cleaning_rules.RULES_ENV} or config/cleaning_rules.json)")
+parser.add_argument('--log-level', choices=list(metrics.LEVELS),
+                    help=f"Console detail; TRACE adds a line per skipped user (default: ${metrics.LEVEL_ENV} or {metrics.DEFAULT_LEVEL})")
+parser.add_argument('--metrics-file', default='data/processed/metrics.json',
+                    help="Where the JSON report of stage timings, peak memory and counters is written")
+parser.add_argument('--profile', nargs='?', const='data/processed/profile.pstats',
+                    help="Run under cProfile and dump the stats here (default: data/processed/profile.pstats)")
 
-def is_flagged(user_id, user_info):
-    """Check if a user should be filtered out based on their email or user ID."""
-    email = user_info.get("email", "").lower()
-    for flag in flagged_strings:
-        if flag in email:
-            return True
-    if user_id in test_accounts:
-        return True
-    return False
 
-# Initialize audit DataFrame
-audit_log = pd.DataFrame(columns=['user_id', 'section', 'action', 'reason', 'details'])
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and (args.incremental or args.full):
+        parser.error("--workers cannot be combined with --incremental or --full")
+    if args.audit_sample < 1:
+        parser.error("--audit-sample must be at least 1")
+    if args.parquet and not parquet_writer.available():
+        parser.error("--parquet needs pyarrow (pip install pyarrow)")
+    if args.log_level:
+        metrics.set_level(args.log_level)
+    if args.rules:
+        cleaning_rules.set_rules_path(args.rules)
+
+    run_metrics = metrics.Metrics()
+    if args.profile:
+        profiler = cProfile.Profile()
+        summary = profiler.runcall(process, args, run_metrics)
+        profiler.dump_stats(args.profile)
+        print(f"Saved: {args.profile}")
+    else:
+        summary = process(args, run_metrics)
 
-# Optionally fetch new Firebase data if 'update' argument is provided
-if len(sys.argv) > 1 and sys.argv[1] == "update":
-    print("DEBUG: Running fetch_firebase_data.py to update data...")
     try:
-        subprocess.run(["python", "scripts/fetch_firebase_data.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"ERROR: Failed to run fetch_firebase_data.py: {e}")
-        sys.exit(1)
-    except FileNotFoundError:
-        print("ERROR: scripts/fetch_firebase_data.py not found. Please ensure it exists or remove the 'update' argument.")
+        run_metrics.write(args.metrics_file, arguments=vars(args), **summary)
+        print(f"Saved: {args.metrics_file}")
+    except PermissionError as e:
+        print(f"ERROR: Permission denied when writing to {args.metrics_file}: {e}")
         sys.exit(1)
 
-# Load the most recent JSON and auth files
-try:
-    json_files = sorted([f for f in os.listdir('data/raw/json')], reverse=True)
-    auth_files = sorted([f for f in os.listdir('data/raw/auth')], reverse=True)
-except FileNotFoundError as e:
-    print(f"ERROR: Directory not found: {e}")
-    sys.exit(1)
 
-print(f"DEBUG: JSON files found: {json_files}")
-print(f"DEBUG: Auth files found: {auth_files}")
+def process(args, run_metrics):
+    """Run the processing steps, recording spans and counters in `run_metrics`."""
+    # Debug: Check the environment
+    metrics.log('DEBUG', "Checking environment...")
+    metrics.log('DEBUG', f"Current directory: {os.getcwd()}")
 
-if not json_files or not auth_files:
-    print("ERROR: Missing JSON or auth files in 'data/raw/json' or 'data/raw/auth'.")
-    sys.exit(1)
+    # Ensure required directories exist
+    required_dirs = ['data/raw/json', 'data/raw/auth', 'data/processed']
+    for dir_path in required_dirs:
+        if not os.path.exists(dir_path):
+            print(f"ERROR: Directory '{dir_path}' does not exist. Creating it...")
+            os.makedirs(dir_path)
+        metrics.log('DEBUG', f"'{dir_path}' exists: {os.path.exists(dir_path)}")
 
-# Load the data
-try:
-    with open(f"data/raw/json/{json_files[0]}") as json_file:
-        data = json.load(json_file)
-    auth_data = pd.read_csv(f"data/raw/auth/{auth_files[0]}")
-except FileNotFoundError as e:
-    print(f"ERROR: File not found: {e}")
-    sys.exit(1)
-except json.JSONDecodeError as e:
-    print(f"ERROR: Invalid JSON format in {json_files[0]}: {e}")
-    sys.exit(1)
-except pd.errors.EmptyDataError as e:
-    print(f"ERROR: Auth CSV file {auth_files[0]} is empty: {e}")
-    sys.exit(1)
+    # Optionally fetch new Firebase data if 'update' argument is provided
+    if args.command == "update":
+        metrics.log('DEBUG', "Running fetch_firebase_data.py to update data...")
+        import fetch_firebase_data
+        try:
+            fetch_firebase_data.main(['--store', args.store])
+        except ImportError as e:
+            print(f"ERROR: Failed to run fetch_firebase_data.py: {e}. Install firebase_admin or remove the 'update' argument.")
+            sys.exit(1)
+        except Exception as e:
+            print(f"ERROR: Failed to run fetch_firebase_data.py: {e}")
+            sys.exit(1)
 
-print(f"DEBUG: JSON data type: {type(data)}")
-print(f"DEBUG: Auth data shape: {auth_data.shape}")
+    # Load the most recent snapshot (from the store or a JSON file) and auth file
+    with run_metrics.span('load'):
+        store = SnapshotStore(args.store)
+        try:
+            store_dates = store.snapshots()
+            json_files = sorted([f for f in os.listdir('data/raw/json')], reverse=True)
+            auth_files = sorted([f for f in os.listdir('data/raw/auth')], reverse=True)
+        except FileNotFoundError as e:
+            print(f"ERROR: Directory not found: {e}")
+            sys.exit(1)
 
-# Process auth data: Filter test accounts, check emails and timestamps
-auth_data.columns = ['user_id', 'email', 'creation_date', 'last_sign_in']
-initial_auth_users = auth_data['user_id'].nunique()
-for index, row in auth_data.iterrows():
-    user_id = row['user_id']
-    if pd.isna(row['email']) or row['email'].strip() == '':
-        audit_log.loc[len(audit_log)] = [user_id, 'Auth Data', 'Flagged', 'Missing email', 'Email field empty or null']
-    if user_id in test_accounts:
-        audit_log.loc[len(audit_log)] = [user_id, 'Auth Data', 'Skipped', 'Test account', 'Known test user ID']
-    try:
-        creation_dt = pd.to_datetime(row['creation_date'])
-        if creation_dt > datetime.now():
-            audit_log.loc[len(audit_log)] = [user_id, 'Auth Data', 'Flagged', 'Future timestamp', f"Creation date: {row['creation_date']}"]
-    except (ValueError, TypeError):
-        audit_log.loc[len(audit_log)] = [user_id, 'Auth Data', 'Flagged', 'Invalid timestamp', f"Creation date: {row['creation_date']}"]
-auth_data_cleaned = auth_data[~auth_data['user_id'].isin(test_accounts)]
-try:
-    auth_data_cleaned.to_csv('data/processed/auth_data.csv', index=False)
-    print("Saved: data/processed/auth_data.csv")
-except PermissionError as e:
-    print(f"ERROR: Permission denied when writing to data/processed/auth_data.csv: {e}")
-    sys.exit(1)
+        metrics.log('DEBUG', f"{len(store_dates)} stored snapshots, {len(json_files)} JSON files, "
+                             f"{len(auth_files)} auth files found")
+        metrics.trace(f"Stored snapshots found: {store_dates}")
+        metrics.trace(f"JSON files found: {json_files}")
+        metrics.trace(f"Auth files found: {auth_files}")
 
-# Process subscriptions: Extract transaction details, check timestamps
-subscriptions = pd.DataFrame(columns=[
-    'user_id', 'purchase_date', 'expiration_date', 
-    'original_purchase_date', 'product_id', 'num_transactions'
-])
-total_invalid_transactions = 0
-total_users = 0
-skipped_no_userinfo = 0
-skipped_flagged = 0
-processed_subscriptions = 0
-
-userIDs = data.keys()
-for i in userIDs:
-    total_users += 1
-    if 'userInfo' not in data[i]:
-        skipped_no_userinfo += 1
-        audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Skipped', 'Missing userInfo', 'No userInfo field in JSON']
-        print(f"DEBUG: Skipping user {i} - no userInfo (subscriptions)")
-        continue
-    user_info = data[i]['userInfo']
-    if is_flagged(i, user_info):
-        skipped_flagged += 1
-        audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Skipped', 'Flagged email', f"Email: {user_info.get('email', 'N/A')}"]
-        print(f"DEBUG: Skipping user {i} - flagged (email: {user_info.get('email', 'N/A')}) (subscriptions)")
-        continue
-    if 'latestReceiptInfo' in user_info:
-        transactions = user_info['latestReceiptInfo']
-        num_transactions = len(transactions)
-        for y in transactions:
-            if not isinstance(y, dict):
-                print(f"DEBUG: Skipping invalid transaction for user {i}: {y}")
-                total_invalid_transactions += 1
-                audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Skipped', 'Invalid transaction', f"Transaction data: {y}"]
-                continue
-            purchase_ms = y.get('purchase_date_ms')
-            expires_ms = y.get('expires_date_ms')
-            if purchase_ms and expires_ms:
-                try:
-                    purchase_dt = pd.to_datetime(int(purchase_ms), unit='ms')
-                    expires_dt = pd.to_datetime(int(expires_ms), unit='ms')
-                    if purchase_dt > datetime.now() or expires_dt < purchase_dt:
-                        audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Flagged', 'Invalid timestamp', f"Purchase: {purchase_ms}, Expires: {expires_ms}"]
-                except (ValueError, TypeError):
-                    audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Flagged', 'Invalid timestamp', f"Purchase: {purchase_ms}, Expires: {expires_ms}"]
-            subscriptions.loc[len(subscriptions)] = [
-                i, purchase_ms, expires_ms, y.get('original_purchase_date_ms'), 
-                y.get('product_id'), num_transactions
-            ]
-        processed_subscriptions += 1
-        audit_log.loc[len(audit_log)] = [i, 'Subscriptions', 'Processed', 'Valid data', f"Transactions: {num_transactions}"]
+        if args.snapshot:
+            snapshot_date = args.snapshot
+            json_files = [f for f in json_files if os.path.splitext(f)[0] == snapshot_date]
+            auth_files = [f for f in auth_files if os.path.splitext(f)[0] == snapshot_date]
+            from_store = snapshot_date in store_dates
+        else:
+            json_dates = [os.path.splitext(f)[0] for f in json_files]
+            from_store = bool(store_dates) and (not json_dates or store_dates[-1] >= json_dates[0])
+            snapshot_date = store_dates[-1] if from_store else (json_dates[0] if json_dates else None)
 
-# Check for duplicate user_ids in subscriptions
-dup_subs = subscriptions[subscriptions.duplicated('user_id', keep=False)]
-if not dup_subs.empty:
-    for user_id in dup_subs['user_id'].unique():
-        audit_log.loc[len(audit_log)] = [user_id, 'Subscriptions', 'Flagged', 'Duplicate user ID', f"Found {len(dup_subs[dup_subs['user_id'] == user_id])} entries"]
+        if not (from_store or json_files) or not auth_files:
+            wanted = f" for {args.snapshot}" if args.snapshot else ''
+            print(f"ERROR: Missing snapshot or auth files{wanted} in '{args.store}', 'data/raw/json' or 'data/raw/auth'.")
+            sys.exit(1)
 
-# Log subscriptions summary
-print(f"DEBUG: Subscriptions - Total users: {total_users}")
-print(f"DEBUG: Subscriptions - Skipped (no userInfo): {skipped_no_userinfo}")
-print(f"DEBUG: Subscriptions - Skipped (flagged): {skipped_flagged}")
-print(f"DEBUG: Subscriptions - Processed users: {processed_subscriptions}")
-print(f"DEBUG: Subscriptions - Total invalid transactions skipped: {total_invalid_transactions}")
+        # Load the data. Stored and streamed snapshots are only opened here and read during extraction.
+        snapshot_name = f"{snapshot_date} ({args.store})" if from_store else json_files[0]
+        json_path = None if from_store else f"data/raw/json/{json_files[0]}"
+        try:
+            if from_store:
+                data = None
+            elif args.stream:
+                if not os.path.exists(json_path):
+                    raise FileNotFoundError(json_path)
+                data = None
+            else:
+                with open(json_path) as json_file:
+                    data = json.load(json_file)
+            auth_data = pd.read_csv(f"data/raw/auth/{auth_files[0]}")
+        except FileNotFoundError as e:
+            print(f"ERROR: File not found: {e}")
+            sys.exit(1)
+        except json.JSONDecodeError as e:
+            print(f"ERROR: Invalid JSON format in {snapshot_name}: {e}")
+            sys.exit(1)
+        except pd.errors.EmptyDataError as e:
+            print(f"ERROR: Auth CSV file {auth_files[0]} is empty: {e}")
+            sys.exit(1)
 
-# Save the subscriptions data
-try:
-    subscriptions.to_csv('data/processed/subscriptions.csv', index=False)
-    print("Saved: data/processed/subscriptions.csv")
-except PermissionError as e:
-    print(f"ERROR: Permission denied when writing to data/processed/subscriptions.csv: {e}")
-    sys.exit(1)
+    metrics.log('DEBUG', f"Snapshot: {snapshot_name}, auth: {auth_files[0]}")
+    metrics.log('DEBUG', f"JSON data type: {'streamed' if data is None else type(data)}")
+    metrics.log('DEBUG', f"Auth data shape: {auth_data.shape}")
 
-# Process user profiles: Extract user info, check completeness
-user_profiles = pd.DataFrame(columns=[
-    'user_id', 'email', 'country', 'city', 'height', 'weight', 'gender', 'age', 'active', 'level'
-])
-total_users = 0
-skipped_no_userinfo = 0
-skipped_flagged = 0
-processed_profiles = 0
+    # Process auth data: Filter test accounts, check emails and timestamps
+    with run_metrics.span('auth_validation'):
+        auth_data.columns = ['user_id', 'email', 'creation_date', 'last_sign_in']
+        rules = cleaning_rules.active_rules()
+        auth_audit, auth_counts = rules.check_auth(auth_data)
+        auth_counts['total_users'] = int(auth_data['user_id'].nunique())
+        auth_data_cleaned = auth_data[~auth_data['user_id'].isin(rules.test_accounts)]
+    run_metrics.count('Auth Data', auth_counts)
+    with run_metrics.span('write:auth_data'):
+        try:
+            auth_data_cleaned.to_csv('data/processed/auth_data.csv', index=False)
+            print("Saved: data/processed/auth_data.csv")
+        except PermissionError as e:
+            print(f"ERROR: Permission denied when writing to data/processed/auth_data.csv: {e}")
+            sys.exit(1)
+    run_metrics.rows['auth_data'] = len(auth_data_cleaned)
 
-for user_id in userIDs:
-    total_users += 1
-    if 'userInfo' not in data[user_id]:
-        skipped_no_userinfo += 1
-        audit_log.loc[len(audit_log)] = [user_id, 'User Profiles', 'Skipped', 'Missing userInfo', 'No userInfo field in JSON']
-        print(f"DEBUG: Skipping user {user_id} - no userInfo (user_profiles)")
-        continue
-    user_info = data[user_id]['userInfo']
-    if is_flagged(user_id, user_info):
-        skipped_flagged += 1
-        audit_log.loc[len(audit_log)] = [user_id, 'User Profiles', 'Skipped', 'Flagged email', f"Email: {user_info.get('email', 'N/A')}"]
-        print(f"DEBUG: Skipping user {user_id} - flagged (email: {user_info.get('email', 'N/A')}) (user_profiles)")
-        continue
-    profile = [
-        user_id, user_info.get('email'), user_info.get('country'), user_info.get('city'),
-        user_info.get('height'), user_info.get('weight'), user_info.get('gender'),
-        user_info.get('age'), user_info.get('active'), user_info.get('level')
-    ]
-    missing_fields = [col for col, val in zip(user_profiles.columns[1:], profile[1:]) if pd.isna(val) or val == '']
-    if len(missing_fields) > 3:  # Arbitrary threshold for "incomplete"
-        audit_log.loc[len(audit_log)] = [user_id, 'User Profiles', 'Flagged', 'Incomplete profile', f"Missing: {', '.join(missing_fields)}"]
-    if user_info.get('height') and not isinstance(user_info.get('height'), (int, float)):
-        audit_log.loc[len(audit_log)] = [user_id, 'User Profiles', 'Flagged', 'Data type mismatch', f"Height: {user_info.get('height')}"]
-    user_profiles.loc[len(user_profiles)] = profile
-    processed_profiles += 1
-    audit_log.loc[len(audit_log)] = [user_id, 'User Profiles', 'Processed', 'Valid data', 'Profile data extracted']
+    # Extract subscriptions, user profiles and my_gym preferences in one pass over the users
+    subscriptions_extractor = SubscriptionsExtractor()
+    profiles_extractor = UserProfilesExtractor()
+    user_store = UserStore(auth_data)
+    my_gym_extractor = MyGymExtractor(user_store)
+    extractors = [subscriptions_extractor, profiles_extractor, my_gym_extractor]
+    with run_metrics.span('extract'):
+        try:
+            if from_store:
+                users = store.iter_users(snapshot_date)
+            else:
+                users = iter_users(json_path) if args.stream else data.items()
+            if args.incremental or args.full:
+                state = IncrementalState() if args.full else IncrementalState.load(args.state_file)
+                shards = store_shards(store, snapshot_date) if from_store else snapshot_shards(users)
+                total_unique_users, state, delta = run_incremental(shards, extractors, state)
+                metrics.log('DEBUG', f"Incremental - Unchanged: {delta['unchanged']}, Changed: {delta['changed']}, "
+                                     f"Added: {delta['added']}, Deleted: {delta['deleted']}; shards reused: "
+                                     f"{delta['reused_shards']}, read: {delta['read_shards']}")
+                run_metrics.count('Incremental', delta)
+            elif args.workers > 1:
+                total_unique_users = run_parallel(users, extractors, args.workers, args.shard_size)
+            else:
+                total_unique_users = run_extractors(users, extractors)
+        except json.JSONDecodeError as e:
+            print(f"ERROR: Invalid JSON format in {snapshot_name}: {e}")
+            sys.exit(1)
+        except FileNotFoundError as e:
+            print(f"ERROR: Snapshot shard not found: {e}")
+            sys.exit(1)
 
-# Log user profiles summary
-print(f"DEBUG: User Profiles - Total users: {total_users}")
-print(f"DEBUG: User Profiles - Skipped (no userInfo): {skipped_no_userinfo}")
-print(f"DEBUG: User Profiles - Skipped (flagged): {skipped_flagged}")
-print(f"DEBUG: User Profiles - Processed users: {processed_profiles}")
+    # Log section summaries and stream the audit rows to disk in section order
+    try:
+        audit_log = AuditLog(AUDIT_CSV, sample=args.audit_sample)
+    except PermissionError as e:
+        print(f"ERROR: Permission denied when writing to {AUDIT_CSV}: {e}")
+        sys.exit(1)
+    audit_log.extend(auth_audit)
+    for extractor in extractors:
+        # Summed over worker processes when extraction is sharded
+        run_metrics.add_span(f"extract:{extractor.label}", extractor.seconds)
+        run_metrics.count(extractor.section, extractor.counts)
+        extractor.log_summary()
+        audit_log.merge(extractor.audit)
+        extractor.audit = AuditLog()  # Its rows are on disk now
 
-# Save the user profiles data
-try:
-    user_profiles.to_csv('data/processed/user_profiles.csv', index=False)
-    print("Saved: data/processed/user_profiles.csv")
-except PermissionError as e:
-    print(f"ERROR: Permission denied when writing to data/processed/user_profiles.csv: {e}")
-    sys.exit(1)
+    # Build and save the extracted tables
+    tables = {}
+    for extractor in extractors:
+        name = extractor.label
+        with run_metrics.span(f"write:{name}"):
+            tables[name] = extractor.to_frame()
+            try:
+                tables[name].to_csv(f'data/processed/{name}.csv', index=False)
+                print(f"Saved: data/processed/{name}.csv")
+            except PermissionError as e:
+                print(f"ERROR: Permission denied when writing to data/processed/{name}.csv: {e}")
+                sys.exit(1)
+        run_metrics.rows[name] = len(tables[name])
+    subscriptions, user_profiles, my_gym = tables['subscriptions'], tables['user_profiles'], tables['my_gym']
 
-# Process my_gym preferences
-my_gym = pd.DataFrame(columns=['user_id', 'creation_date', 'preferences', 'translated'])
-total_users = 0
-skipped_no_userinfo = 0
-skipped_flagged = 0
-skipped_no_preferences = 0
-skipped_invalid_preferences = 0
-processed_users = 0
+    # Save the equipment bridge table and its precomputed aggregates
+    user_equipment = equipment.bridge_table(my_gym)
+    equipment_tables = [('user_equipment', user_equipment, False),
+                        ('equipment_counts', equipment.equipment_counts(my_gym), False),
+                        ('equipment_cooccurrence', equipment.cooccurrence(my_gym), True)]
+    for name, table, index in equipment_tables:
+        with run_metrics.span(f"write:{name}"):
+            try:
+                table.to_csv(f'data/processed/{name}.csv', index=index)
+                print(f"Saved: data/processed/{name}.csv")
+            except PermissionError as e:
+                print(f"ERROR: Permission denied when writing to data/processed/{name}.csv: {e}")
+                sys.exit(1)
+    run_metrics.rows['user_equipment'] = len(user_equipment)
 
-preference_mapping = {
-    'A': 'Full Gym', 'N': 'Bodyweight', 'DA': 'Dumbbells', 'KA': 'Kettlebells', 'K': 'Kettlebells',
-    'B': 'Barbell & Plates', 'C': 'Cable Machines', 'J': 'Boxes', 'M': 'Med Ball', 'S': 'Swiss Ball',
-    'R': 'Bands', 'HB': 'Hexbar', 'H': 'Hexbar', 'X': 'Back Extension Machine', 'Y': 'Assault Bike',
-    'P': 'Weighted Plate', 'D': 'Dumbbells'
-}
+    # Add summary stats to audit log, from the counters kept as rows were added
+    with run_metrics.span('audit_summary'):
+        removed_users = len(audit_log.skipped_users)
+        flagged_issues = audit_log.action_count('Flagged')
+        final_users = pd.concat([auth_data_cleaned['user_id'], subscriptions['user_id'], user_profiles['user_id'], my_gym['user_id']]).nunique()
 
-possible_preference_fields = ['myGym', 'myGymPreferences', 'gymPreferences', 'my_gym_preferences']
+        audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Total Users Before Cleaning', str(total_unique_users)])
+        audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Total Users Removed', str(removed_users)])
+        audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Final User Count After Cleaning', str(final_users)])
+        audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Total Flagged Issues', str(flagged_issues)])
+        if args.audit_sample > 1:
+            audit_log.flush()  # Sampled rows are counted as they are written
+            audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Processed Rows Omitted By Sampling',
+                              str(audit_log.omitted)])
 
-for user_id in userIDs:
-    total_users += 1
-    if 'userInfo' not in data[user_id]:
-        skipped_no_userinfo += 1
-        audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Skipped', 'Missing userInfo', 'No userInfo field in JSON']
-        print(f"DEBUG: Skipping user {user_id} - no userInfo (my_gym)")
-        continue
-    user_info = data[user_id]['userInfo']
-    if is_flagged(user_id, user_info):
-        skipped_flagged += 1
-        audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Skipped', 'Flagged email', f"Email: {user_info.get('email', 'N/A')}"]
-        print(f"DEBUG: Skipping user {user_id} - flagged (email: {user_info.get('email', 'N/A')}) (my_gym)")
-        continue
-    creation_date = auth_data[auth_data['user_id'] == user_id]['creation_date'].iloc[0] if user_id in auth_data['user_id'].values else None
-    
-    preferences = None
-    found_field = None
-    for field in possible_preference_fields:
-        if field in user_info:
-            preferences = user_info[field]
-            found_field = field
-            break
-    
-    if preferences is not None:
-        pref_list = []
-        if preferences is None:
-            pref_list = []
-        elif isinstance(preferences, list):
-            pref_list = preferences
-        elif isinstance(preferences, str):
-            pref_list = [pref.strip() for pref in preferences.split(',')]
-        else:
-            skipped_invalid_preferences += 1
-            audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Skipped', 'Invalid preferences type', f"Field {found_field}: {preferences}"]
-            print(f"DEBUG: Skipping user {user_id} - {found_field} is not a list or string: {preferences}")
-            continue
-        
-        normalized_prefs = []
-        for pref in pref_list:
-            if not pref:
-                continue
-            pref = pref.strip().upper()
-            if pref not in preference_mapping and pref not in ['D', 'KA']:
-                audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Flagged', 'Unmapped preference', f"Preference: {pref}"]
-            if pref == 'D':
-                pref = 'DA'
-                audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Modified', 'Normalized preference', 'D -> DA']
-            if pref == 'KA':
-                pref = 'K'
-                audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Modified', 'Normalized preference', 'KA -> K']
-            normalized_prefs.append(pref)
-        
-        deduped_prefs = []
-        seen = set()
-        for pref in normalized_prefs:
-            if pref not in seen:
-                seen.add(pref)
-                deduped_prefs.append(pref)
-        
-        if deduped_prefs:
-            preferences_str = ','.join(deduped_prefs)
-            translated_list = [preference_mapping.get(pref, '') for pref in deduped_prefs]
-            translated_str = ','.join(translated_list)
-            my_gym.loc[len(my_gym)] = [user_id, creation_date, preferences_str, translated_str]
-            processed_users += 1
-            audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Processed', 'Valid data', f"Preferences: {preferences_str}"]
-        else:
-            skipped_no_preferences += 1
-            audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Skipped', 'No valid preferences', 'Empty after normalization']
-    else:
-        skipped_no_preferences += 1
-        audit_log.loc[len(audit_log)] = [user_id, 'My Gym', 'Skipped', 'No preferences field', f"Tried fields: {possible_preference_fields}"]
+    # Save the audit log
+    with run_metrics.span('write:data_cleaning_audit'):
+        try:
+            audit_log.close()
+            print(f"Saved: {AUDIT_CSV}")
+        except PermissionError as e:
+            print(f"ERROR: Permission denied when writing to {AUDIT_CSV}: {e}")
+            sys.exit(1)
+    run_metrics.rows['data_cleaning_audit'] = audit_log.written
+    run_metrics.count('Audit', {'logged': audit_log.logged, 'written': audit_log.written, 'omitted': audit_log.omitted})
 
-# Log my_gym summary
-print(f"DEBUG: My Gym - Total users: {total_users}")
-print(f"DEBUG: My Gym - Skipped (no userInfo): {skipped_no_userinfo}")
-print(f"DEBUG: My Gym - Skipped (flagged): {skipped_flagged}")
-print(f"DEBUG: My Gym - Skipped (no gym preferences field): {skipped_no_preferences}")
-print(f"DEBUG: My Gym - Skipped (invalid preferences type): {skipped_invalid_preferences}")
-print(f"DEBUG: My Gym - Processed users: {processed_users}")
+    # Optionally save typed Parquet copies of every table
+    if args.parquet:
+        partition = snapshot_date if args.partition_by_snapshot else None
+        tables = [('auth_data', auth_data_cleaned), ('subscriptions', subscriptions), ('user_profiles', user_profiles),
+                  ('my_gym', my_gym), ('user_equipment', user_equipment),
+                  ('equipment_counts', equipment_tables[1][1])]
+        # The audit log is already on disk; read it back rather than keeping it in memory
+        tables.append(('data_cleaning_audit', pd.read_csv(AUDIT_CSV, dtype=str, keep_default_na=False, na_values=[''])))
+        for name, table in tables:
+            with run_metrics.span(f"parquet:{name}"):
+                try:
+                    path = parquet_writer.write_table(name, table, snapshot_date=partition)
+                    print(f"Saved: {path}")
+                except PermissionError as e:
+                    print(f"ERROR: Permission denied when writing Parquet for {name}: {e}")
+                    sys.exit(1)
 
-# Save the my_gym data
-try:
-    my_gym.to_csv('data/processed/my_gym.csv', index=False)
-    print("Saved: data/processed/my_gym.csv")
-except PermissionError as e:
-    print(f"ERROR: Permission denied when writing to data/processed/my_gym.csv: {e}")
-    sys.exit(1)
+    # Save the incremental state only once every CSV is written, so it always matches them
+    if args.incremental or args.full:
+        with run_metrics.span('save_state'):
+            try:
+                state.save(args.state_file)
+                print(f"Saved: {args.state_file}")
+            except PermissionError as e:
+                print(f"ERROR: Permission denied when writing to {args.state_file}: {e}")
+                sys.exit(1)
 
-# Add summary stats to audit log
-total_unique_users = len(userIDs)
-removed_users = audit_log[audit_log['action'] == 'Skipped']['user_id'].nunique()
-final_users = pd.concat([auth_data_cleaned['user_id'], subscriptions['user_id'], user_profiles['user_id'], my_gym['user_id']]).nunique()
-flagged_issues = audit_log[audit_log['action'] == 'Flagged'].shape[0]
+    return {'snapshot': snapshot_name, 'auth_file': auth_files[0], 'total_users': total_unique_users}
 
-audit_log.loc[len(audit_log)] = ['SUMMARY', 'Summary', 'Summary Stat', 'Total Users Before Cleaning', str(total_unique_users)]
-audit_log.loc[len(audit_log)] = ['SUMMARY', 'Summary', 'Summary Stat', 'Total Users Removed', str(removed_users)]
-audit_log.loc[len(audit_log)] = ['SUMMARY', 'Summary', 'Summary Stat', 'Final User Count After Cleaning', str(final_users)]
-audit_log.loc[len(audit_log)] = ['SUMMARY', 'Summary', 'Summary Stat', 'Total Flagged Issues', str(flagged_issues)]
 
-# Save the audit log
-try:
-    audit_log.to_csv('data/processed/data_cleaning_audit.csv', index=False)
-    print("Saved: data/processed/data_cleaning_audit.csv")
-except PermissionError as e:
-    print(f"ERROR: Permission denied when writing to data/processed/data_cleaning_audit.csv: {e}")
-    sys.exit(1)
+if __name__ == '__main__':
+    main()
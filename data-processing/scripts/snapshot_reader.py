@@ -0,0 +1,116 @@
+"""
+Streams `(user_id, record)` pairs out of a raw RTDB `/users` JSON snapshot.
+
+`json.load` builds the Python objects for every user before processing can
+start, so peak memory grows with the whole database. `iter_users` parses the
+top-level object one user at a time instead, keeping memory proportional to a
+single user record. It uses `ijson` when it is installed and falls back to an
+incremental parser built on `json.JSONDecoder.raw_decode` otherwise.
+"""
+
+import json
+
+try:
+    import ijson
+except ImportError:  # ijson is optional; the fallback parser needs only the standard library
+    ijson = None
+
+CHUNK_SIZE = 1 << 20
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_users(path, use_ijson=None):
+    """Yield `(user_id, record)` for each user in the snapshot at `path`.
+
+    Raises `json.JSONDecodeError` if the snapshot is malformed, which can
+    happen part-way through the iteration.
+    """
+    if use_ijson is None:
+        use_ijson = ijson is not None
+    if use_ijson:
+        yield from _iter_users_ijson(path)
+    else:
+        with open(path) as f:
+            yield from _iter_object_items(f)
+
+
+def _iter_users_ijson(path):
+    with open(path, 'rb') as f:
+        try:
+            yield from ijson.kvitems(f, '', use_float=True)
+        except ijson.JSONError as e:
+            raise json.JSONDecodeError(str(e), '', 0) from e
+
+
+class _Reader:
+    """Character buffer over a text file that is refilled on demand."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk, dropping what has already been consumed."""
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expected '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self, decoder):
+        """Decode one JSON value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number or literal cut off at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_object_items(f):
+    decoder = json.JSONDecoder()
+    reader = _Reader(f)
+    first = reader.peek()
+    if first == 'n':
+        # An empty /users reference is written as `null`
+        if reader.value(decoder) is None:
+            return
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value(decoder)
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expected a user ID key", reader.buf, reader.pos)
+        reader.expect(':')
+        yield key, reader.value(decoder)
+        sep = reader.peek()
+        if sep == '}':
+            return
+        reader.expect(',')
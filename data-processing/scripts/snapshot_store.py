@@ -0,0 +1,240 @@
+"""
+Sharded, compressed store for raw RTDB `/users` snapshots.
+
+A daily `indent=4` JSON snapshot is mostly whitespace and mostly the same as
+the day before. The store keeps each snapshot as a list of shards instead:
+gzip-compressed newline-delimited JSON, one `[user_id, record]` line per user.
+
+Shard boundaries are picked by the user IDs themselves: a user starts a new
+shard when a hash of its ID is divisible by `shard_users`, so shards hold
+that many users on average and a user who is added, changed or removed only
+changes the shard it falls in. Shards are named by a hash of their content,
+so a shard that is the same as in an earlier snapshot is stored once.
+
+    data/raw/store/
+        objects/ab/ab12...ndjson.gz   one shard
+        objects/ab/ab12...idx.json    user_id -> [offset, length] in the decompressed shard
+        snapshots/YYYY-MM-DD.json     the snapshot's shards in order, with each
+                                      one's first and last user ID
+
+Reading a snapshot decompresses one shard at a time. Looking up a single user
+reads the manifest, the indexes of the shards whose ID range covers it, and
+then decompresses only the shard that holds it.
+
+Usage (from data-processing/):
+    python scripts/snapshot_store.py import data/raw/json/2024-01-01.json
+    python scripts/snapshot_store.py list
+    python scripts/snapshot_store.py get USER_ID [--date YYYY-MM-DD]
+    python scripts/snapshot_store.py prune
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+DEFAULT_STORE_DIR = 'data/raw/store'
+DEFAULT_SHARD_USERS = 64
+MANIFEST_VERSION = 1
+
+
+def starts_shard(user_id, shard_users):
+    """Whether `user_id` begins a new shard; depends only on the ID, so boundaries are stable across days."""
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_users == 0
+
+
+_DECODER = json.JSONDecoder()
+
+
+def content_id(payload):
+    """Name of a shard: a hash of its decompressed NDJSON."""
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def encode_user(user_id, record):
+    """One NDJSON line; the compact JSON decodes to the same record as the pretty-printed snapshot."""
+    return (json.dumps([user_id, record], ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+def line_user_id(line):
+    """The user ID an NDJSON line starts with, without decoding its record."""
+    return _DECODER.raw_decode(line.decode(), 1)[0]
+
+
+class SnapshotStore:
+    """Content-addressed shards plus one manifest per snapshot date."""
+
+    def __init__(self, root=DEFAULT_STORE_DIR, shard_users=DEFAULT_SHARD_USERS):
+        self.root = root
+        self.shard_users = shard_users
+
+    def _object_path(self, shard_id, suffix):
+        return os.path.join(self.root, 'objects', shard_id[:2], f"{shard_id}{suffix}")
+
+    def _manifest_path(self, snapshot_date):
+        return os.path.join(self.root, 'snapshots', f"{snapshot_date}.json")
+
+    def snapshots(self):
+        """Snapshot dates in the store, oldest first."""
+        directory = os.path.join(self.root, 'snapshots')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(directory) if name.endswith('.json'))
+
+    def latest(self):
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def manifest(self, snapshot_date=None):
+        snapshot_date = snapshot_date or self.latest()
+        if snapshot_date is None:
+            raise FileNotFoundError(f"No snapshots in {self.root}")
+        with open(self._manifest_path(snapshot_date)) as f:
+            return json.load(f)
+
+    def write(self, snapshot_date, users):
+        """Store the `(user_id, record)` pairs as the snapshot for `snapshot_date`.
+
+        Users are kept in the order given. Only one shard is held in memory at a
+        time. Returns counts of users, shards, newly written shards and bytes.
+        """
+        stats = {'users': 0, 'shards': 0, 'new_shards': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        shards = []
+        lines, index, size = [], {}, 0
+        for user_id, record in users:
+            if lines and starts_shard(user_id, self.shard_users):
+                shards.append(self._write_shard(lines, index, stats))
+                lines, index, size = [], {}, 0
+            line = encode_user(user_id, record)
+            index[user_id] = [size, len(line)]
+            lines.append(line)
+            size += len(line)
+            stats['users'] += 1
+        if lines:
+            shards.append(self._write_shard(lines, index, stats))
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'date': snapshot_date,
+            'users': stats['users'],
+            'shard_users': self.shard_users,
+            'shards': shards,
+        }
+        path = self._manifest_path(snapshot_date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, path)
+        return stats
+
+    def _write_shard(self, lines, index, stats):
+        payload = b''.join(lines)
+        shard_id = content_id(payload)
+        path = self._object_path(shard_id, '.ndjson.gz')
+        stats['shards'] += 1
+        stats['raw_bytes'] += len(payload)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # The index goes first: a shard file only appears once it is complete and indexed
+            index_path = self._object_path(shard_id, '.idx.json')
+            with open(f"{index_path}.tmp", 'w') as f:
+                json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(f"{index_path}.tmp", index_path)
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(gzip.compress(payload, mtime=0))
+            os.replace(f"{path}.tmp", path)
+            stats['new_shards'] += 1
+        stats['stored_bytes'] += os.path.getsize(path)
+        return {'id': shard_id, 'users': len(index), 'first': min(index), 'last': max(index)}
+
+    def _read_shard(self, shard_id):
+        with open(self._object_path(shard_id, '.ndjson.gz'), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def iter_shard(self, shard_id):
+        """Yield `(user_id, line)` for every user in one shard, leaving each record as its stored NDJSON line."""
+        for line in self._read_shard(shard_id).splitlines(keepends=True):
+            yield line_user_id(line), line
+
+    def iter_users(self, snapshot_date=None):
+        """Yield `(user_id, record)` for every user in a snapshot (default: the latest), in stored order."""
+        for shard in self.manifest(snapshot_date)['shards']:
+            for line in self._read_shard(shard['id']).splitlines():
+                user_id, record = json.loads(line)
+                yield user_id, record
+
+    def get(self, user_id, snapshot_date=None):
+        """Return one user's record from a snapshot (default: the latest). Raises KeyError if absent."""
+        for shard in self.manifest(snapshot_date)['shards']:
+            if not shard['first'] <= user_id <= shard['last']:
+                continue
+            with open(self._object_path(shard['id'], '.idx.json')) as f:
+                index = json.load(f)
+            if user_id in index:
+                offset, length = index[user_id]
+                return json.loads(self._read_shard(shard['id'])[offset:offset + length])[1]
+        raise KeyError(user_id)
+
+    def prune(self):
+        """Delete shards no manifest refers to any more. Returns how many were deleted."""
+        referenced = {shard['id'] for snapshot_date in self.snapshots()
+                      for shard in self.manifest(snapshot_date)['shards']}
+        deleted = 0
+        objects = os.path.join(self.root, 'objects')
+        for directory, _, names in os.walk(objects):
+            for name in names:
+                shard_id = name.split('.', 1)[0]
+                if shard_id not in referenced:
+                    os.remove(os.path.join(directory, name))
+                    deleted += name.endswith('.ndjson.gz')
+        return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the sharded raw snapshot store.")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help="Add a JSON snapshot file to the store")
+    import_parser.add_argument('json_path')
+    import_parser.add_argument('--date', help="Snapshot date (default: the file name, e.g. 2024-01-01.json)")
+    import_parser.add_argument('--shard-users', type=int, default=DEFAULT_SHARD_USERS,
+                               help="Average users per shard; smaller shards deduplicate better")
+    commands.add_parser('list', help="List the stored snapshots")
+    get_parser = commands.add_parser('get', help="Print one user's record")
+    get_parser.add_argument('user_id')
+    get_parser.add_argument('--date', help="Snapshot date (default: the latest)")
+    commands.add_parser('prune', help="Delete shards no snapshot refers to")
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        from snapshot_reader import iter_users
+        store = SnapshotStore(args.store, args.shard_users)
+        snapshot_date = args.date or os.path.splitext(os.path.basename(args.json_path))[0]
+        stats = store.write(snapshot_date, iter_users(args.json_path))
+        print(f"Stored {snapshot_date}: {stats['users']} users in {stats['shards']} shards "
+              f"({stats['new_shards']} new, {stats['stored_bytes'] / 1e6:.1f} MB compressed)")
+    elif args.command == 'list':
+        store = SnapshotStore(args.store)
+        for snapshot_date in store.snapshots():
+            manifest = store.manifest(snapshot_date)
+            print(f"{snapshot_date}  {manifest['users']:>9} users  {len(manifest['shards']):>7} shards")
+    elif args.command == 'get':
+        try:
+            record = SnapshotStore(args.store).get(args.user_id, args.date)
+        except KeyError:
+            print(f"ERROR: User {args.user_id} is not in snapshot {args.date or 'latest'}")
+            sys.exit(1)
+        except FileNotFoundError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        print(json.dumps(record, indent=4))
+    elif args.command == 'prune':
+        print(f"Deleted {SnapshotStore(args.store).prune()} unreferenced shards")
+
+
+if __name__ == '__main__':
+    main()
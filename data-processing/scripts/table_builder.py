@@ -0,0 +1,478 @@
+"""
+Collects output rows into column buffers and builds a DataFrame once per table.
+
+Appending with `df.loc[len(df)] = [...]` reallocates the frame on every row, so
+building a table that way gets quadratically slower as the user base grows.
+
+Columns can be given a kind to store them compactly while rows are collected:
+    'int'        int64 array, e.g. epoch-millisecond timestamps and counts
+    'category'   int32 codes into a dictionary of distinct values, e.g.
+                 `country` or `product_id`
+Other columns keep a list of the raw values. A typed column only holds values
+it can give back exactly as they came in (so the CSV is unchanged); the first
+value that doesn't fit, such as a non-numeric timestamp string, turns that
+column back into a plain list.
+
+Plain columns are written the way per-row appends left them. Appending
+infers a dtype for the column from its rows so far, so a column that starts
+out numeric is cast as it goes: ints become floats once a float is appended,
+bools become ints once an int is. Those casts stop at the first value that
+makes the column `object`, such as a string in a numeric column, and the
+rows after it keep their own types. `appended_values` applies the same casts.
+"""
+
+from array import array
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+CHUNK_ROWS = 4096  # Rows staged as raw values before typed columns pack them
+
+# The dtype a column of appended rows starts with, and the dtype it moves to
+# as each value is appended; a value not listed makes the column object
+_FIRST_DTYPE = {int: 'int', float: 'float', bool: 'bool', str: 'str'}
+_NEXT_DTYPE = {
+    'int': {int: 'int', bool: 'int', float: 'float'},
+    'float': {int: 'float', bool: 'float', float: 'float'},
+    'bool': {bool: 'bool', int: 'int'},
+    'str': {str: 'str', type(None): 'str'},
+}
+_CASTS = {'int': int, 'float': float}
+_NUMBER_TYPES = {int, float, bool}
+
+
+def _value_type(value):
+    """The type appending treats `value` as; ints past int64 aren't numbers."""
+    kind = type(value)
+    if kind is int and not INT64_MIN <= value <= INT64_MAX:
+        return object
+    return kind
+
+
+def _gathered(values_by_source, rows):
+    """The values at `rows` of several value lists read as one."""
+    values = values_by_source[0] if len(values_by_source) == 1 else list(chain.from_iterable(values_by_source))
+    return [values[i] for i in rows.tolist()]
+
+
+def appended_values(values):
+    """`values` as per-row appends to an empty DataFrame would write them.
+
+    The rows before the column first becomes object are cast to the dtype it
+    had reached by then; the rest are unchanged.
+    """
+    if not values or len(set(map(type, values)) & _NUMBER_TYPES) < 2:
+        return values  # Nothing to cast without two kinds of number
+    dtype = _FIRST_DTYPE.get(_value_type(values[0]))
+    if dtype is None:
+        return values
+    end = 1
+    while end < len(values):
+        following = _NEXT_DTYPE[dtype].get(_value_type(values[end]))
+        if following is None:
+            break
+        dtype = following
+        end += 1
+    cast = _CASTS.get(dtype)
+    if cast is None:
+        return values
+    return [cast(value) for value in values[:end]] + values[end:]
+
+
+class ObjectColumn:
+    """Raw Python values."""
+
+    __slots__ = ('values',)
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else []
+
+    def __len__(self):
+        return len(self.values)
+
+    def flush(self):
+        pass
+
+    def slice(self, start=0, stop=None):
+        return self.values[start:stop]
+
+    def take(self, sources, rows):
+        """Append the values at `rows` of `sources`, columns read as one."""
+        self.values.extend(_gathered([source.slice() for source in sources], rows))
+
+    def to_series_values(self):
+        return appended_values(self.values)
+
+    def nbytes(self):
+        return 8 * len(self.values)
+
+
+class IntColumn:
+    """int64 values, with missing values (None or '') held in a null mask.
+
+    Digit strings are stored as numbers when the number prints back as the
+    same string, so `'1690000000000'` is kept but `'0123'` is not. Values
+    are staged in a list and packed a chunk at a time.
+    """
+
+    __slots__ = ('staged', '_data', '_nulls', '_fallback')
+
+    def __init__(self):
+        self.staged = []
+        self._data = array('q')
+        self._nulls = None  # bytearray, created on the first missing value
+        self._fallback = None  # ObjectColumn once a value didn't fit
+
+    def __len__(self):
+        packed = len(self._fallback) if self._fallback is not None else len(self._data)
+        return packed + len(self.staged)
+
+    def flush(self):
+        staged = self.staged
+        if not staged:
+            return
+        if self._fallback is not None:
+            self._fallback.values.extend(staged)
+        elif not self._pack(staged):
+            for value in staged:
+                self._append(value)
+        staged.clear()
+
+    def _pack(self, staged):
+        """Pack a chunk of plain numbers or digit strings in one go; False if it has anything else."""
+        types = set(map(type, staged))
+        types.discard(type(None))
+        if len(types) > 1 or not types <= {int, str}:
+            return False
+        kind = types.pop() if types else int
+        missing = None
+        if None in staged or '' in staged:
+            missing = bytes([value is None or value == '' for value in staged])
+            fill = '0' if kind is str else 0
+            staged = [fill if value is None or value == '' else value for value in staged]
+        try:
+            if kind is str:
+                numbers = list(map(int, staged))
+                if list(map(str, numbers)) != staged:
+                    return False
+            else:
+                numbers = staged
+            packed = array('q', numbers)
+        except (ValueError, OverflowError):
+            return False
+        if missing is not None and self._nulls is None:
+            self._nulls = bytearray(len(self._data))
+        self._data.extend(packed)
+        if self._nulls is not None:
+            self._nulls.extend(missing if missing is not None else bytes(len(packed)))
+        return True
+
+    def _append(self, value):
+        if self._fallback is not None:
+            self._fallback.values.append(value)
+            return
+        if value is None or value == '':
+            # Missing values are written as empty CSV fields either way
+            if self._nulls is None:
+                self._nulls = bytearray(len(self._data))
+            self._data.append(0)
+            self._nulls.append(1)
+            return
+        number = value if type(value) is int else None
+        if type(value) is str:
+            try:
+                number = int(value)
+            except ValueError:
+                pass
+            if number is not None and str(number) != value:
+                number = None
+        if number is None or not INT64_MIN <= number <= INT64_MAX:
+            self._fallback = ObjectColumn(self._packed_slice())
+            self._data = self._nulls = None
+            self._fallback.values.append(value)
+            return
+        self._data.append(number)
+        if self._nulls is not None:
+            self._nulls.append(0)
+
+    def _packed_slice(self, start=0, stop=None):
+        if self._fallback is not None:
+            return self._fallback.slice(start, stop)
+        values = self._data[start:stop].tolist()
+        if self._nulls is not None:
+            for i, null in enumerate(self._nulls[start:stop]):
+                if null:
+                    values[i] = None
+        return values
+
+    def slice(self, start=0, stop=None):
+        self.flush()
+        return self._packed_slice(start, stop)
+
+    def take(self, sources, rows):
+        """Append the values at `rows` of `sources`, columns read as one; packed numbers are copied as they are."""
+        self.flush()
+        for source in sources:
+            source.flush()
+        if self._fallback is not None or any(type(source) is not IntColumn or source._fallback is not None
+                                             for source in sources):
+            self.staged.extend(_gathered([source.slice() for source in sources], rows))
+            return
+        data = np.concatenate([np.frombuffer(source._data, dtype=np.int64) for source in sources])[rows]
+        nulls = None
+        if any(source._nulls is not None for source in sources):
+            nulls = np.concatenate([np.frombuffer(source._nulls, dtype=np.uint8) if source._nulls is not None
+                                    else np.zeros(len(source._data), dtype=np.uint8) for source in sources])[rows]
+            if self._nulls is None and nulls.any():
+                self._nulls = bytearray(len(self._data))
+        if self._nulls is not None:
+            self._nulls.extend(nulls.tobytes() if nulls is not None else bytes(len(data)))
+        self._data.frombytes(data.tobytes())
+
+    def to_series_values(self):
+        self.flush()
+        if self._fallback is not None:
+            return self._fallback.to_series_values()
+        data = np.frombuffer(self._data, dtype=np.int64) if len(self._data) else np.array([], dtype=np.int64)
+        if self._nulls is None:
+            return data.copy()
+        return pd.arrays.IntegerArray(data.copy(), np.frombuffer(bytes(self._nulls), dtype=bool).copy())
+
+    def nbytes(self):
+        self.flush()
+        if self._fallback is not None:
+            return self._fallback.nbytes()
+        return self._data.itemsize * len(self._data) + (len(self._nulls) if self._nulls is not None else 0)
+
+
+class CategoryColumn:
+    """Dictionary-encoded values: one int32 code per row and each distinct value stored once.
+
+    Values are staged in a list and encoded a chunk at a time.
+    """
+
+    __slots__ = ('staged', '_codes', '_categories', '_index', '_fallback')
+
+    def __init__(self):
+        self.staged = []
+        self._codes = array('i')
+        self._categories = []
+        # Strings are keys as they are; other values are keyed with their
+        # type, so 1, 1.0 and True stay distinct values
+        self._index = {None: -1}
+        self._fallback = None
+
+    def __len__(self):
+        packed = len(self._fallback) if self._fallback is not None else len(self._codes)
+        return packed + len(self.staged)
+
+    def flush(self):
+        staged = self.staged
+        if not staged:
+            return
+        if self._fallback is not None:
+            self._fallback.values.extend(staged)
+            staged.clear()
+            return
+        try:
+            codes = list(map(self._index.get, staged))
+        except TypeError:  # Unhashable, e.g. a list where a string was expected
+            codes = None
+        if codes is None:
+            for value in staged:
+                self._append(value)
+        else:
+            # Only values not seen before need a look at their type
+            i = 0
+            try:
+                while True:
+                    i = codes.index(None, i)
+                    codes[i] = self._code(staged[i])
+            except ValueError:
+                pass
+            self._codes.extend(array('i', codes))
+        staged.clear()
+
+    def _code(self, value):
+        key = value if type(value) is str else (value.__class__, value)
+        code = self._index.get(key)
+        if code is None:
+            code = self._index[key] = len(self._categories)
+            self._categories.append(value)
+        return code
+
+    def _append(self, value):
+        if self._fallback is not None:
+            self._fallback.values.append(value)
+            return
+        try:
+            code = -1 if value is None else self._code(value)
+        except TypeError:
+            self._fallback = ObjectColumn(self._packed_slice())
+            self._codes = self._categories = self._index = None
+            self._fallback.values.append(value)
+            return
+        self._codes.append(code)
+
+    def _packed_slice(self, start=0, stop=None):
+        if self._fallback is not None:
+            return self._fallback.slice(start, stop)
+        categories = self._categories
+        return [None if code < 0 else categories[code] for code in self._codes[start:stop]]
+
+    def slice(self, start=0, stop=None):
+        self.flush()
+        return self._packed_slice(start, stop)
+
+    def take(self, sources, rows):
+        """Append the values at `rows` of `sources`, columns read as one.
+
+        Each distinct value is looked up once, in order of first appearance,
+        so the dictionary is the one appending the values would build.
+        """
+        self.flush()
+        for source in sources:
+            source.flush()
+        if self._fallback is not None or any(type(source) is not CategoryColumn or source._fallback is not None
+                                             for source in sources):
+            self.staged.extend(_gathered([source.slice() for source in sources], rows))
+            return
+        categories, codes = [], []
+        for source in sources:
+            source_codes = np.frombuffer(source._codes, dtype=np.int32).astype(np.int64)
+            codes.append(np.where(source_codes < 0, -1, source_codes + len(categories)))
+            categories.extend(source._categories)
+        distinct, first, positions = np.unique(np.concatenate(codes)[rows], return_index=True, return_inverse=True)
+        mapped = np.empty(len(distinct), dtype=np.int32)
+        for i in np.argsort(first).tolist():
+            code = int(distinct[i])
+            mapped[i] = -1 if code < 0 else self._code(categories[code])
+        self._codes.frombytes(mapped[positions].tobytes())
+
+    def to_series_values(self):
+        self.flush()
+        if self._fallback is not None:
+            return self._fallback.to_series_values()
+        codes = np.frombuffer(self._codes, dtype=np.int32) if len(self._codes) else np.array([], dtype=np.int32)
+        if all(type(value) is str for value in self._categories):
+            return pd.Categorical.from_codes(codes.copy(), categories=pd.Index(self._categories, dtype=object))
+        # Mixed types (e.g. 1 and '1') can't be pandas categories; decode to objects
+        decoded = np.empty(len(self._categories) + 1, dtype=object)
+        decoded[:-1] = self._categories
+        if len(set(map(type, self._categories)) & _NUMBER_TYPES) < 2:
+            return decoded[codes]
+        return appended_values(decoded[codes].tolist())
+
+    def nbytes(self):
+        self.flush()
+        if self._fallback is not None:
+            return self._fallback.nbytes()
+        return self._codes.itemsize * len(self._codes) + 8 * len(self._categories)
+
+
+COLUMN_KINDS = {'object': ObjectColumn, 'int': IntColumn, 'category': CategoryColumn}
+
+
+class TableBuilder:
+    """Append-only row buffer for one output table."""
+
+    def __init__(self, columns, kinds=None):
+        """`kinds` maps column names to 'int' or 'category'; other columns hold raw values."""
+        self.columns = list(columns)
+        self.kinds = dict(kinds or {})
+        self._buffers = [COLUMN_KINDS[self.kinds.get(name, 'object')]() for name in self.columns]
+        self._bind_appends()
+        self._typed = any(type(buffer) is not ObjectColumn for buffer in self._buffers)
+        self._staged_rows = 0
+
+    def _bind_appends(self):
+        self._appends = [(buffer.values if type(buffer) is ObjectColumn else buffer.staged).append
+                         for buffer in self._buffers]
+
+    def __getstate__(self):
+        # The bound append methods are rebuilt from the buffers when unpickled
+        state = self.__dict__.copy()
+        del state['_appends']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind_appends()
+
+    def __len__(self):
+        return len(self._buffers[0]) if self._buffers else 0
+
+    def append(self, row):
+        """Add one row, given in the same order as `columns`."""
+        if len(row) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} values, got {len(row)}: {row}")
+        for append, value in zip(self._appends, row):
+            append(value)
+        if self._typed:
+            self._staged_rows += 1
+            if self._staged_rows == CHUNK_ROWS:
+                self.flush()
+
+    def flush(self):
+        """Pack the staged values of the typed columns."""
+        for buffer in self._buffers:
+            buffer.flush()
+        self._typed = any(type(buffer) is not ObjectColumn for buffer in self._buffers)
+        self._staged_rows = 0
+
+    def extend(self, rows):
+        """Add several rows at once."""
+        for row in rows:
+            self.append(row)
+
+    def merge(self, other):
+        """Append every row buffered in another builder with the same columns."""
+        if other.columns != self.columns:
+            raise ValueError(f"Column mismatch: {other.columns} != {self.columns}")
+        self.flush()
+        for buffer, other_buffer in zip(self._buffers, other._buffers):
+            (buffer.values if type(buffer) is ObjectColumn else buffer.staged).extend(other_buffer.slice())
+        self.flush()
+
+    def take(self, sources, rows):
+        """Append rows of `sources`, builders with the same columns read as one table, in the order of `rows`.
+
+        `rows` is an integer numpy array. Packed columns are gathered with
+        numpy rather than row by row.
+        """
+        for source in sources:
+            if source.columns != self.columns:
+                raise ValueError(f"Column mismatch: {source.columns} != {self.columns}")
+        self.flush()
+        for i, buffer in enumerate(self._buffers):
+            buffer.take([source._buffers[i] for source in sources], rows)
+        self.flush()
+
+    def rows(self, start=0, stop=None):
+        """Return buffered rows `start:stop` as tuples."""
+        return list(zip(*(buffer.slice(start, stop) for buffer in self._buffers)))
+
+    def column(self, name):
+        """Return the buffered values of one column."""
+        return self._buffers[self.columns.index(name)].slice()
+
+    def nbytes(self):
+        """Approximate size of the buffers, not counting the raw objects that plain columns point to."""
+        return sum(buffer.nbytes() for buffer in self._buffers)
+
+    def to_frame(self):
+        """Build the DataFrame in one allocation.
+
+        Plain columns are kept as `object` dtype so every value is written to
+        CSV exactly as it came out of the raw data, the same as row-wise
+        appends. Typed columns become int64 (or nullable Int64) and
+        categorical columns, which write the same text.
+        """
+        data = {}
+        for name, buffer in zip(self.columns, self._buffers):
+            values = buffer.to_series_values()
+            data[name] = pd.Series(values, dtype=object) if isinstance(values, list) else values
+        return pd.DataFrame(data, columns=self.columns)
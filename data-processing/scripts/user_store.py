@@ -0,0 +1,53 @@
+"""
+Auth users indexed by `user_id`.
+
+The store is built once from the auth CSV so sections can look a user up in
+O(1) instead of scanning and masking the whole auth frame for every user.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class UserStore:
+    """Read-only view of the auth data keyed on `user_id`.
+
+    When a `user_id` appears more than once the first row wins, matching the
+    old `auth_data[auth_data['user_id'] == user_id].iloc[0]` lookups.
+    """
+
+    def __init__(self, auth_data):
+        first_rows = auth_data.drop_duplicates('user_id', keep='first')
+        self.columns = list(first_rows.columns)
+        self._index = pd.Index(first_rows['user_id'])
+        self._positions = {user_id: pos for pos, user_id in enumerate(first_rows['user_id'])}
+        self._values = {col: first_rows[col].to_numpy(dtype=object) for col in self.columns}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def get(self, user_id, column, default=None):
+        """Return one auth field for a user, or `default` if the user is unknown."""
+        pos = self._positions.get(user_id)
+        if pos is None:
+            return default
+        return self._values[column][pos]
+
+    def creation_date(self, user_id):
+        return self.get(user_id, 'creation_date')
+
+    def attach(self, frame, column, user_id_column='user_id'):
+        """Fill `column` of `frame` for every row in one vectorized join.
+
+        Values keep their original Python types and unknown users get None,
+        so the CSV output is the same as with per-user lookups.
+        """
+        positions = self._index.get_indexer(frame[user_id_column])
+        found = positions >= 0
+        values = np.full(len(frame), None, dtype=object)
+        values[found] = self._values[column][positions[found]]
+        frame[column] = values
+        return frame
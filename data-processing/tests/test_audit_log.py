@@ -0,0 +1,46 @@
+"""
+A file-backed AuditLog must write the same CSV however its rows are chunked.
+"""
+
+import pandas as pd
+import pytest
+
+from audit_log import AuditLog
+from extractors import MyGymExtractor, SubscriptionsExtractor, UserProfilesExtractor, dispatch_user
+from synthetic import format_auth_row, generate_users
+from user_store import UserStore
+
+
+def extractor_logs():
+    users = list(generate_users(500, seed=7))
+    auth_rows = [format_auth_row(auth_row) for _, _, auth_row in users]
+    auth_data = pd.DataFrame([row for row in auth_rows if row is not None],
+                             columns=['user_id', 'email', 'creation_date', 'last_sign_in'])
+    extractors = [SubscriptionsExtractor(), UserProfilesExtractor(), MyGymExtractor(UserStore(auth_data))]
+    for user_id, record, _ in users:
+        dispatch_user(user_id, record, extractors)
+    for extractor in extractors:
+        extractor.finish()
+    return [extractor.audit for extractor in extractors]
+
+
+def write(path, chunk_rows, sample):
+    audit_log = AuditLog(str(path), sample=sample, chunk_rows=chunk_rows)
+    audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'First', '1'])
+    details = 0  # Most distinct details strings held at once
+    for log in extractor_logs():
+        audit_log.merge(log)
+        details = max(details, len(audit_log._details))
+    audit_log.append(['SUMMARY', 'Summary', 'Summary Stat', 'Last', '2'])
+    audit_log.close()
+    return audit_log, details
+
+
+@pytest.mark.parametrize('sample', [1, 3])
+def test_chunking_doesnt_change_the_csv(tmp_path, sample):
+    whole, _ = write(tmp_path / 'whole.csv', 10 ** 9, sample)
+    chunked, details = write(tmp_path / 'chunked.csv', 7, sample)
+    assert (tmp_path / 'whole.csv').read_text() == (tmp_path / 'chunked.csv').read_text()
+    assert (chunked.logged, chunked.written, chunked.omitted) == (whole.logged, whole.written, whole.omitted)
+    assert chunked.counts() == whole.counts()
+    assert details < 7  # Only the details of rows not yet written
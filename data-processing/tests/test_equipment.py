@@ -0,0 +1,80 @@
+"""
+The precomputed equipment tables must agree with the product-analysis SQL they replace.
+"""
+
+import random
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import equipment
+
+# Queries 1 and 2 from product-analysis/sql-workflow/README.md, with the
+# hard-coded user counts (1159 and 682) computed instead
+QUERY_1 = """
+SELECT
+    equipment,
+    COUNT(DISTINCT user_id) AS quantity,
+    ROUND(COUNT(DISTINCT user_id) * 100.0 / (SELECT COUNT(*) FROM my_gym), 2) AS percentage_of_total
+FROM user_equipment
+GROUP BY equipment
+"""
+QUERY_2 = """
+WITH equipment_counts AS (
+    SELECT
+        user_id,
+        COUNT(equipment) AS equip_count
+    FROM user_equipment
+    GROUP BY user_id
+    HAVING COUNT(equipment) <= 2
+),
+limited_users AS (
+    SELECT
+        ue.equipment,
+        COUNT(DISTINCT ue.user_id) AS quantity
+    FROM user_equipment ue
+    JOIN equipment_counts ec ON ue.user_id = ec.user_id
+    GROUP BY ue.equipment
+)
+SELECT
+    el.equipment,
+    COALESCE(lu.quantity, 0) AS quantity,
+    ROUND(COALESCE(lu.quantity, 0) * 100.0 / (SELECT COUNT(*) FROM equipment_counts), 2) AS percentage_of_total
+FROM equipment_list el
+LEFT JOIN limited_users lu ON el.equipment = lu.equipment
+"""
+
+
+@pytest.fixture
+def my_gym():
+    # Mostly one or two types, plus users with none and users with many
+    rng = random.Random(0)
+    masks = [sum(1 << bit for bit in rng.sample(range(len(equipment.EQUIPMENT)), rng.choice([0, 0, 1, 1, 1, 2, 2, 3, 5])))
+             for _ in range(3000)]
+    return pd.DataFrame({'user_id': [f"u{n}" for n in range(len(masks))], 'equipment_mask': masks})
+
+
+def run_query(my_gym, query):
+    with sqlite3.connect(':memory:') as db:
+        my_gym.to_sql('my_gym', db, index=False)
+        equipment.bridge_table(my_gym).to_sql('user_equipment', db, index=False)
+        pd.DataFrame({'equipment': equipment.EQUIPMENT}).to_sql('equipment_list', db, index=False)
+        return pd.read_sql_query(query, db).set_index('equipment')
+
+
+def test_counts_match_query_1(my_gym):
+    counts = equipment.equipment_counts(my_gym).set_index('equipment')
+    expected = run_query(my_gym, QUERY_1)
+    used = counts[counts['users'] > 0]
+    assert used['users'].to_dict() == expected['quantity'].to_dict()
+    # ROUND and numpy's round break ties differently, so allow one step of rounding
+    assert used['percentage_of_total'].to_dict() == pytest.approx(expected['percentage_of_total'].to_dict(), abs=0.011)
+
+
+def test_limited_counts_match_query_2(my_gym):
+    counts = equipment.equipment_counts(my_gym).set_index('equipment')
+    expected = run_query(my_gym, QUERY_2).loc[equipment.EQUIPMENT]
+    assert (my_gym['equipment_mask'] == 0).any()
+    assert counts['limited_users'].to_dict() == expected['quantity'].to_dict()
+    assert counts['percentage_of_limited'].to_dict() == pytest.approx(expected['percentage_of_total'].to_dict(), abs=0.011)
@@ -0,0 +1,47 @@
+"""
+A failed Auth listing must not leave a truncated export where processing looks for one.
+"""
+
+import os
+
+import pytest
+
+from fake_firebase import FakeAuth, Latency
+from fetch_auth_data import fetch_auth_data
+from synthetic import generate_users
+
+
+class FailingAuth(FakeAuth):
+    """Raises on the page that starts at `fail_at`."""
+
+    def __init__(self, auth_rows, fail_at):
+        super().__init__(auth_rows, Latency(0, 0))
+        self.fail_at = fail_at
+
+    def list_users(self, page_token=None, max_results=1000):
+        if int(page_token or 0) >= self.fail_at:
+            raise ConnectionError("quota exceeded")
+        return super().list_users(page_token, max_results)
+
+
+@pytest.fixture
+def auth_rows():
+    return [auth_row for _, _, auth_row in generate_users(250, seed=2)]
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_failed_listing_leaves_no_file(tmp_path, auth_rows, prefetch):
+    path = tmp_path / '2024-01-01.csv'
+    with pytest.raises(ConnectionError):
+        fetch_auth_data(FailingAuth(auth_rows, fail_at=100), str(path), batch_size=50, prefetch=prefetch)
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_listing_keeps_the_earlier_export(tmp_path, auth_rows):
+    path = tmp_path / '2024-01-01.csv'
+    fetch_auth_data(FakeAuth(auth_rows, Latency(0, 0)), str(path), batch_size=50)
+    written = path.read_text()
+    with pytest.raises(ConnectionError):
+        fetch_auth_data(FailingAuth(auth_rows, fail_at=100), str(path), batch_size=50)
+    assert os.listdir(tmp_path) == ['2024-01-01.csv']
+    assert path.read_text() == written
@@ -0,0 +1,31 @@
+"""
+Sharded `/users` reads must return every user, in the order a single read does.
+"""
+
+import pytest
+
+from fake_firebase import FakeDb, Latency
+from fetch_firebase_data import fetch_users, key_order, key_ranges
+
+# Integer-like keys sort first and numerically; the rest, including ones with
+# leading zeros or past 32 bits, sort as strings
+KEYS = ['-1', '0', '2', '10', '2147483647', '-2147483648', '2147483648', '007', '-0', '1e3', 'a10', 'a9',
+        'uuuuuuuuuuuuuuuu000000000001', '-NxYz12AbC', 'jR3UB09kczdJQtCGtKHHkHjhVVO2', 'Z']
+
+
+def test_key_order():
+    assert sorted(KEYS, key=key_order) == [
+        '-2147483648', '-1', '0', '2', '10', '2147483647',
+        '-0', '-NxYz12AbC', '007', '1e3', '2147483648', 'Z', 'a10', 'a9',
+        'jR3UB09kczdJQtCGtKHHkHjhVVO2', 'uuuuuuuuuuuuuuuu000000000001',
+    ]
+
+
+@pytest.mark.parametrize('shards', [1, 3, 5, len(KEYS)])
+def test_sharded_read_returns_every_user_in_order(shards):
+    users = {key: {'userInfo': {'email': f"{key}@example.com"}} for key in KEYS}
+    db = FakeDb(users, Latency(round_trip=0, per_user=0))
+    assert len(key_ranges(KEYS, shards)) <= shards
+    fetched = fetch_users(db, shards)
+    assert list(fetched) == sorted(KEYS, key=key_order)
+    assert fetched == users
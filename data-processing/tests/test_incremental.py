@@ -0,0 +1,101 @@
+"""
+An `--incremental` run must write the same CSVs as a `--full` run on the same snapshot.
+"""
+
+import csv
+import filecmp
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+import metrics
+import process_raw_to_csv
+from snapshot_store import SnapshotStore
+from synthetic import format_auth_row, generate_user, write_snapshot
+
+
+def run(*argv):
+    process_raw_to_csv.main(['--log-level', 'ERROR', '--state-file', 'incremental_state.pkl', *argv])
+
+
+def processed_csvs():
+    return sorted(name for name in os.listdir('data/processed') if name.endswith('.csv'))
+
+
+def next_snapshot(json_path, auth_path, snapshot_date):
+    """Write a snapshot one day on: one user changed, one deleted, one added and one newly flagged."""
+    with open(json_path) as f:
+        data = json.load(f)
+    with open(auth_path, newline='') as f:
+        auth_rows = list(csv.reader(f))
+
+    with_info = [user_id for user_id, record in data.items() if 'userInfo' in record]
+    changed, deleted, flagged = with_info[0], with_info[1], with_info[2]
+    info = data[changed]['userInfo']
+    info.update({'country': 'DE', 'height': 181.5, 'myGym': ['B', 'DA', 'KA']})
+    info.setdefault('latestReceiptInfo', []).append({
+        'product_id': 'klein_yearly', 'purchase_date_ms': '1700000000000',
+        'expires_date_ms': '1731536000000', 'original_purchase_date_ms': '1700000000000',
+    })
+    del data[deleted]
+    data[flagged]['userInfo']['email'] = 'tester@uat.com'
+    added, record, auth_row = generate_user(random.Random(1), len(data) + 1000)
+    data[added] = record
+    auth_rows.append(format_auth_row(auth_row))
+
+    json_path = os.path.join('data', 'raw', 'json', f"{snapshot_date}.json")
+    auth_path = os.path.join('data', 'raw', 'auth', f"{snapshot_date}.csv")
+    with open(json_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    with open(auth_path, 'w', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(row for row in auth_rows if row is not None)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(metrics.LEVEL_ENV, 'ERROR')  # set_level exports it; put it back afterwards
+    os.makedirs('data/processed')
+    return tmp_path
+
+
+def to_store(snapshot_date):
+    """Move a JSON snapshot into the snapshot store, as `fetch_firebase_data.py` would write it."""
+    json_path = os.path.join('data', 'raw', 'json', f"{snapshot_date}.json")
+    with open(json_path) as f:
+        SnapshotStore('data/raw/store').write(snapshot_date, json.load(f).items())
+    os.remove(json_path)
+
+
+@pytest.mark.parametrize('from_store', [False, True])
+def test_incremental_matches_full(workdir, from_store):
+    json_path, auth_path = write_snapshot(str(workdir), 400, seed=5, snapshot_date='2024-01-01')
+    if from_store:
+        to_store('2024-01-01')
+    run('--full')
+    if from_store:
+        with open(json_path, 'w') as f:
+            json.dump(dict(SnapshotStore('data/raw/store').iter_users()), f)
+    next_snapshot(json_path, auth_path, '2024-01-02')
+    if from_store:
+        to_store('2024-01-02')
+        os.remove(json_path)
+
+    run('--incremental')
+    with open('data/processed/metrics.json') as f:
+        delta = json.load(f)['counters']['Incremental']
+    assert (delta['changed'], delta['added'], delta['deleted']) == (2, 1, 1)
+    assert delta['reused_shards'] > 0 and delta['read_shards'] > 0
+    shutil.copytree('data/processed', 'incremental')
+    shutil.rmtree('data/processed')
+    os.makedirs('data/processed')
+    run('--full')
+
+    names = processed_csvs()
+    assert 'subscriptions.csv' in names and 'data_cleaning_audit.csv' in names
+    assert sorted(name for name in os.listdir('incremental') if name.endswith('.csv')) == names
+    _, mismatch, errors = filecmp.cmpfiles('incremental', 'data/processed', names, shallow=False)
+    assert not mismatch and not errors
@@ -0,0 +1,118 @@
+"""
+An `--incremental` load must leave the tables as a full load of the same CSVs would.
+"""
+
+import csv
+import os
+import sqlite3
+
+import pytest
+
+import load_to_db
+
+TABLES = ['auth_data', 'data_cleaning_audit']
+
+
+def write_csvs(auth_rows, audit_rows):
+    for table, rows in [('auth_data', auth_rows), ('data_cleaning_audit', audit_rows)]:
+        spec = load_to_db.TABLES[table]
+        with open(spec['csv'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in spec['columns']])
+            writer.writerows(rows)
+
+
+def first_snapshot():
+    auth_rows = [[f"u{n}", f"user{n}@example.com", '2024-01-01 10:00:00', ''] for n in range(20)]
+    # Each user's audit rows are spread over sections, and some rows have no user_id
+    audit_rows = [[f"u{n}", section, 'Processed', 'Valid data', f"{section} {n}"]
+                  for section in ['Subscriptions', 'User Profiles', 'My Gym'] for n in range(20)]
+    audit_rows += [['', 'Subscriptions', 'Skipped', 'Missing user_id', 'no id'],
+                   ['SUMMARY', 'Summary', 'Summary Stat', 'Users', '20']]
+    return auth_rows, audit_rows
+
+
+def next_snapshot(auth_rows, audit_rows):
+    """One user changed, one deleted, one added, one dropped from the audit and a new row without a user_id."""
+    auth_rows = [row for row in auth_rows if row[0] != 'u2'] + [['u99', 'new@example.com', '2024-01-02 09:00:00', '']]
+    auth_rows[1] = ['u1', 'changed@example.com', '2024-01-01 10:00:00', '2024-01-02 08:00:00']
+    audit_rows = [row for row in audit_rows if row[0] not in ('u2', 'u4')]
+    audit_rows = [row[:4] + ['edited'] if row[0] == 'u3' and row[1] == 'My Gym' else row for row in audit_rows]
+    audit_rows += [['u99', 'My Gym', 'Processed', 'Valid data', 'added'],
+                   ['', 'My Gym', 'Skipped', 'Missing user_id', 'no id either']]
+    return auth_rows, audit_rows
+
+
+def load(db_path, incremental=False, batch_size=7):
+    target = load_to_db.connect(f"sqlite:///{db_path}")
+    for table in TABLES:
+        load_to_db.load_table(target, table, load_to_db.TABLES[table], incremental, batch_size)
+    target.conn.close()
+
+
+def contents(db_path):
+    with sqlite3.connect(db_path) as conn:
+        tables = {table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall(), key=repr) for table in TABLES}
+        indexes = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return tables, indexes
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/processed')
+    return tmp_path
+
+
+@pytest.mark.parametrize('after_plain_load', [False, True])
+def test_incremental_matches_full(workdir, after_plain_load):
+    write_csvs(*first_snapshot())
+    load('incremental.sqlite', incremental=not after_plain_load)
+    load('incremental.sqlite', incremental=True)  # Nothing changed
+    write_csvs(*next_snapshot(*first_snapshot()))
+    load('incremental.sqlite', incremental=True)
+    load('full.sqlite')
+
+    tables, indexes = contents('incremental.sqlite')
+    full_tables, full_indexes = contents('full.sqlite')
+    assert tables == full_tables
+    assert ('u2', 'user2@example.com', '2024-01-01 10:00:00', None) not in tables['auth_data']
+    assert sum(row[0] is None for row in tables['data_cleaning_audit']) == 2
+    assert {f"idx_{table}_user_id" for table in TABLES} <= indexes
+    assert full_indexes == {f"idx_{table}_user_id" for table in TABLES}  # A plain load drops the hashes
+
+
+def test_only_changed_users_are_rewritten(workdir):
+    write_csvs(*first_snapshot())
+    load('incremental.sqlite', incremental=True)
+    write_csvs(*next_snapshot(*first_snapshot()))
+    target = load_to_db.connect('sqlite:///incremental.sqlite')
+    # u1 and u99 in auth_data; u3's three rows, u99's and both rows without a user_id in the audit
+    assert load_to_db.load_table(target, 'auth_data', load_to_db.TABLES['auth_data'], incremental=True) == 2
+    assert load_to_db.load_table(target, 'data_cleaning_audit', load_to_db.TABLES['data_cleaning_audit'],
+                                 incremental=True) == 6
+
+
+def test_failed_load_keeps_the_previous_table(workdir, monkeypatch):
+    write_csvs(*first_snapshot())
+    load('db.sqlite')
+    before = contents('db.sqlite')
+    write_csvs(*next_snapshot(*first_snapshot()))
+
+    read_rows = load_to_db.read_rows
+
+    def failing_read_rows(csv_path):
+        for n, row in enumerate(read_rows(csv_path)):
+            if n == 10:
+                raise OSError("disk full")
+            yield row
+
+    monkeypatch.setattr(load_to_db, 'read_rows', failing_read_rows)
+    with pytest.raises(OSError):
+        load('db.sqlite')
+    assert contents('db.sqlite') == before
+
+    monkeypatch.setattr(load_to_db, 'read_rows', read_rows)
+    load('db.sqlite', incremental=True)
+    load('full.sqlite')
+    assert contents('db.sqlite')[0] == contents('full.sqlite')[0]
@@ -0,0 +1,72 @@
+"""
+TableBuilder must write the same CSVs as the per-row `df.loc[len(df)] = row` appends it replaced.
+"""
+
+import json
+import random
+
+import pandas as pd
+import pytest
+
+import table_builder
+from extractors import MyGymExtractor, SubscriptionsExtractor, UserProfilesExtractor, dispatch_user
+from synthetic import write_snapshot
+from table_builder import TableBuilder
+from user_store import UserStore
+
+
+@pytest.fixture(scope='module')
+def raw_rows(tmp_path_factory):
+    """Each table's rows as the extractors produce them, before any typed column sees them."""
+    json_path, auth_path = write_snapshot(tmp_path_factory.mktemp('snapshot'), 600, seed=3)
+    with open(json_path) as f:
+        data = json.load(f)
+    auth_data = pd.read_csv(auth_path)
+    auth_data.columns = ['user_id', 'email', 'creation_date', 'last_sign_in']
+    extractors = [SubscriptionsExtractor(), UserProfilesExtractor(),
+                  MyGymExtractor(UserStore(auth_data), join_creation_dates=False)]
+    for extractor in extractors:
+        extractor.table = TableBuilder(extractor.columns)  # Plain lists keep the values as they came
+    for user_id, record in data.items():
+        dispatch_user(user_id, record, extractors)
+    return {type(extractor): (extractor.columns, extractor.kinds, extractor.table.rows()) for extractor in extractors}
+
+
+def loc_append_csv(columns, rows):
+    frame = pd.DataFrame(columns=columns)
+    for row in rows:
+        frame.loc[len(frame)] = list(row)
+    return frame.to_csv(index=False)
+
+
+@pytest.mark.parametrize('extractor', [SubscriptionsExtractor, UserProfilesExtractor, MyGymExtractor])
+@pytest.mark.parametrize('chunk_rows', [table_builder.CHUNK_ROWS, 7])
+def test_same_csv_as_loc_append(raw_rows, extractor, chunk_rows, monkeypatch):
+    monkeypatch.setattr(table_builder, 'CHUNK_ROWS', chunk_rows)
+    columns, kinds, rows = raw_rows[extractor]
+    assert rows
+    builder = TableBuilder(columns, kinds)
+    builder.extend(rows)
+    assert builder.to_frame().to_csv(index=False) == loc_append_csv(columns, rows)
+
+
+def test_values_that_dont_fit_a_typed_column():
+    columns = ['user_id', 'purchase_date', 'product_id']
+    rows = [['a', '1690000000000', 'monthly'], ['b', None, None], ['c', '0123', ['not', 'hashable']],
+            ['d', 'invalid', 1], ['e', 1690000000000, '1']]
+    builder = TableBuilder(columns, {'purchase_date': 'int', 'product_id': 'category'})
+    builder.extend(rows)
+    assert builder.to_frame().to_csv(index=False) == loc_append_csv(columns, rows)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_mixed_types_cast_like_loc_append(seed):
+    # Free-form fields such as height mix ints, floats, bools, strings and missing values.
+    # JSON has no NaN, so it isn't in the pool
+    rng = random.Random(seed)
+    pool = [158, 0, 2 ** 70, 166.9, 1.0, True, False, "5'11", '158', '', None]
+    columns = ['user_id', 'height', 'level']
+    rows = [[f"u{n}", rng.choice(pool[:rng.randint(1, len(pool))]), rng.choice(pool)] for n in range(rng.randint(1, 12))]
+    builder = TableBuilder(columns, {'level': 'category'})
+    builder.extend(rows)
+    assert builder.to_frame().to_csv(index=False) == loc_append_csv(columns, rows)